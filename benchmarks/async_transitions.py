@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###########################################################################
+#                       Async Transition Benchmark                        #
+###########################################################################
+
+# Requests per second and latency percentiles of the ride transition
+# endpoints through Django's ASGI handler: the DRF actions
+# (ride/<pk>/accept/ ...) against riders.async_views
+# (async/ride/<pk>/accept/ ...).
+#
+#   python benchmarks/async_transitions.py --rides 200 --concurrency 50
+#   python benchmarks/async_transitions.py --sqlite
+#
+# Every ride goes accept -> pickup -> complete; `concurrency` rides are in
+# flight at once, each with its own rider. Without --sqlite it uses the
+# configured database and deletes the rows it created afterwards.
+
+SYNC_PREFIX = "/api/riders/ride/{}/"
+ASYNC_PREFIX = "/api/riders/async/ride/{}/"
+
+
+def setup_django(sqlite):
+    import django
+    from django.conf import settings
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+    settings.ALLOWED_HOSTS = ["*"]
+    if sqlite:
+        settings.DATABASES = {
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(tempfile.mkdtemp(prefix="transitions-bench-"), "db.sqlite3"),
+            }
+        }
+    django.setup()
+
+    if sqlite:
+        from django.core.management import call_command
+        call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def create_fixtures(riders_count):
+    from rest_framework_simplejwt.tokens import RefreshToken
+    from riders.models import RiderProfile, Vehicle
+
+    user = RiderProfile.objects.create(
+        name="bench user", email="bench-user@example.com", phone="0",
+        role="USER", latitude=23.0225, longitude=72.5714
+    )
+    riders = []
+    for index in range(riders_count):
+        rider = RiderProfile.objects.create(
+            name=f"bench rider {index}", email=f"bench-rider-{index}@example.com", phone="0",
+            role="RIDER", latitude=23.0225, longitude=72.5714
+        )
+        Vehicle.objects.create(rider=rider, vehicle_number=f"BENCH{index}", vehicle_type="CAR")
+        riders.append((rider, str(RefreshToken.for_user(rider).access_token)))
+    return user, riders
+
+
+def create_rides(user, count):
+    from riders.models import Ride
+
+    return [
+        Ride.objects.create(
+            user=user, user_name=user.name, user_phone=user.phone,
+            pickup_location="A", pickup_latitude=23.0225, pickup_longitude=72.5714,
+            drop_location="B", drop_latitude=23.0325, drop_longitude=72.5814,
+            vehicle_type="CAR", charges=100
+        ).id
+        for _ in range(count)
+    ]
+
+
+async def rider_loop(client, prefix, token, ride_ids, latencies, failures):
+    headers = {"Authorization": f"Bearer {token}"}
+    while ride_ids:
+        ride_id = ride_ids.pop()
+        for step in ("accept", "pickup", "complete"):
+            started = time.perf_counter()
+            response = await client.post(prefix.format(ride_id) + f"{step}/", headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures.append((step, response.status_code))
+
+
+async def run(prefix, riders, ride_ids):
+    from django.test import AsyncClient
+
+    client = AsyncClient()
+    latencies = []
+    failures = []
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        rider_loop(client, prefix, token, ride_ids, latencies, failures)
+        for _, token in riders
+    ])
+    return time.perf_counter() - started, latencies, failures
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, elapsed, latencies, failures):
+    print(
+        f"{name:<18} {len(latencies):>6} requests  {len(latencies) / elapsed:>8,.0f} req/s  "
+        f"p50 {percentile(latencies, 0.50) * 1000:>7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:>7.1f} ms"
+        + (f"  {len(failures)} failed" if failures else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sqlite", action="store_true")
+    args = parser.parse_args()
+
+    setup_django(args.sqlite)
+    from riders.models import Ride
+
+    user, riders = create_fixtures(args.concurrency)
+    try:
+        for name, prefix in (("DRF (sync)", SYNC_PREFIX), ("async views", ASYNC_PREFIX)):
+            ride_ids = create_rides(user, args.rides)
+            report(name, *asyncio.run(run(prefix, riders, ride_ids)))
+    finally:
+        Ride.objects.filter(user=user).delete()
+        for rider, _ in riders:
+            rider.delete()
+        user.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###########################################################################
+#                       Channel Layer Benchmark                           #
+###########################################################################
+
+# Compares group_send throughput of InMemoryChannelLayer (one process) with
+# LocalSocketChannelLayer spread over several worker processes.
+#
+#   python benchmarks/channel_layers.py --messages 20000 --workers 4
+#
+# Every receiver joins the same group and counts what it gets; the result is
+# messages delivered per second across all receivers and the time until the
+# last receiver has seen the last message.
+
+GROUP = "bench"
+
+
+def setup_django():
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(USE_TZ=True)
+        django.setup()
+
+
+def payload():
+    return {
+        "type": "rides_update",
+        "data": {
+            "status": True,
+            "message": "Nearby Rides are",
+            "data": {"id": 1, "pickup_latitude": "23.022500", "pickup_longitude": "72.571400", "charges": 150}
+        }
+    }
+
+
+async def receive_all(layer, channel, count):
+    for _ in range(count):
+        await layer.receive(channel)
+
+
+async def bench_in_memory(messages, receivers):
+    from channels.layers import InMemoryChannelLayer
+
+    layer = InMemoryChannelLayer(capacity=messages)
+    channels = []
+    for _ in range(receivers):
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        channels.append(channel)
+
+    started = time.perf_counter()
+    consumers = [asyncio.ensure_future(receive_all(layer, channel, messages)) for channel in channels]
+    message = payload()
+    for _ in range(messages):
+        await layer.group_send(GROUP, message)
+    await asyncio.gather(*consumers)
+    return time.perf_counter() - started
+
+
+def socket_worker(path, messages, ready, done):
+    setup_django()
+    from riders.layers import LocalSocketChannelLayer
+
+    async def main():
+        layer = LocalSocketChannelLayer(path=path, capacity=messages)
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        ready.set()
+        await receive_all(layer, channel, messages)
+        done.put(time.monotonic())
+        await layer.close()
+
+    asyncio.run(main())
+
+
+async def bench_local_socket(messages, workers):
+    from riders.layers import LocalSocketChannelLayer
+
+    path = tempfile.mkdtemp(prefix="channels-bench-")
+    context = multiprocessing.get_context("spawn")
+    done = context.Queue()
+    processes = []
+    for _ in range(workers):
+        ready = context.Event()
+        process = context.Process(target=socket_worker, args=(path, messages, ready, done))
+        process.start()
+        ready.wait()
+        processes.append(process)
+
+    layer = LocalSocketChannelLayer(path=path)
+    message = payload()
+    started = time.monotonic()
+    for _ in range(messages):
+        await layer.group_send(GROUP, message)
+    # Wait off the loop so it can keep flushing the peer sockets.
+    loop = asyncio.get_running_loop()
+    finished = max([await loop.run_in_executor(None, done.get) for _ in processes])
+    await layer.close()
+
+    for process in processes:
+        process.join()
+    return finished - started
+
+
+def report(name, elapsed, messages, receivers):
+    delivered = messages * receivers
+    print(f"{name:<24} {receivers:>3} receivers  {elapsed * 1000:>9.1f} ms  {delivered / elapsed:>12,.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    setup_django()
+    report("InMemoryChannelLayer", asyncio.run(bench_in_memory(args.messages, args.workers)), args.messages, args.workers)
+    report("LocalSocketChannelLayer", asyncio.run(bench_local_socket(args.messages, args.workers)), args.messages, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###########################################################################
+#                       WebSocket Unit Of Work Benchmark                  #
+###########################################################################
+
+# Messages per second one worker handles when every ORM call of a WebSocket
+# message is its own sync_to_async hop, against riders.db.unit_of_work (one
+# hop and one transaction per message). Both run the accept / hand back
+# handlers' database work on the same rides followed by one group_send.
+#
+#   python benchmarks/ws_unit_of_work.py --sockets 50 --messages 200
+#   python benchmarks/ws_unit_of_work.py --sqlite
+#
+# Without --sqlite it uses the configured database and deletes the rows it
+# created afterwards.
+
+
+def setup_django(sqlite):
+    import django
+    from django.conf import settings
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+    if sqlite:
+        settings.DATABASES = {
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(tempfile.mkdtemp(prefix="ws-bench-"), "db.sqlite3"),
+            }
+        }
+    django.setup()
+
+    if sqlite:
+        from django.core.management import call_command
+        call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def create_fixtures(sockets):
+    from riders.models import Ride, RiderProfile
+
+    user = RiderProfile.objects.create(
+        name="bench user", email="bench-user@example.com", phone="0",
+        role="USER", latitude=23.0225, longitude=72.5714
+    )
+    riders = [
+        RiderProfile.objects.create(
+            name=f"bench rider {index}", email=f"bench-rider-{index}@example.com", phone="0",
+            role="RIDER", latitude=23.0225, longitude=72.5714
+        )
+        for index in range(sockets)
+    ]
+    rides = [
+        Ride.objects.create(
+            user=user, user_name=user.name, user_phone=user.phone,
+            pickup_location="A", pickup_latitude=23.0225, pickup_longitude=72.5714,
+            drop_location="B", drop_latitude=23.0325, drop_longitude=72.5814,
+            vehicle_type="bike", charges=100
+        )
+        for _ in range(sockets)
+    ]
+    return user, riders, rides
+
+
+# Same database work as RideConsumer.accept_ride / decline_ride: flip the
+# ride between requested and accepted, then read what the reply needs.
+def handle(ride_id, rider_id, accept):
+    from riders.models import Ride, RiderProfile
+    from riders.transitions import transition
+
+    if accept:
+        changed = transition(ride_id, "accepted", expected=["requested"], rider_id=rider_id, otp="123456")
+        RiderProfile.objects.filter(id=rider_id).update(is_available=False)
+    else:
+        changed = transition(ride_id, "requested", where={"rider_id": rider_id}, rider_id=None, otp=None)
+        RiderProfile.objects.filter(id=rider_id).update(is_available=True)
+    return Ride.objects.get(id=ride_id), changed
+
+
+async def multi_hop(ride_id, rider_id, accept):
+    from asgiref.sync import sync_to_async
+    from riders.models import Ride, RiderProfile
+    from riders.transitions import transition
+
+    if accept:
+        changed = await sync_to_async(transition)(ride_id, "accepted", expected=["requested"], rider_id=rider_id, otp="123456")
+        await sync_to_async(RiderProfile.objects.filter(id=rider_id).update)(is_available=False)
+    else:
+        changed = await sync_to_async(transition)(ride_id, "requested", where={"rider_id": rider_id}, rider_id=None, otp=None)
+        await sync_to_async(RiderProfile.objects.filter(id=rider_id).update)(is_available=True)
+    return await sync_to_async(Ride.objects.get)(id=ride_id), changed
+
+
+async def socket(layer, handler, ride_id, rider_id, messages):
+    for index in range(messages):
+        ride, _ = await handler(ride_id, rider_id, index % 2 == 0)
+        await layer.group_send(f"user_{ride.user_id}", {"type": "ride_accepted", "data": {"ride_id": ride.id}})
+
+
+async def run(handler, rides, riders, messages):
+    from channels.layers import InMemoryChannelLayer
+
+    layer = InMemoryChannelLayer()
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        socket(layer, handler, ride.id, rider.id, messages)
+        for ride, rider in zip(rides, riders)
+    ])
+    return time.perf_counter() - started
+
+
+def report(name, elapsed, total):
+    print(f"{name:<24} {total:>7} messages  {elapsed * 1000:>9.1f} ms  {total / elapsed:>10,.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--sqlite", action="store_true")
+    args = parser.parse_args()
+
+    setup_django(args.sqlite)
+    from riders.db import unit_of_work
+
+    user, riders, rides = create_fixtures(args.sockets)
+    total = args.sockets * args.messages
+    try:
+        report("sync_to_async per call", asyncio.run(run(multi_hop, rides, riders, args.messages)), total)
+        report("unit_of_work", asyncio.run(run(unit_of_work(handle), rides, riders, args.messages)), total)
+    finally:
+        for rider in riders:
+            rider.delete()
+        user.delete()
+
+
+if __name__ == "__main__":
+    main()
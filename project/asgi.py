@@ -11,14 +11,14 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from riders.routing import websocket_urlpatterns
-from channels.auth import AuthMiddlewareStack
+from riders.middleware import ServerLoopMiddleware, TokenAuthMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = ProtocolTypeRouter({
+application = ServerLoopMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": TokenAuthMiddleware(
         URLRouter(websocket_urlpatterns)
         ),
-})
+}))
 
@@ -129,12 +129,25 @@ DATABASES = {
         'PASSWORD': 'your_password',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Keep connections open between calls (seconds) and ping a reused
+        # connection before its first query.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'riders.authentication.TokenPrincipalAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'riders.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'riders.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 }
 
@@ -155,9 +168,113 @@ SIMPLE_JWT = {
 
 AUTH_USER_MODEL = "riders.RiderProfile"
 
+# Run a single ASGI worker: the available riders and open rides indexes,
+# the availability stream version, the location buffer, batch dispatch and
+# the principal cache all live in that process. riders.layers.
+# LocalSocketChannelLayer can share group sends between workers on one
+# machine, but does not replicate that state; it is opt-in until that state
+# is shared too:
+#
+#     "BACKEND": "riders.layers.LocalSocketChannelLayer",
+#     "CONFIG": {"path": "/run/ridebooking/channels"},
 CHANNEL_LAYERS ={
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
 
 }
+
+
+# Size (in degrees) of the grid cells used by the in-memory geo indexes.
+GEO_INDEX_CELL_DEGREES = 0.02
+
+# Nearest-rider search: start at NEAREST_RIDERS_START_RADIUS_KM and double
+# the radius until NEAREST_RIDERS_LIMIT riders are found or the radius
+# reaches NEAREST_RIDERS_MAX_RADIUS_KM.
+NEAREST_RIDERS_LIMIT = 20
+NEAREST_RIDERS_START_RADIUS_KM = 1
+NEAREST_RIDERS_MAX_RADIUS_KM = 10
+
+# Requested rides a rider sees on connect.
+NEARBY_RIDES_RADIUS_KM = 5
+NEARBY_RIDES_LIMIT = 50
+
+# New ride dispatch: "broadcast" offers every ride to all nearest riders as
+# soon as it is created; "batch" collects rides for RIDE_BATCH_WINDOW_SECONDS
+# and sends each matched rider a single offer from a global assignment.
+# Rides still open after RIDE_BATCH_MAX_ROUNDS windows fall back to a
+# broadcast. The assignment runs on RIDE_BATCH_SOLVER_WORKERS threads.
+RIDE_DISPATCH_MODE = "broadcast"
+RIDE_BATCH_WINDOW_SECONDS = 2
+RIDE_BATCH_CANDIDATES = 10
+RIDE_BATCH_MAX_ROUNDS = 5
+RIDE_BATCH_SOLVER_WORKERS = 2
+
+# How many rider changes the availability stream remembers for delta
+# resyncs; clients further behind get a full snapshot.
+AVAILABILITY_CHANGE_LOG_SIZE = 100000
+
+# Most map tiles one availability socket may subscribe to at once.
+AVAILABILITY_MAX_TILES = 64
+
+# Most concurrent group sends when offering a new ride to nearby riders.
+RIDE_FANOUT_CONCURRENCY = 50
+
+# Availability and ride-list broadcasts triggered by ride transitions are
+# coalesced and sent at most once per interval (seconds).
+BROADCAST_COALESCE_INTERVAL = 0.25
+
+# Rider GPS pings are buffered in memory and written to the database in
+# batches every LOCATION_FLUSH_INTERVAL seconds; no ping stays unwritten for
+# longer than LOCATION_MAX_STALENESS seconds.
+LOCATION_FLUSH_INTERVAL = 5
+LOCATION_MAX_STALENESS = 10
+LOCATION_FLUSH_BATCH_SIZE = 500
+
+# GPS points kept in memory per rider for heading, speed and reconnect
+# catch-up (16 bytes each). A rider's trail is dropped after TRAIL_IDLE_TTL
+# seconds without a ping.
+TRAIL_POINTS = 120
+TRAIL_IDLE_TTL = 600
+
+# Requested rides are closed after RIDE_REQUEST_TIMEOUT seconds. Timeouts
+# live on a timing wheel of RIDE_TIMEOUT_SLOTS buckets, RIDE_TIMEOUT_TICK
+# seconds each.
+RIDE_REQUEST_TIMEOUT = 300
+RIDE_TIMEOUT_TICK = 1
+RIDE_TIMEOUT_SLOTS = 512
+
+# Stale ride requests are also swept from the database every
+# RIDE_EXPIRY_SWEEP_INTERVAL seconds, at most RIDE_EXPIRY_BATCH_SIZE rides
+# per UPDATE.
+RIDE_EXPIRY_SWEEP_INTERVAL = 30
+RIDE_EXPIRY_BATCH_SIZE = 5000
+
+# ORM work on the ASGI path runs on DB_EXECUTOR_WORKERS threads (one
+# database connection each). Once DB_EXECUTOR_MAX_QUEUE calls are waiting,
+# WebSocket messages are answered "busy" instead of queueing.
+DB_EXECUTOR_WORKERS = 8
+DB_EXECUTOR_MAX_QUEUE = 200
+# Seconds between the connection age / health checks on each of those
+# threads (a call that raised is always followed by one).
+DB_EXECUTOR_CONNECTION_CHECK = 30
+
+# request.user is a riders.authentication.TokenPrincipal built from the
+# role and vehicle claims of the access token. Those claims are trusted for
+# PRINCIPAL_CACHE_TTL seconds after the token was issued, then read from
+# the database and cached for as long in a per-process cache of
+# PRINCIPAL_CACHE_SIZE users (0 disables it). Profile and vehicle changes
+# also mark the user stale there.
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL = 60
+
+# Password hashing (login, signup, password change) runs on
+# PASSWORD_HASH_WORKERS threads. Once PASSWORD_HASH_MAX_QUEUE hashes are
+# waiting, those requests are answered 503 with Retry-After.
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_MAX_QUEUE = 32
+
+# List endpoints (profiles, vehicles, rides, payments) answer LIST_PAGE_SIZE
+# rows per page by default; ?page_size= can ask for up to LIST_MAX_PAGE_SIZE.
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
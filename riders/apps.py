@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class RidersConfig(AppConfig):
     name = 'riders'
+
+    def ready(self):
+        from riders import authentication, locations
+
+        authentication.connect_signals()
+        locations.connect_signals()
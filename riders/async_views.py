@@ -0,0 +1,317 @@
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+from riders.encoding import dumpb, loads
+from riders.models import RiderProfile, Ride
+from riders.serializers import LoginSerializer, RiderProfileSerializer, RideSerializer
+from riders.utils import index_rider, index_ride
+from riders.geo import available_riders
+from riders.dispatch import batch_dispatcher
+from riders.timeouts import ride_timeouts
+from riders.transitions import atransition
+from riders.broadcasts import broadcast_scheduler
+from riders.hashing import HashingBusy, password_hasher
+from riders.db import DatabaseBusy, database_sync_to_async
+
+###########################################################################
+#                       Async Ride Transition Module                      #
+###########################################################################
+
+# Async versions of RideViewSet.accept / pickup / decline / complete for the
+# ASGI deployment. They answer with the same status codes and
+# {"status", "message", "data"} bodies, but run on the event loop: the ORM
+# calls are Django's async ones and the broadcasts are requested straight on
+# the server loop, so a request never parks a sync thread.
+
+def respond(ok, message, data=None, http_status=status.HTTP_200_OK):
+    return HttpResponse(
+        dumpb({"status": ok, "message": message, "data": data}),
+        content_type="application/json",
+        status=http_status
+    )
+
+
+# Bearer token -> riders.authentication.TokenPrincipal, or None.
+async def authenticate(request):
+    from rest_framework.exceptions import AuthenticationFailed
+    from riders.authentication import TokenPrincipalAuthentication, aprincipal_for_token
+
+    authentication = TokenPrincipalAuthentication()
+    try:
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        return await aprincipal_for_token(authentication.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return None
+
+
+def not_authenticated():
+    return respond(False, "Authentication credentials were not provided.", http_status=status.HTTP_401_UNAUTHORIZED)
+
+
+def server_busy():
+    response = respond(False, "Server busy, please try again", http_status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response["Retry-After"] = "1"
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def accept_ride(request, pk):
+    user = await authenticate(request)
+    if user is None:
+        return not_authenticated()
+
+    if user.role not in ["RIDER", "ADMIN"]:
+        return respond(False, "You do not have permission", http_status=status.HTTP_401_UNAUTHORIZED)
+
+    if not user.has_vehicle:
+        return respond(False, "You must have a registered vehicle to accept rides.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        ride = await Ride.objects.aget(pk=pk)
+    except Ride.DoesNotExist:
+        return respond(False, "Ride not found or not assigned to you", http_status=status.HTTP_404_NOT_FOUND)
+
+    if user.vehicle_type != ride.vehicle_type:
+        return respond(False, f"You do not have {ride.vehicle_type} to accept this ride.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    if not await atransition(ride.id, 'accepted', rider_id=user.id):
+        await ride.arefresh_from_db(fields=['status'])
+        return respond(False, f"Cannot accept ride with status '{ride.status}'", http_status=status.HTTP_400_BAD_REQUEST)
+
+    ride.rider_id = user.id
+    ride.status = 'accepted'
+    index_ride(ride)
+    batch_dispatcher.discard(ride.id)
+    ride_timeouts.cancel(ride.id)
+
+    await RiderProfile.objects.filter(pk=user.pk).aupdate(is_available=False)
+    available_riders.remove(user.pk)
+
+    broadcast_scheduler.request(availability=True)
+
+    return respond(True, "Ride accepted", RideSerializer(ride).data)
+
+
+@csrf_exempt
+@require_POST
+async def pickup_ride(request, pk):
+    user = await authenticate(request)
+    if user is None:
+        return not_authenticated()
+
+    if user.role not in ["RIDER", "ADMIN"]:
+        return respond(False, "You do not have permission", http_status=status.HTTP_401_UNAUTHORIZED)
+
+    if not user.has_vehicle:
+        return respond(False, "You must have a registered vehicle to complete rides.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        ride = await Ride.objects.aget(pk=pk)
+    except Ride.DoesNotExist:
+        return respond(False, "Ride not found or not assigned to you", http_status=status.HTTP_404_NOT_FOUND)
+
+    if user.vehicle_type != ride.vehicle_type:
+        return respond(False, f"You do not have {ride.vehicle_type} to pick up this ride.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    if not await atransition(ride.id, 'picked_up', where={'rider_id': user.id}):
+        await ride.arefresh_from_db(fields=['status', 'rider'])
+        if ride.rider_id != user.id:
+            return respond(False, "Ride not found or not assigned to you", http_status=status.HTTP_404_NOT_FOUND)
+        return respond(False, f"Cannot pick up ride with status '{ride.status}'", http_status=status.HTTP_400_BAD_REQUEST)
+
+    ride.status = 'picked_up'
+
+    return respond(True, "Ride Picked up", RideSerializer(ride).data)
+
+
+@csrf_exempt
+@require_POST
+async def decline_ride(request, pk):
+    user = await authenticate(request)
+    if user is None:
+        return not_authenticated()
+
+    allowed_status = ['requested', 'accepted']
+
+    try:
+        ride = await Ride.objects.select_related("rider__vehicle").aget(pk=pk)
+    except Ride.DoesNotExist:
+        return respond(False, "Ride not found", http_status=status.HTTP_404_NOT_FOUND)
+
+    if ride.status not in allowed_status:
+        return respond(False, f"Cannot decline ride with status '{ride.status}'", http_status=status.HTTP_400_BAD_REQUEST)
+
+    if user.role == "RIDER":
+        if not user.has_vehicle:
+            return respond(False, "You must have a registered vehicle to decline rides.", http_status=status.HTTP_400_BAD_REQUEST)
+
+        if ride.rider_id != user.id:
+            return respond(False, "Ride not assigned to you.", http_status=status.HTTP_403_FORBIDDEN)
+
+    elif user.role == "USER":
+        if ride.user_id != user.id:
+            return respond(False, "You are not allowed to decline this ride.", http_status=status.HTTP_403_FORBIDDEN)
+
+    elif user.role == "ADMIN":
+        pass
+
+    else:
+        return respond(False, "You do not have permission to perform this action.", http_status=status.HTTP_403_FORBIDDEN)
+
+    where = {'rider_id': ride.rider_id} if ride.status == 'accepted' else None
+    if not await atransition(ride.id, 'declined', expected=[ride.status], where=where):
+        await ride.arefresh_from_db(fields=['status'])
+        return respond(False, f"Cannot decline ride with status '{ride.status}'", http_status=status.HTTP_400_BAD_REQUEST)
+
+    if ride.status == 'accepted' and ride.rider:
+        ride.rider.is_available = True
+        await ride.rider.asave(update_fields=['is_available'])
+        index_rider(ride.rider)
+
+    ride.status = 'declined'
+    index_ride(ride)
+    batch_dispatcher.discard(ride.id)
+    ride_timeouts.cancel(ride.id)
+
+    broadcast_scheduler.request(availability=True)
+
+    return respond(True, "Ride declined", RideSerializer(ride).data)
+
+
+@csrf_exempt
+@require_POST
+async def complete_ride(request, pk):
+    user = await authenticate(request)
+    if user is None:
+        return not_authenticated()
+
+    if user.role not in ["RIDER", "ADMIN"]:
+        return respond(False, "You do not have permission", http_status=status.HTTP_401_UNAUTHORIZED)
+
+    if not user.has_vehicle:
+        return respond(False, "You must have a registered vehicle to complete rides.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        ride = await Ride.objects.aget(pk=pk, rider_id=user.id)
+    except Ride.DoesNotExist:
+        return respond(False, "Ride not found or not assigned to you", http_status=status.HTTP_404_NOT_FOUND)
+
+    if not await atransition(ride.id, 'completed', where={'rider_id': user.id}):
+        await ride.arefresh_from_db(fields=['status'])
+        return respond(False, f"Cannot complete ride with status '{ride.status}'", http_status=status.HTTP_400_BAD_REQUEST)
+
+    ride.status = 'completed'
+    index_ride(ride)
+
+    # Make rider available again
+    rider_profile = await user.aprofile()
+    rider_profile.is_available = True
+    await rider_profile.asave(update_fields=['is_available'])
+    index_rider(rider_profile)
+
+    broadcast_scheduler.request(availability=True)
+
+    return respond(True, "Ride completed", RideSerializer(ride).data)
+
+
+###########################################################################
+#                       Async Login Module                                #
+###########################################################################
+
+# LoginViewSet.post and RiderProfileViewSet.create on the event loop: the
+# password hashing waits on the hashing pool without holding a request
+# thread, and a full pool answers 503 with Retry-After like the sync views.
+# Under ASGI every sync view shares one thread, so a burst of logins on the
+# sync endpoints still queues the other sync views behind the hashing;
+# these are the ones to use there.
+@csrf_exempt
+@require_POST
+async def login(request):
+    from riders.authentication import principal_token
+    from riders.views import login_error_message
+
+    try:
+        data = loads(request.body or b"{}")
+    except ValueError:
+        return respond(False, "Invalid JSON body", http_status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = LoginSerializer(data=data)
+    if not serializer.is_valid():
+        return respond(False, login_error_message(serializer.errors), http_status=status.HTTP_400_BAD_REQUEST)
+
+    email = serializer.validated_data.get("email")
+    password = serializer.validated_data.get("password")
+
+    try:
+        rider = await RiderProfile.objects.select_related("vehicle").aget(email=email)
+    except RiderProfile.DoesNotExist:
+        return respond(False, "User not exists.", http_status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        matches, upgraded = await password_hasher.averify(password, rider.password)
+    except HashingBusy:
+        return server_busy()
+
+    if not matches:
+        return respond(False, "Invalid Password", http_status=status.HTTP_400_BAD_REQUEST)
+
+    # Stored with an outdated hasher: keep the new hash.
+    if upgraded:
+        await RiderProfile.objects.filter(pk=rider.pk).aupdate(password=upgraded)
+
+    refresh = principal_token(rider)
+
+    return respond(True, "Login Successful", {
+        "id": rider.id,
+        "name": rider.name,
+        "email": rider.email,
+        "role": rider.role,
+        "tokens": {
+            "access": str(refresh.access_token),
+            "refresh": str(refresh)
+        }
+    })
+
+
+def _signup_checks(data):
+    from riders.views import signup_error
+
+    error = signup_error(data)
+    if error is not None:
+        return error, None
+    serializer = RiderProfileSerializer(data=data, context={"password_hashed": True})
+    if not serializer.is_valid():
+        return ({"success": False, "message": serializer.errors, "data": None}, status.HTTP_400_BAD_REQUEST), None
+    return None, serializer
+
+
+def _signup_save(serializer, password):
+    serializer.save(password=password)
+    return serializer.data
+
+
+@csrf_exempt
+@require_POST
+async def signup(request):
+    try:
+        data = loads(request.body or b"{}")
+    except ValueError:
+        return respond(False, "Invalid JSON body", http_status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        error, serializer = await database_sync_to_async(_signup_checks)(data)
+        if error is not None:
+            body, http_status = error
+            return HttpResponse(dumpb(body), content_type="application/json", status=http_status)
+
+        password = await password_hasher.amake(serializer.validated_data["password"])
+        profile = await database_sync_to_async(_signup_save)(serializer, password)
+    except (DatabaseBusy, HashingBusy):
+        return server_busy()
+
+    return respond(True, f"{data['role'].capitalize()} created successfully", profile, http_status=status.HTTP_201_CREATED)
@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+MISSING = object()
+STALE = object()
+
+###########################################################################
+#                       Token Principal Module                            #
+###########################################################################
+
+# The authenticated caller as request.user, built from the signed claims of
+# the access token (user id, role and the rider's vehicle type) instead of a
+# RiderProfile row, so permission checks cost no query. Code that needs the
+# full profile (name, phone, location) asks for .profile, which loads it
+# once.
+class TokenPrincipal:
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, id, role, vehicle_type=None):
+        self.id = self.pk = id
+        self.role = role
+        self.vehicle_type = vehicle_type
+        self._profile = None
+
+    def __str__(self):
+        return f"{self.role} {self.id}"
+
+    @property
+    def has_vehicle(self):
+        return self.vehicle_type is not None
+
+    @property
+    def profile(self):
+        from riders.models import RiderProfile
+
+        if self._profile is None:
+            self._profile = RiderProfile.objects.select_related("vehicle").get(pk=self.id)
+        return self._profile
+
+    async def aprofile(self):
+        from riders.models import RiderProfile
+
+        if self._profile is None:
+            self._profile = await RiderProfile.objects.select_related("vehicle").aget(pk=self.id)
+        return self._profile
+
+
+# The claims a RiderProfile's tokens carry besides its id.
+def principal_claims(rider):
+    from riders.models import Vehicle
+
+    try:
+        vehicle_type = rider.vehicle.vehicle_type
+    except Vehicle.DoesNotExist:
+        vehicle_type = None
+    return {"role": rider.role, "vehicle_type": vehicle_type}
+
+
+# RefreshToken for a login; its access token copies the principal claims.
+def principal_token(rider):
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    refresh = RefreshToken.for_user(rider)
+    for claim, value in principal_claims(rider).items():
+        refresh[claim] = value
+    return refresh
+
+
+###########################################################################
+#                       Principal Cache Module                            #
+###########################################################################
+
+# Claims are fixed when a token is issued, so a role or vehicle change would
+# only show up at the next login. Token claims are therefore trusted for
+# PRINCIPAL_CACHE_TTL seconds after the token was issued; after that the
+# claims are read from the database and cached here for another
+# PRINCIPAL_CACHE_TTL seconds. A deleted or demoted user thus loses access
+# within PRINCIPAL_CACHE_TTL seconds in every process, at the cost of at
+# most one query per user and TTL.
+#
+# Within the process, saving or deleting a profile or vehicle also marks
+# its user stale right away, so the next request reloads the claims. At
+# most PRINCIPAL_CACHE_SIZE users are kept, least recently used first out;
+# 0 turns the cache off.
+class PrincipalCache:
+    def __init__(self, size=None, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "reloads": 0, "invalidations": 0}
+
+    def _settings(self):
+        from django.conf import settings
+
+        size = self.size if self.size is not None else getattr(settings, "PRINCIPAL_CACHE_SIZE", 10000)
+        ttl = self.ttl if self.ttl is not None else getattr(settings, "PRINCIPAL_CACHE_TTL", 60)
+        return size, ttl
+
+    # Whether a token is recent enough for its claims to be used as they are.
+    def fresh(self, token):
+        _, ttl = self._settings()
+        issued_at = token.get("iat")
+        return issued_at is not None and time.time() - issued_at <= ttl
+
+    def lookup(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return MISSING
+            expires_at, claims = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return MISSING
+            self._entries.move_to_end(user_id)
+            if claims is not STALE:
+                self.stats["hits"] += 1
+            return claims
+
+    def store(self, user_id, claims):
+        size, ttl = self._settings()
+        if size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, claims)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self.stats["invalidations"] += 1
+        self.store(user_id, STALE)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def load_claims(user_id):
+    from riders.models import RiderProfile
+
+    rider = RiderProfile.objects.select_related("vehicle").filter(pk=user_id).first()
+    return principal_claims(rider) if rider is not None and rider.is_active else None
+
+
+async def aload_claims(user_id):
+    from riders.models import RiderProfile
+
+    rider = await RiderProfile.objects.select_related("vehicle").filter(pk=user_id).afirst()
+    return principal_claims(rider) if rider is not None and rider.is_active else None
+
+
+# (user_id, claims) for a validated token; claims is MISSING when they have
+# to be loaded (stale cache entry, a token issued without claims, or one
+# older than PRINCIPAL_CACHE_TTL with nothing cached).
+def _token_claims(token):
+    from rest_framework_simplejwt.settings import api_settings
+    from riders.models import RiderProfile
+
+    try:
+        # simplejwt writes the id as a string.
+        user_id = RiderProfile._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+    except (KeyError, ValidationError):
+        raise InvalidToken("Token contained no recognizable user identification")
+
+    claims = principal_cache.lookup(user_id)
+    if claims is STALE:
+        return user_id, MISSING
+    if claims is MISSING and "role" in token and principal_cache.fresh(token):
+        claims = {"role": token["role"], "vehicle_type": token.get("vehicle_type")}
+    return user_id, claims
+
+
+def _principal(user_id, claims):
+    if claims is None:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+    return TokenPrincipal(user_id, **claims)
+
+
+def principal_for_token(token):
+    user_id, claims = _token_claims(token)
+    if claims is MISSING:
+        principal_cache.stats["reloads"] += 1
+        claims = load_claims(user_id)
+        principal_cache.store(user_id, claims)
+    return _principal(user_id, claims)
+
+
+async def aprincipal_for_token(token):
+    user_id, claims = _token_claims(token)
+    if claims is MISSING:
+        principal_cache.stats["reloads"] += 1
+        claims = await aload_claims(user_id)
+        principal_cache.store(user_id, claims)
+    return _principal(user_id, claims)
+
+
+# Raw JWT (str or bytes) -> validated token; raises InvalidToken.
+def validate_token(raw_token):
+    return JWTAuthentication().get_validated_token(raw_token)
+
+
+###########################################################################
+#                       Authentication Module                             #
+###########################################################################
+
+# REST_FRAMEWORK authentication class: JWTAuthentication with a
+# TokenPrincipal as request.user instead of a RiderProfile lookup.
+class TokenPrincipalAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        return principal_for_token(validated_token)
+
+
+###########################################################################
+#                       Cache Invalidation Module                         #
+###########################################################################
+
+def profile_changed(sender, instance, **kwargs):
+    update_fields = kwargs.get("update_fields")
+    # Saves that only touch availability or location keep the claims.
+    if update_fields is not None and "role" not in update_fields:
+        return
+    principal_cache.invalidate(instance.pk)
+
+
+def vehicle_changed(sender, instance, **kwargs):
+    principal_cache.invalidate(instance.rider_id)
+
+
+# Called from RidersConfig.ready().
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    from riders.models import RiderProfile, Vehicle
+
+    post_save.connect(profile_changed, sender=RiderProfile, dispatch_uid="principal_profile_saved")
+    post_delete.connect(profile_changed, sender=RiderProfile, dispatch_uid="principal_profile_deleted")
+    post_save.connect(vehicle_changed, sender=Vehicle, dispatch_uid="principal_vehicle_saved")
+    post_delete.connect(vehicle_changed, sender=Vehicle, dispatch_uid="principal_vehicle_deleted")
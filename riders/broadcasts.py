@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+###########################################################################
+#                       Broadcast Scheduler Module                        #
+###########################################################################
+
+# Ride state transitions only mark the availability stream and/or a ride as
+# dirty. The first mark arms a flush on the ASGI event loop
+# BROADCAST_COALESCE_INTERVAL seconds later and every mark until then is
+# folded into that same flush, so a burst of accepts/declines/completes
+# costs one availability broadcast instead of one per transition. Without a
+# running event loop (WSGI, management commands) the broadcast is sent
+# straight away; on a short-lived loop (async views under runserver, test
+# clients) the flush runs on a timer thread instead, since that loop may be
+# gone before the flush is due.
+class BroadcastScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._availability = False
+        self._rides = set()
+        self._armed = False
+        self._tasks = set()
+        self.stats = {"requested": 0, "coalesced": 0, "emitted": 0}
+
+    def request(self, availability=False, ride=None):
+        from django.conf import settings
+        from riders.utils import is_server_loop, server_event_loop
+
+        with self._lock:
+            self.stats["requested"] += 1
+            self._availability = self._availability or availability
+            if ride is not None:
+                self._rides.add(ride.id)
+            if self._armed:
+                self.stats["coalesced"] += 1
+                return
+            self._armed = True
+
+        interval = max(settings.BROADCAST_COALESCE_INTERVAL, 0)
+        loop = server_event_loop()
+        if is_server_loop(loop):
+            try:
+                loop.call_soon_threadsafe(loop.call_later, interval, self._start_flush)
+                return
+            except RuntimeError:
+                # The loop closed under us; flush without it.
+                pass
+
+        if loop is None:
+            self.flush_now()
+        else:
+            timer = threading.Timer(interval, self._flush_in_thread)
+            timer.daemon = True
+            timer.start()
+
+    def _take(self):
+        with self._lock:
+            availability, rides = self._availability, self._rides
+            self._availability = False
+            self._rides = set()
+            self._armed = False
+            if availability or rides:
+                self.stats["emitted"] += 1
+            return availability, rides
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _flush_in_thread(self):
+        from django.db import connections
+
+        try:
+            self.flush_now()
+        except Exception:
+            logger.exception("Broadcast flush failed")
+        finally:
+            connections.close_all()
+
+    async def flush(self):
+        from riders.db import database_sync_to_async
+        from channels.layers import get_channel_layer
+        from riders.geo import available_riders
+        from riders.utils import available_riders_messages, fan_out_new_ride, group_send_many
+
+        availability, ride_ids = self._take()
+        try:
+            if availability:
+                if available_riders.loaded:
+                    messages = available_riders_messages()
+                else:
+                    messages = await database_sync_to_async(available_riders_messages, bounded=False)()
+                if messages:
+                    await group_send_many(get_channel_layer(), "rider_update", messages)
+
+            if ride_ids:
+                for ride in await database_sync_to_async(self._requested_rides, bounded=False)(ride_ids):
+                    await fan_out_new_ride(ride)
+        except Exception:
+            logger.exception("Broadcast flush failed")
+
+    def flush_now(self):
+        from riders.utils import broadcast_available_riders, broadcast_new_ride
+
+        availability, ride_ids = self._take()
+        if availability:
+            broadcast_available_riders()
+        for ride in self._requested_rides(ride_ids):
+            broadcast_new_ride(ride)
+
+    def _requested_rides(self, ride_ids):
+        from riders.models import Ride
+
+        if not ride_ids:
+            return []
+        return list(Ride.objects.filter(id__in=ride_ids, status="requested"))
+
+
+broadcast_scheduler = BroadcastScheduler()
@@ -1,17 +1,70 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from asgiref.sync import sync_to_async, async_to_sync
+from riders.db import DatabaseBusy, database_sync_to_async
 from riders.utils import validate_coordinates ,rider_location
+from riders.encoding import dumps, loads
+
+# Consumers behind riders.middleware.TokenAuthMiddleware: the caller is
+# self.principal (role and vehicle type from the token, no query).
+class AuthenticatedConsumer(AsyncWebsocketConsumer):
+    @property
+    def principal(self):
+        return self.scope.get("principal")
+
+    # Whether the caller may use this socket: authenticated, with one of
+    # `roles` and owning `owner_id` (the id in the URL) when given. Admins
+    # may use every socket.
+    def allowed(self, owner_id=None, roles=None):
+        principal = self.principal
+        if principal is None:
+            return False
+        if principal.role == "ADMIN":
+            return True
+        if roles is not None and principal.role not in roles:
+            return False
+        return owner_id is None or principal.id == int(owner_id)
+
+    # Clients that sent the token as a sub-protocol must get one back.
+    async def accept(self, subprotocol=None, headers=None):
+        from riders.middleware import AUTH_SUBPROTOCOL
+
+        if subprotocol is None and AUTH_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            subprotocol = AUTH_SUBPROTOCOL
+        await super().accept(subprotocol=subprotocol, headers=headers)
+
+
+# Consumers whose messages hit the database. A message that finds the
+# database executor full gets a "busy" reply instead of closing the socket;
+# a connect that finds it full is closed so the client retries later.
+class DatabaseConsumer(AuthenticatedConsumer):
+    async def websocket_connect(self, message):
+        try:
+            await super().websocket_connect(message)
+        except DatabaseBusy:
+            await self.close()
 
-ride_timeout_tasks = {}
+    async def websocket_receive(self, message):
+        try:
+            await super().websocket_receive(message)
+        except DatabaseBusy:
+            await self.send(text_data=dumps({
+                "status": False,
+                "message": "Server busy, please try again"
+            }))
 
 ###########################################################################
 #                       Rider Avialability Module                         #
 ###########################################################################
 
-class RiderAvailabilityConsumer(AsyncWebsocketConsumer):
+class RiderAvailabilityConsumer(DatabaseConsumer):
     async def connect(self):
+        from riders.utils import available_riders_snapshot
+
         self.group_name = "rider_availability"
+        self.tiles = set()
+
+        if not self.allowed():
+            await self.close()
+            return
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -19,91 +72,126 @@ class RiderAvailabilityConsumer(AsyncWebsocketConsumer):
         )
         await self.accept()
 
+        snapshot = await database_sync_to_async(available_riders_snapshot)()
+        await self.send(text_data=dumps(snapshot))
+
     async def disconnect(self, close_code):
+        from riders.utils import availability_tile_group
+
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
+        for tile in self.tiles:
+            await self.channel_layer.group_discard(availability_tile_group(tile), self.channel_name)
 
     async def receive(self, text_data):
-        from riders.models import RiderProfile, Vehicle
-        from riders.utils import distance_km
-        from asgiref.sync import sync_to_async
+        from riders.utils import nearest_riders, available_rider_data, available_riders_since
+
+        data = loads(text_data)
+
+        if data.get("action") == "resync":
+            try:
+                version = int(data.get("version"))
+            except (TypeError, ValueError):
+                version = -1
+            message = await database_sync_to_async(available_riders_since)(version, self.tiles)
+            await self.send(text_data=dumps(message))
+            return
+
+        if data.get("action") in ("subscribe", "viewport"):
+            await self.subscribe_tiles(data)
+            return
 
-        data = json.loads(text_data)
         user_lat = data.get("latitude")
         user_lng = data.get("longitude")
 
         if not validate_coordinates(user_lat, user_lng):
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 "status": False,
                 "message": "Invalid Coordinates"
             }))
             return
 
-        riders = await sync_to_async(list)(
-            RiderProfile.objects.filter(role="RIDER", is_available=True).select_related('vehicle')
-        )
+        riders = await database_sync_to_async(nearest_riders)(user_lat, user_lng)
 
         nearby_riders = []
-        for rider in riders:
-            if rider.latitude is None or rider.longitude is None:
-                continue
-
-            distance = distance_km(
-                float(user_lat),
-                float(user_lng),
-                float(rider.latitude),
-                float(rider.longitude),
-            )
+        for rider_id, vehicle_type, lat, lng, _ in riders:
+            nearby_riders.append(available_rider_data(rider_id, vehicle_type, lat, lng))
 
-            if distance <= 5:
-                vehicle_type = None
-                try:
-                    vehicle_type = rider.vehicle.vehicle_type_id
-                except Vehicle.DoesNotExist:
-                    vehicle_type = "UNKNOWN"
-                    
-                nearby_riders.append({
-                    "latitude": float(rider.latitude),
-                    "longitude": float(rider.longitude),
-                    "vehicle_type": vehicle_type
-                })
-
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Available Riders",
             "data": nearby_riders
         }))
     
+    # {"action": "subscribe", "tiles": [[row, col], ...]} or
+    # {"action": "viewport", "south": .., "west": .., "north": .., "east": ..}
+    # Replaces the current tile subscription and sends a snapshot of the
+    # riders in the tiles. An empty subscription, or one over
+    # AVAILABILITY_MAX_TILES tiles (a zoomed-out map), goes back to the
+    # city-wide stream.
+    async def subscribe_tiles(self, data):
+        from django.conf import settings
+        from riders.utils import availability_tile_group, available_riders_in_tiles, available_riders_snapshot, tiles_for_viewport
+
+        try:
+            if data.get("action") == "viewport":
+                tiles = tiles_for_viewport(data["south"], data["west"], data["north"], data["east"])
+            else:
+                tiles = [(int(row), int(col)) for row, col in data.get("tiles") or []]
+        except (KeyError, TypeError, ValueError):
+            await self.send(text_data=dumps({
+                "status": False,
+                "message": "Invalid tiles"
+            }))
+            return
+
+        if len(tiles) > settings.AVAILABILITY_MAX_TILES:
+            tiles = []
+
+        tiles = set(tiles)
+        for tile in self.tiles - tiles:
+            await self.channel_layer.group_discard(availability_tile_group(tile), self.channel_name)
+        for tile in tiles - self.tiles:
+            await self.channel_layer.group_add(availability_tile_group(tile), self.channel_name)
+
+        if tiles and not self.tiles:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        elif not tiles and self.tiles:
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+        self.tiles = tiles
+
+        if tiles:
+            snapshot = await database_sync_to_async(available_riders_in_tiles)(sorted(tiles))
+        else:
+            snapshot = await database_sync_to_async(available_riders_snapshot)()
+        await self.send(text_data=dumps(snapshot))
+
     async def rider_update(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.send(text_data=dumps(event["data"]))
 
 
 ###########################################################################
 #                           Create Ride Module                            #
 ###########################################################################
 
-class UserRideConsumer(AsyncWebsocketConsumer):
-    ride_timeout_tasks = {}
+class UserRideConsumer(DatabaseConsumer):
     async def connect(self):
         self.user_id = self.scope["url_route"]["kwargs"]["user_id"]
         self.group_name = f"user_{self.user_id}"
+        # Loaded with the first ride this socket creates.
+        self.user = None
 
-        from riders.models import RiderProfile
-        try:
-            self.user = await sync_to_async(RiderProfile.objects.get)(id=self.user_id)
-            if self.user.role == "RIDER":
-                await self.close()
-                return
-            
-            await self.channel_layer.group_add(
-                self.group_name,
-                self.channel_name
-            )
-            await self.accept()
-        except RiderProfile.DoesNotExist:
+        if not self.allowed(owner_id=self.user_id, roles=("USER",)):
             await self.close()
+            return
+
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
@@ -112,73 +200,83 @@ class UserRideConsumer(AsyncWebsocketConsumer):
         )
 
     async def receive(self, text_data):
-        from riders.models import Ride
-        from asgiref.sync import sync_to_async
-        from riders.utils import broadcast_new_ride, auto_close_ride, calculate_charges
-        import asyncio
+        from django.conf import settings
+        from riders.db import unit_of_work
+        from riders.dispatch import batch_dispatcher
+        from riders.timeouts import ride_timeouts
+        from riders.utils import fan_out_new_ride, index_ride
 
-        data = json.loads(text_data)
+        data = loads(text_data)
         action = data.get("action")
 
         if action == "create_ride":
-            ride_data = data.get("data")
-    
-            charges = await sync_to_async(calculate_charges)(
-                ride_data["pickup_latitude"],
-                ride_data["pickup_longitude"],
-                ride_data["drop_latitude"],
-                ride_data["drop_longitude"],
-                ride_data["vehicle_type"]
-            )
-            print(charges)
-
-            ride = await sync_to_async(Ride.objects.create)(
-                user = self.user,
-                user_name = self.user.name,
-                user_phone = self.user.phone,
-                pickup_location = ride_data["pickup_location"],
-                pickup_latitude = ride_data["pickup_latitude"],
-                pickup_longitude = ride_data["pickup_longitude"],
-                drop_location = ride_data["drop_location"],
-                drop_latitude = ride_data["drop_latitude"],
-                drop_longitude = ride_data["drop_longitude"],
-                vehicle_type = ride_data["vehicle_type"],
-                charges = charges
-            )
+            ride = await unit_of_work(self.create_ride)(data.get("data"))
+            index_ride(ride)
 
-            await sync_to_async(broadcast_new_ride)(ride)
-            task = asyncio.create_task(auto_close_ride(self.channel_layer, ride.id, delay_seconds=300))
-            ride_timeout_tasks[ride.id] = task
+            if settings.RIDE_DISPATCH_MODE == "batch":
+                batch_dispatcher.submit(ride)
+            else:
+                await fan_out_new_ride(ride)
+            ride_timeouts.schedule_ride(ride)
 
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 "status": True,
                 "message": "Ride Created Successfully",
                 "data": ride.id
             }))
 
+    def create_ride(self, ride_data):
+        from riders.models import Ride, RiderProfile
+        from riders.utils import calculate_charges
+
+        if self.user is None:
+            self.user = RiderProfile.objects.get(id=self.user_id)
+
+        charges = calculate_charges(
+            ride_data["pickup_latitude"],
+            ride_data["pickup_longitude"],
+            ride_data["drop_latitude"],
+            ride_data["drop_longitude"],
+            ride_data["vehicle_type"]
+        )
+
+        return Ride.objects.create(
+            user = self.user,
+            user_name = self.user.name,
+            user_phone = self.user.phone,
+            pickup_location = ride_data["pickup_location"],
+            pickup_latitude = ride_data["pickup_latitude"],
+            pickup_longitude = ride_data["pickup_longitude"],
+            drop_location = ride_data["drop_location"],
+            drop_latitude = ride_data["drop_latitude"],
+            drop_longitude = ride_data["drop_longitude"],
+            vehicle_type = ride_data["vehicle_type"],
+            charges = charges
+        )
+
     async def ride_accepted(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Accepted",
             "data": event["data"]
         }))
 
     async def ride_declined(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Declined",
             "data": event["data"]
         }))
 
     async def ride_picked_up(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Picked up",
             "data": event["data"]
         }))
 
     async def ride_finished(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Finished",
             "data": event["data"]
@@ -189,11 +287,15 @@ class UserRideConsumer(AsyncWebsocketConsumer):
 #               Nearby Rider can see requested ride Module                #
 ###########################################################################
 
-class RideConsumer(AsyncWebsocketConsumer):
+class RideConsumer(DatabaseConsumer):
     async def connect(self):
         self.rider_id = self.scope["url_route"]["kwargs"]["rider_id"]
         self.group_name = f"rider_{self.rider_id}"
 
+        if not self.allowed(owner_id=self.rider_id, roles=("RIDER",)):
+            await self.close()
+            return
+
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
@@ -208,7 +310,7 @@ class RideConsumer(AsyncWebsocketConsumer):
         )
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
+        data = loads(text_data)
 
         if data.get("action") == "accept_ride":
             await self.accept_ride(data.get("ride_id"))
@@ -223,72 +325,81 @@ class RideConsumer(AsyncWebsocketConsumer):
             await self.finish_ride(data.get("ride_id"))
 
     async def send_nearby_rides(self):
+        from django.conf import settings
         from riders.models import Ride, RiderProfile
         from riders.serializers import RideSerializer
-        from riders.utils import distance_km
-        from asgiref.sync import sync_to_async
+        from riders.geo import available_riders, open_rides
+        from riders.locations import location_buffer
+        from riders.db import unit_of_work
+        from riders.utils import vehicle_type_id
+
+        # Vehicle type from the token and the position from memory (latest
+        # ping, else the availability index); the profile is only read for
+        # riders neither knows about.
+        rider_vehicle_type = vehicle_type_id(self.principal.vehicle_type)
+        position = location_buffer.get(self.rider_id)
+        if position is None and self.rider_id in available_riders:
+            _, rider_lat, rider_lng = available_riders.get(self.rider_id)
+            position = (rider_lat, rider_lng)
+
+        @unit_of_work
+        def open_rides_nearby():
+            rider_lat, rider_lng = position or RiderProfile.objects.values_list("latitude", "longitude").get(id=self.rider_id)
+
+            open_rides.ensure_loaded()
+            nearby = open_rides.within(
+                rider_lat,
+                rider_lng,
+                settings.NEARBY_RIDES_RADIUS_KM,
+                key=rider_vehicle_type
+            )
+            nearby.sort(key=lambda ride: ride[4])
+            ride_ids = [ride_id for ride_id, _, _, _, _ in nearby[:settings.NEARBY_RIDES_LIMIT]]
 
-        rider = await sync_to_async(RiderProfile.objects.select_related("vehicle").get)(id=self.rider_id)
-        rider_vehicle_type = rider.vehicle.vehicle_type_id
-        rides = await sync_to_async(list)(
-            Ride.objects.filter(status="requested", vehicle_type=rider_vehicle_type)
-        )
+            rides = Ride.objects.filter(status="requested").in_bulk(ride_ids)
+            return [rides[ride_id] for ride_id in ride_ids if ride_id in rides]
 
-        nearby_rides = []
-        for ride in rides:
-            distance = distance_km(
-                float(rider.latitude),
-                float(rider.longitude),
-                float(ride.pickup_latitude),
-                float(ride.pickup_longitude)
-            )
-            if distance <= 5:
-                nearby_rides.append(ride)
+        nearby_rides = await open_rides_nearby()
 
         data = RideSerializer(nearby_rides, many=True).data
 
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Nearby Rides",
             "data": data
         }))
 
     async def rides_update(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.send(text_data=dumps(event["data"]))
 
     async def accept_ride(self, ride_id):
+        from riders.db import unit_of_work
+
+        # Autocommit: the accept UPDATE commits on its own, so the riders
+        # that lose the race are not kept waiting on the winner's row lock.
+        @unit_of_work(atomic=False)
         def accept_ride_db_save():
             from riders.models import Ride, RiderProfile
-            from django.db import transaction
+            from riders.transitions import transition
             import random
 
-            with transaction.atomic():
-                ride = Ride.objects.select_for_update().get(id=ride_id)
-
-                if ride.status != "requested":
-                    return None
-        
-                ride.status = "accepted"
-                ride.rider_id = self.rider_id
-                otp = str(random.randint(100000, 999999))
-                ride.otp = otp
-                ride.save()
-
-                rider = RiderProfile.objects.get(id=self.rider_id)
-                rider.is_available = False
-                rider.save()
+            otp = str(random.randint(100000, 999999))
+            # Riders racing for the same ride each run one UPDATE; only the
+            # winner goes on to load the ride and its own profile.
+            if not transition(ride_id, "accepted", rider_id=self.rider_id, otp=otp):
+                return None
+            RiderProfile.objects.filter(id=self.rider_id).update(is_available=False)
 
-                vehicle = rider.vehicle
+            ride = Ride.objects.get(id=ride_id)
+            rider = RiderProfile.objects.select_related("vehicle").get(id=self.rider_id)
+            vehicle = rider.vehicle
 
-                return ride, rider, vehicle, otp
+            return ride, rider, vehicle, otp
             
-        result = await sync_to_async(accept_ride_db_save)()
-        
-        from riders.utils import broadcast_available_riders
-        await sync_to_async(broadcast_available_riders)()
+        result = await accept_ride_db_save()
 
         if not result:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 "status": False,
                 "message": "Ride already taken"
             }))
@@ -296,10 +407,18 @@ class RideConsumer(AsyncWebsocketConsumer):
         
         ride, rider, vehicle, otp = result
 
-        from .consumers import ride_timeout_tasks
-        task = ride_timeout_tasks.pop(ride.id, None)
-        if task and not task.done():
-            task.cancel()
+        from riders.geo import available_riders, open_rides
+        open_rides.remove(ride.id)
+        available_riders.remove(self.rider_id)
+
+        from riders.dispatch import batch_dispatcher
+        from riders.timeouts import ride_timeouts
+        ride_timeouts.cancel(ride.id)
+        batch_dispatcher.discard(ride.id)
+
+        # Only the winner took a rider out of the pool.
+        from riders.broadcasts import broadcast_scheduler
+        broadcast_scheduler.request(availability=True)
         
         await self.channel_layer.group_send(
             f"user_{ride.user_id}",
@@ -319,21 +438,38 @@ class RideConsumer(AsyncWebsocketConsumer):
             }
         )
 
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride accepted successfully"
         }))
 
     async def decline_ride(self, ride_id):
         from riders.models import Ride
+        from riders.db import unit_of_work
+        from riders.timeouts import ride_timeouts
+        from riders.transitions import transition
+        from riders.utils import index_ride
+
+        @unit_of_work
+        def decline_ride_db_save():
+            ride = Ride.objects.get(id=ride_id)
+            handed_back = transition(
+                ride.id,
+                "requested",
+                where={"rider_id": self.rider_id},
+                rider_id=None,
+                otp=None
+            )
+            return ride, handed_back
 
-        ride = await sync_to_async(Ride.objects.get)(id=ride_id)
-
-        if ride.status == "accepted" and ride.rider_id == self.rider_id:
+        ride, handed_back = await decline_ride_db_save()
+        if handed_back:
             ride.status = "requested"
             ride.rider_id = None
             ride.otp = None
-            await sync_to_async(ride.save)()
+            index_ride(ride)
+            # Back to requested: the original request deadline applies again.
+            ride_timeouts.schedule_ride(ride)
 
             await self.channel_layer.group_send(
                 f"user_{ride.user_id}",
@@ -347,26 +483,43 @@ class RideConsumer(AsyncWebsocketConsumer):
                 }
             )
         else:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 "status": True,
                 "message": "Ride Declined"
             }))
 
     async def picked_up_ride(self, ride_id, entered_otp):
         from riders.models import Ride
-        from asgiref.sync import sync_to_async
-        
-        ride = await sync_to_async(Ride.objects.get)(id=ride_id)
+        from riders.db import unit_of_work
+        from riders.transitions import transition
+
+        @unit_of_work
+        def picked_up_ride_db_save():
+            ride = Ride.objects.get(id=ride_id)
+            if str(ride.otp) != str(entered_otp):
+                return ride, None
+            picked_up = transition(
+                ride.id,
+                "picked_up",
+                where={"rider_id": self.rider_id, "otp": ride.otp}
+            )
+            return ride, picked_up
 
-        if str(ride.otp) != str(entered_otp):
-            await self.send(text_data=json.dumps({
+        ride, picked_up = await picked_up_ride_db_save()
+
+        if picked_up is None:
+            await self.send(text_data=dumps({
                 "status": False,
                 "message": "Invalid OTP"
             }))
             return
 
-        ride.status = "picked_up"
-        await sync_to_async(ride.save)()
+        if not picked_up:
+            await self.send(text_data=dumps({
+                "status": False,
+                "message": f"Cannot pick up ride with status '{ride.status}'"
+            }))
+            return
 
         await self.channel_layer.group_send(
             f"user_{ride.user_id}",
@@ -379,19 +532,37 @@ class RideConsumer(AsyncWebsocketConsumer):
                 }
             )
         
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Picked up"
         }))
 
     async def finish_ride(self, ride_id):
         from riders.models import Ride
-        from asgiref.sync import sync_to_async
+        from riders.db import unit_of_work
+        from riders.transitions import transition
+        from riders.utils import index_ride
+
+        @unit_of_work
+        def finish_ride_db_save():
+            ride = Ride.objects.get(id=ride_id)
+            finished = transition(
+                ride.id,
+                "completed",
+                where={"rider_id": self.rider_id}
+            )
+            return ride, finished
 
-        ride = await sync_to_async(Ride.objects.get)(id=ride_id)
+        ride, finished = await finish_ride_db_save()
+        if not finished:
+            await self.send(text_data=dumps({
+                "status": False,
+                "message": f"Cannot finish ride with status '{ride.status}'"
+            }))
+            return
 
-        ride.status = "finished"
-        await sync_to_async(ride.save)()
+        ride.status = "completed"
+        index_ride(ride)
 
         await self.channel_layer.group_send(
             f"user_{ride.user_id}",
@@ -404,7 +575,7 @@ class RideConsumer(AsyncWebsocketConsumer):
             }
         )
 
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             "status": True,
             "message": "Ride Finished"
         }))
@@ -415,16 +586,31 @@ class RideConsumer(AsyncWebsocketConsumer):
 #                       Rider Live Location Module                        #
 ###########################################################################
 
-class RiderLocationConsumer(AsyncWebsocketConsumer):
+class RiderLocationConsumer(AuthenticatedConsumer):
     async def connect(self):
+        from riders.wire import SUBPROTOCOL, LocationDecoder, LocationEncoder
+
         self.rider_id = self.scope['url_route']['kwargs']['rider_id']
         self.group_name = f"rider_location_{self.rider_id}"
 
+        # Clients that offer the binary sub-protocol get binary location
+        # frames (riders/wire.py); everyone else keeps the JSON messages.
+        self.binary = SUBPROTOCOL in self.scope.get("subprotocols", [])
+        self.decoder = LocationDecoder()
+        self.encoder = LocationEncoder()
+
+        # Anyone signed in may follow a rider; only that rider (or an admin)
+        # may push locations.
+        if not self.allowed():
+            await self.close()
+            return
+        self.can_push = self.allowed(owner_id=self.rider_id)
+
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept(subprotocol=SUBPROTOCOL if self.binary else None)
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
@@ -432,27 +618,102 @@ class RiderLocationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        from riders.models import RiderProfile
+    async def receive(self, text_data=None, bytes_data=None):
+        from riders.wire import WireError, now_ms
+
+        if bytes_data is not None:
+            try:
+                points = self.decoder.decode(bytes_data)
+            except WireError as e:
+                await self.send(text_data=dumps({
+                    "status": False,
+                    "message": f"Invalid location frame: {e}"
+                }))
+                return
+            await self.update_location([
+                point for point in points if validate_coordinates(point[0], point[1])
+            ])
+            return
+
+        data = loads(text_data)
+
+        # Catch-up after a reconnect: every trail point after `since`.
+        if data.get("action") == "trail":
+            await self.send_trail(data.get("since"))
+            return
 
-        data = json.loads(text_data)
         lat = data.get('latitude')
         lng = data.get('longitude')
 
         if validate_coordinates(lat, lng):
-            await sync_to_async(RiderProfile.objects.filter(id=self.rider_id).update)(
-                latitude = lat,
-                longitude = lng
-            )
+            await self.update_location([(float(lat), float(lng), now_ms())])
+
+    # points are (lat, lng, timestamp_ms), oldest first. Every point goes
+    # into the trail; only the latest one is stored and sent to listeners.
+    async def update_location(self, points):
+        from riders.broadcasts import broadcast_scheduler
+        from riders.geo import available_riders
+        from riders.locations import location_buffer
+        from riders.trails import rider_trails
+
+        if not self.can_push:
+            await self.send(text_data=dumps({
+                "status": False,
+                "message": "Only the rider can update this location"
+            }))
+            return
 
-            location_data = rider_location(lat, lng)
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'location_update',
-                    'data': location_data
-                }
-            )
+        if not points:
+            return
+
+        for lat, lng, timestamp in points:
+            rider_trails.append(self.rider_id, lat, lng, timestamp / 1000)
+
+        lat, lng, timestamp = points[-1]
+        location_buffer.push(self.rider_id, lat, lng)
+        # An available rider moved: let the availability stream send the
+        # "move" (folded with any other changes in the coalescing window).
+        if available_riders.move(self.rider_id, lat, lng):
+            broadcast_scheduler.request(availability=True)
+
+        location_data = rider_location(lat, lng)
+        location_data.update(rider_trails.motion(self.rider_id) or {})
+        await self.channel_layer.group_send(
+            self.group_name,
+            {
+                'type': 'location_update',
+                'data': location_data,
+                'timestamp': timestamp
+            }
+        )
 
     async def location_update(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        if self.binary:
+            data = event["data"]
+            await self.send(bytes_data=self.encoder.encode(
+                data["latitude"],
+                data["longitude"],
+                event.get("timestamp")
+            ))
+            return
+        await self.send(text_data=dumps(event["data"]))
+
+    async def send_trail(self, since):
+        from riders.trails import rider_trails
+
+        try:
+            since = float(since) if since is not None else None
+        except (TypeError, ValueError):
+            since = None
+
+        await self.send(text_data=dumps({
+            "status": True,
+            "message": "Rider Trail",
+            "data": {
+                "rider_id": self.rider_id,
+                "points": [
+                    {"latitude": lat, "longitude": lng, "timestamp": timestamp}
+                    for lat, lng, timestamp in rider_trails.points(self.rider_id, since)
+                ]
+            }
+        }))
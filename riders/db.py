@@ -0,0 +1,109 @@
+import functools
+import threading
+import time
+
+from riders.executors import BoundedExecutor, ExecutorBusy
+
+###########################################################################
+#                       Database Executor Module                          #
+###########################################################################
+
+class DatabaseBusy(ExecutorBusy):
+    pass
+
+
+# Fixed pool of DB_EXECUTOR_WORKERS threads for the ORM work of the ASGI
+# path (consumers and the background tasks on the server loop). Each thread
+# keeps its own database connection, so a worker process never holds more
+# than DB_EXECUTOR_WORKERS connections; they are reused for CONN_MAX_AGE
+# seconds and checked with CONN_HEALTH_CHECKS. close_old_connections()
+# runs after a call that raised and otherwise at most once every
+# DB_EXECUTOR_CONNECTION_CHECK seconds per thread: running it around every
+# call would re-arm the health check and cost each call an extra ping.
+#
+# At most DB_EXECUTOR_MAX_QUEUE calls may wait for a thread. Past that,
+# run() raises DatabaseBusy straight away instead of queueing without
+# bound; pass bounded=False for work that must not be dropped (background
+# flushes and sweeps), which still waits its turn for the same threads.
+class DatabaseExecutor(BoundedExecutor):
+    busy = DatabaseBusy
+    workers_setting = "DB_EXECUTOR_WORKERS"
+    max_queue_setting = "DB_EXECUTOR_MAX_QUEUE"
+    default_workers = 8
+    default_max_queue = 200
+    thread_name_prefix = "db"
+
+    def __init__(self, workers=None, max_queue=None):
+        super().__init__(workers, max_queue)
+        self._local = threading.local()
+
+    def _job(self, func, args, kwargs):
+        from django.conf import settings
+        from django.db import close_old_connections
+
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            now = time.monotonic()
+            if failed or now >= getattr(self._local, "check_at", 0):
+                close_old_connections()
+                self._local.check_at = now + getattr(settings, "DB_EXECUTOR_CONNECTION_CHECK", 30)
+
+
+db_executor = DatabaseExecutor()
+
+
+# sync_to_async for database work: database_sync_to_async(func)(*args)
+# runs func on db_executor.
+def database_sync_to_async(func, bounded=True):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(func, *args, bounded=bounded, **kwargs)
+    return wrapper
+
+
+###########################################################################
+#                       Unit Of Work Module                               #
+###########################################################################
+
+def _run_atomic(func, args, kwargs):
+    from django.db import transaction
+
+    with transaction.atomic():
+        return func(*args, **kwargs)
+
+
+# Runs all the database work for one inbound WebSocket message in a single
+# executor hop and a single transaction:
+#
+#     @unit_of_work
+#     def finish(ride_id, rider_id):
+#         ride = Ride.objects.get(id=ride_id)
+#         ...
+#         return ride
+#
+#     ride = await finish(ride_id, self.rider_id)
+#     await self.channel_layer.group_send(...)
+#
+# The decorated function becomes a coroutine function. It must be plain sync
+# ORM code; channel layer sends and other async work go after the await, once
+# the transaction has committed.
+#
+# @unit_of_work(atomic=False) keeps the single hop but runs in autocommit.
+# Use it when the first statement is a contended compare-and-swap
+# (riders.transitions): inside a transaction the winner would hold the row
+# lock until the rest of the unit is done, and every losing UPDATE waits on
+# it.
+def unit_of_work(func=None, atomic=True):
+    if func is None:
+        return functools.partial(unit_of_work, atomic=atomic)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if atomic:
+            return await db_executor.run(_run_atomic, func, args, kwargs)
+        return await db_executor.run(func, *args, **kwargs)
+    return wrapper
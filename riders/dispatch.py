@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+logger = logging.getLogger(__name__)
+
+###########################################################################
+#                       Assignment Solver Module                          #
+###########################################################################
+
+# costs is a rides x riders matrix of pickup distances, with None where the
+# rider is not a candidate for the ride. Returns (ride_index, rider_index)
+# pairs so that every ride and every rider is used at most once. Runs on a
+# solver thread, off the event loop.
+def solve_assignment(costs, max_cost):
+    if linear_sum_assignment is not None:
+        return _solve_optimal(costs, max_cost)
+    return _solve_greedy(costs, max_cost)
+
+def _solve_optimal(costs, max_cost):
+    infeasible = max_cost * 1000 + 1
+    matrix = [
+        [cost if cost is not None and cost <= max_cost else infeasible for cost in row]
+        for row in costs
+    ]
+    rows, cols = linear_sum_assignment(matrix)
+    return [
+        (int(row), int(col))
+        for row, col in zip(rows, cols)
+        if matrix[row][col] < infeasible
+    ]
+
+def _solve_greedy(costs, max_cost):
+    pairs = sorted(
+        (cost, ride_index, rider_index)
+        for ride_index, row in enumerate(costs)
+        for rider_index, cost in enumerate(row)
+        if cost is not None and cost <= max_cost
+    )
+
+    assigned_rides = set()
+    assigned_riders = set()
+    assignments = []
+    for _, ride_index, rider_index in pairs:
+        if ride_index in assigned_rides or rider_index in assigned_riders:
+            continue
+        assigned_rides.add(ride_index)
+        assigned_riders.add(rider_index)
+        assignments.append((ride_index, rider_index))
+    return assignments
+
+
+###########################################################################
+#                       Batch Dispatch Module                             #
+###########################################################################
+
+# Collects requested rides for RIDE_BATCH_WINDOW_SECONDS, matches them against
+# nearby riders in one global assignment and sends each matched rider a
+# single targeted offer. A ride stays pending and is offered to a different
+# rider in each following window until it is accepted (discard) or it has
+# been through RIDE_BATCH_MAX_ROUNDS windows; a ride still open after the
+# last round is offered to all of its nearest riders like in broadcast mode.
+class BatchDispatcher:
+    def __init__(self):
+        self._pending = {}
+        self._task = None
+        self._pool = None
+
+    def submit(self, ride):
+        self._pending[ride.id] = {"ride": ride, "rounds": 0, "offered": set()}
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def discard(self, ride_id):
+        self._pending.pop(ride_id, None)
+
+    async def _run(self):
+        from django.conf import settings
+
+        while self._pending:
+            await asyncio.sleep(settings.RIDE_BATCH_WINDOW_SECONDS)
+            try:
+                await self.dispatch_window()
+            except Exception:
+                logger.exception("Batch dispatch window failed")
+
+    async def dispatch_window(self):
+        from django.conf import settings
+        from riders.db import database_sync_to_async
+
+        batch = list(self._pending.values())
+        if not batch:
+            return
+
+        rider_ids, costs = await database_sync_to_async(self._build_costs, bounded=False)(batch)
+        assignments = []
+        if rider_ids:
+            assignments = await asyncio.get_running_loop().run_in_executor(
+                self._executor(),
+                solve_assignment,
+                costs,
+                settings.NEAREST_RIDERS_MAX_RADIUS_KM
+            )
+
+        for ride_index, rider_index in assignments:
+            entry = batch[ride_index]
+            rider_id = rider_ids[rider_index]
+            entry["offered"].add(rider_id)
+            await self.send_offer(entry["ride"], rider_id)
+
+        for entry in batch:
+            entry["rounds"] += 1
+            if entry["rounds"] >= settings.RIDE_BATCH_MAX_ROUNDS and entry["ride"].id in self._pending:
+                self.discard(entry["ride"].id)
+                await self.fall_back(entry["ride"])
+
+        logger.debug("Batch dispatch: %d rides, %d riders, %d offers", len(batch), len(rider_ids), len(assignments))
+
+    def _build_costs(self, batch):
+        from django.conf import settings
+        from riders.utils import nearest_riders
+
+        rider_ids = []
+        columns = {}
+        candidates = []
+        for entry in batch:
+            ride = entry["ride"]
+            nearby = {}
+            for rider_id, _, _, _, distance in nearest_riders(
+                ride.pickup_latitude,
+                ride.pickup_longitude,
+                ride.vehicle_type,
+                k=settings.RIDE_BATCH_CANDIDATES
+            ):
+                if rider_id in entry["offered"]:
+                    continue
+                if rider_id not in columns:
+                    columns[rider_id] = len(rider_ids)
+                    rider_ids.append(rider_id)
+                nearby[columns[rider_id]] = distance
+            candidates.append(nearby)
+
+        costs = [
+            [nearby.get(column) for column in range(len(rider_ids))]
+            for nearby in candidates
+        ]
+        return rider_ids, costs
+
+    async def send_offer(self, ride, rider_id):
+        from channels.layers import get_channel_layer
+        from riders.serializers import RideSerializer
+
+        await get_channel_layer().group_send(
+            f"rider_{rider_id}",
+            {
+                "type": "rides_update",
+                "data": {
+                    "status": True,
+                    "message": "Nearby Rides are",
+                    "data": RideSerializer(ride).data
+                }
+            }
+        )
+
+    async def fall_back(self, ride):
+        from riders.utils import fan_out_new_ride
+
+        logger.debug("Ride %s unmatched after batch rounds, broadcasting", ride.id)
+        await fan_out_new_ride(ride)
+
+    def _executor(self):
+        from django.conf import settings
+
+        if not settings.RIDE_BATCH_SOLVER_WORKERS:
+            return None
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=settings.RIDE_BATCH_SOLVER_WORKERS, thread_name_prefix="dispatch"
+            )
+        return self._pool
+
+
+batch_dispatcher = BatchDispatcher()
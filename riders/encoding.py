@@ -0,0 +1,62 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+###########################################################################
+#                       JSON Encoding Module                              #
+###########################################################################
+
+# One JSON layer for the WebSocket consumers and the REST API. Uses orjson
+# when it is installed and the stdlib json module otherwise. Decimal,
+# datetimes, UUIDs and lazy translation strings are encoded directly, so
+# model values can be put in a payload as they are.
+
+def _default(obj):
+    from django.utils.functional import Promise
+
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, Promise):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumpb(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    def loads(data):
+        return orjson.loads(data)
+
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumpb(obj):
+        return _encoder.encode(obj).encode()
+
+    def dumps(obj):
+        return _encoder.encode(obj)
+
+    def loads(data):
+        return json.loads(data)
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+###########################################################################
+#                       Bounded Executor Module                           #
+###########################################################################
+
+class ExecutorBusy(Exception):
+    pass
+
+
+# Fixed pool of `workers` threads with at most `max_queue` calls waiting for
+# one. Past that, run() and call() raise `busy` straight away instead of
+# queueing without bound; bounded=False skips the limit for work that must
+# not be dropped. Worker count and queue limit come from the settings named
+# by the subclass unless given.
+#
+# Gauges: queued / in_flight right now, peak_queued, completed, rejected,
+# and the time calls waited for a thread and ran on it (last, max, total).
+class BoundedExecutor:
+    busy = ExecutorBusy
+    workers_setting = None
+    max_queue_setting = None
+    default_workers = 4
+    default_max_queue = 100
+    thread_name_prefix = "bounded"
+
+    def __init__(self, workers=None, max_queue=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.gauges = {
+            "queued": 0,
+            "in_flight": 0,
+            "peak_queued": 0,
+            "completed": 0,
+            "rejected": 0,
+            "last_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_wait_ms": 0.0,
+            "last_run_ms": 0.0,
+            "max_run_ms": 0.0,
+            "total_run_ms": 0.0,
+        }
+
+    def _settings(self):
+        from django.conf import settings
+
+        workers = self.workers or getattr(settings, self.workers_setting, self.default_workers)
+        max_queue = self.max_queue
+        if max_queue is None:
+            max_queue = getattr(settings, self.max_queue_setting, self.default_max_queue)
+        return workers, max_queue
+
+    # One pool per process: uvicorn/daphne workers forked after import each
+    # start their own threads.
+    def _executor(self):
+        if self._pool is None or self._pid != os.getpid():
+            workers, _ = self._settings()
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.thread_name_prefix)
+            self._pid = os.getpid()
+        return self._pool
+
+    def _enqueue(self, bounded):
+        _, max_queue = self._settings()
+        with self._lock:
+            if bounded and self.gauges["queued"] >= max_queue:
+                self.gauges["rejected"] += 1
+                raise self.busy(f"{self.gauges['queued']} calls already waiting")
+            self.gauges["queued"] += 1
+            self.gauges["peak_queued"] = max(self.gauges["peak_queued"], self.gauges["queued"])
+        return time.perf_counter()
+
+    async def run(self, func, *args, bounded=True, **kwargs):
+        call = functools.partial(self._call, self._enqueue(bounded), func, args, kwargs)
+        context = contextvars.copy_context()
+        future = self._executor().submit(context.run, call)
+        future.add_done_callback(self._dropped)
+        return await asyncio.wrap_future(future)
+
+    # run() for sync code: blocks the calling thread until the result is in.
+    def call(self, func, *args, bounded=True, **kwargs):
+        return self._executor().submit(self._call, self._enqueue(bounded), func, args, kwargs).result()
+
+    # A call cancelled while it waited for a thread (its task was cancelled,
+    # e.g. on a WebSocket disconnect) never reaches _call(); take it off the
+    # queue here so it does not count against max_queue forever.
+    def _dropped(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.gauges["queued"] -= 1
+
+    def _call(self, submitted, func, args, kwargs):
+        started = time.perf_counter()
+        waited_ms = (started - submitted) * 1000
+        with self._lock:
+            self.gauges["queued"] -= 1
+            self.gauges["in_flight"] += 1
+            self.gauges["last_wait_ms"] = waited_ms
+            self.gauges["max_wait_ms"] = max(self.gauges["max_wait_ms"], waited_ms)
+            self.gauges["total_wait_ms"] += waited_ms
+
+        try:
+            return self._job(func, args, kwargs)
+        finally:
+            run_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.gauges["in_flight"] -= 1
+                self.gauges["completed"] += 1
+                self.gauges["last_run_ms"] = run_ms
+                self.gauges["max_run_ms"] = max(self.gauges["max_run_ms"], run_ms)
+                self.gauges["total_run_ms"] += run_ms
+
+    def _job(self, func, args, kwargs):
+        return func(*args, **kwargs)
+
+    def snapshot(self):
+        workers, max_queue = self._settings()
+        with self._lock:
+            gauges = dict(self.gauges)
+        gauges["workers"] = workers
+        gauges["max_queue"] = max_queue
+        completed = gauges["completed"]
+        gauges["avg_wait_ms"] = gauges["total_wait_ms"] / completed if completed else 0.0
+        gauges["avg_run_ms"] = gauges["total_run_ms"] / completed if completed else 0.0
+        return gauges
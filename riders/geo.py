@@ -0,0 +1,375 @@
+import threading
+from collections import OrderedDict
+from math import cos, floor, radians
+
+KM_PER_DEGREE = 111.32
+
+# Cell crossings remembered per changed entry, for per-tile resyncs.
+CELL_HISTORY = 8
+
+###########################################################################
+#                       Geo Grid Index Module                             #
+###########################################################################
+
+# Fixed-cell grid over lat/lng. Entries are bucketed by (key, cell) where key
+# is the vehicle type id, so a radius lookup only touches the cells that the
+# bounding box of the circle overlaps, for the requested vehicle type.
+#
+# Nearby lookups never reach SQL: the only queries left are the loaders
+# below, which read every available rider or open ride once per process.
+# A bounding-box predicate or spatial index on the lat/lng columns would
+# have nothing to narrow, so none is kept on the models.
+
+ANY = object()
+
+
+def cell_for(lat, lng, cell_degrees):
+    return (floor(lat / cell_degrees), floor(lng / cell_degrees))
+
+
+def bounding_box(lat, lng, radius_km):
+    lat = float(lat)
+    lng = float(lng)
+    lat_span = radius_km / KM_PER_DEGREE
+    lng_span = radius_km / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01))
+    return lat - lat_span, lat + lat_span, lng - lng_span, lng + lng_span
+
+
+def cells_around(lat, lng, radius_km, cell_degrees):
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+
+    min_row, min_col = cell_for(min_lat, min_lng, cell_degrees)
+    max_row, max_col = cell_for(max_lat, max_lng, cell_degrees)
+
+    for row in range(min_row, max_row + 1):
+        for col in range(min_col, max_col + 1):
+            yield (row, col)
+
+
+class GridIndex:
+    def __init__(self, cell_degrees=0.02, loader=None, change_log=0):
+        self.cell_degrees = cell_degrees
+        self.loader = loader
+        self.loaded = False
+        self.version = 0
+        self._cells = {}
+        self._entries = {}
+        self._keys = {}
+        self._lock = threading.RLock()
+
+        # Latest change per entry id, oldest first, as
+        # {entry_id: (version, added_version)}. added_version is None when the
+        # entry was removed. Entries that fall off the end raise the horizon
+        # below which changes_since can no longer answer.
+        self.change_log = change_log
+        self._changes = OrderedDict() if change_log else None
+        self._horizon = 0
+
+        # For entries in the change log, their last CELL_HISTORY cell
+        # crossings as [(version, from_cell, to_cell)], and the newest
+        # version of a crossing that was dropped from that list; this is
+        # what tells changes_since(cells=...) where an entry used to be.
+        self._crossings = {}
+        self._crossings_dropped = {}
+
+        # Called under the index lock as listener(entry_id, old_cell,
+        # new_cell) for every recorded change; a cell is None when the entry
+        # is not (or no longer) indexed.
+        self.listeners = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._entries
+
+    def ensure_loaded(self):
+        if self.loaded or self.loader is None:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            for entry_id, key, lat, lng in self.loader():
+                self._put(entry_id, key, float(lat), float(lng), record=False)
+            self.loaded = True
+
+    def add(self, entry_id, key, lat, lng):
+        with self._lock:
+            self._put(entry_id, key, float(lat), float(lng))
+
+    def move(self, entry_id, lat, lng):
+        # Only entries that are already indexed can move; a rider that is
+        # offline or busy stays out of the index until it is added again.
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return False
+            self._put(entry_id, entry[0], float(lat), float(lng))
+            return True
+
+    def remove(self, entry_id):
+        with self._lock:
+            old_cell = self._discard(entry_id)
+            if old_cell is None:
+                return False
+            self._record(entry_id, present=False, inserted=False)
+            self._crossed(entry_id, old_cell, None)
+            self._notify(entry_id, old_cell, None)
+            return True
+
+    def get(self, entry_id):
+        entry = self._entries.get(entry_id)
+        if entry is None:
+            return None
+        key, _, lat, lng = entry
+        return key, lat, lng
+
+    def cell_of(self, entry_id):
+        entry = self._entries.get(entry_id)
+        return entry[1] if entry is not None else None
+
+    def in_cells(self, cells):
+        with self._lock:
+            found = []
+            for key in list(self._keys):
+                for cell in cells:
+                    bucket = self._cells.get((key, cell))
+                    if bucket:
+                        for entry_id, (lat, lng) in bucket.items():
+                            found.append((entry_id, key, lat, lng))
+            return found
+
+    def snapshot(self):
+        with self._lock:
+            return self.version, [
+                (entry_id, key, lat, lng)
+                for entry_id, (key, _, lat, lng) in self._entries.items()
+            ]
+
+    # Returns the current version and the compacted changes after `version`,
+    # oldest first, as (op, entry_id, key, lat, lng) with op in "add",
+    # "move", "remove". The changes are None when the caller is too far
+    # behind (or ahead) and needs a fresh snapshot instead.
+    #
+    # With `cells`, only the changes seen from those cells: an entry that
+    # came in is an "add", one that left is a "remove", and entries that
+    # stayed outside are left out.
+    def changes_since(self, version, cells=None):
+        with self._lock:
+            if self._changes is None or version < self._horizon or version > self.version:
+                return self.version, None
+
+            changes = []
+            for entry_id in reversed(self._changes):
+                changed_at, added_at = self._changes[entry_id]
+                if changed_at <= version:
+                    break
+                entry = self._entries.get(entry_id)
+                old_cell = None
+                if cells is None:
+                    was_in = is_in = True
+                else:
+                    old_cell = self._cell_at(entry_id, version)
+                    was_in = old_cell is ANY or old_cell in cells
+                    is_in = entry is not None and entry[1] in cells
+                    if old_cell is not ANY and not is_in and not was_in:
+                        continue
+
+                if entry is None or not is_in:
+                    changes.append(("remove", entry_id, None, None, None))
+                else:
+                    key, _, lat, lng = entry
+                    op = "move" if added_at <= version and was_in and old_cell is not ANY else "add"
+                    changes.append((op, entry_id, key, lat, lng))
+            changes.reverse()
+            return self.version, changes
+
+    # The cell an entry was in at `version` (None: not indexed), or ANY when
+    # its crossings no longer reach back that far. Call under the lock.
+    def _cell_at(self, entry_id, version):
+        if self._crossings_dropped.get(entry_id, 0) > version:
+            return ANY
+        for crossed_at, from_cell, _ in self._crossings.get(entry_id, ()):
+            if crossed_at > version:
+                return from_cell
+        entry = self._entries.get(entry_id)
+        return entry[1] if entry is not None else None
+
+    def candidates(self, lat, lng, radius_km, key=ANY):
+        lat = float(lat)
+        lng = float(lng)
+        with self._lock:
+            keys = list(self._keys) if key is ANY else [key]
+            found = []
+            for cell in cells_around(lat, lng, radius_km, self.cell_degrees):
+                for k in keys:
+                    bucket = self._cells.get((k, cell))
+                    if bucket:
+                        for entry_id, (entry_lat, entry_lng) in bucket.items():
+                            found.append((entry_id, k, entry_lat, entry_lng))
+            return found
+
+    def within(self, lat, lng, radius_km, key=ANY):
+        from riders.utils import distances_km
+
+        candidates = self.candidates(lat, lng, radius_km, key)
+        if not candidates:
+            return []
+
+        distances, mask = distances_km(
+            lat,
+            lng,
+            [candidate[2] for candidate in candidates],
+            [candidate[3] for candidate in candidates],
+            radius_km
+        )
+        return [
+            candidate + (float(distance),)
+            for candidate, distance, inside in zip(candidates, distances, mask)
+            if inside
+        ]
+
+    def _put(self, entry_id, key, lat, lng, record=True):
+        old_cell = self._discard(entry_id)
+        cell = cell_for(lat, lng, self.cell_degrees)
+        self._entries[entry_id] = (key, cell, lat, lng)
+        self._cells.setdefault((key, cell), {})[entry_id] = (lat, lng)
+        self._keys[key] = self._keys.get(key, 0) + 1
+        if record:
+            self._record(entry_id, present=True, inserted=old_cell is None)
+            self._crossed(entry_id, old_cell, cell)
+            self._notify(entry_id, old_cell, cell)
+
+    def _discard(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        key, cell = entry[0], entry[1]
+        bucket = self._cells.get((key, cell))
+        if bucket is not None:
+            bucket.pop(entry_id, None)
+            if not bucket:
+                del self._cells[(key, cell)]
+        self._keys[key] -= 1
+        if not self._keys[key]:
+            del self._keys[key]
+        return cell
+
+    def _record(self, entry_id, present, inserted):
+        if self._changes is None:
+            return
+        self.version += 1
+
+        previous = self._changes.pop(entry_id, None)
+        if not present:
+            added_at = None
+        elif inserted:
+            added_at = self.version
+        elif previous is not None and previous[1] is not None:
+            added_at = previous[1]
+        else:
+            added_at = 0
+        self._changes[entry_id] = (self.version, added_at)
+
+        while len(self._changes) > self.change_log:
+            dropped_id, (changed_at, _) = self._changes.popitem(last=False)
+            self._horizon = max(self._horizon, changed_at)
+            self._crossings.pop(dropped_id, None)
+            self._crossings_dropped.pop(dropped_id, None)
+
+    def _crossed(self, entry_id, old_cell, new_cell):
+        if self._changes is None or old_cell == new_cell:
+            return
+        crossings = self._crossings.setdefault(entry_id, [])
+        crossings.append((self.version, old_cell, new_cell))
+        if len(crossings) > CELL_HISTORY:
+            self._crossings_dropped[entry_id] = crossings.pop(0)[0]
+
+    def _notify(self, entry_id, old_cell, new_cell):
+        for listener in self.listeners:
+            listener(entry_id, old_cell, new_cell)
+
+
+###########################################################################
+#                       Tile Changes Module                               #
+###########################################################################
+
+# Remembers, for every entry changed since the last drain, which cell it was
+# in at that point. drain() then turns that into per-tile changes: an entry
+# that crossed from one tile to another is a "remove" for the old tile and
+# an "add" for the new one, so tile subscribers never keep stale entries.
+class TileChanges:
+    def __init__(self, index):
+        self.index = index
+        self._pending = {}
+        index.listeners.append(self._changed)
+
+    def _changed(self, entry_id, old_cell, new_cell):
+        self._pending.setdefault(entry_id, old_cell)
+
+    def drain(self):
+        with self.index._lock:
+            pending, self._pending = self._pending, {}
+
+            tiles = {}
+            for entry_id, old_cell in pending.items():
+                entry = self.index._entries.get(entry_id)
+                new_cell = entry[1] if entry is not None else None
+
+                if old_cell is not None and old_cell != new_cell:
+                    tiles.setdefault(old_cell, []).append(("remove", entry_id, None, None, None))
+                if new_cell is not None:
+                    key, _, lat, lng = entry
+                    op = "move" if old_cell == new_cell else "add"
+                    tiles.setdefault(new_cell, []).append((op, entry_id, key, lat, lng))
+            return self.index.version, tiles
+
+
+###########################################################################
+#                       Available Riders Index                            #
+###########################################################################
+
+def load_available_riders():
+    from riders.models import RiderProfile
+    from riders.locations import location_buffer
+
+    riders = RiderProfile.objects.filter(
+        role="RIDER", is_available=True, latitude__isnull=False, longitude__isnull=False
+    ).values_list("id", "vehicle__vehicle_type_id", "latitude", "longitude")
+    for rider_id, vehicle_type, lat, lng in riders:
+        lat, lng = location_buffer.get(rider_id) or (lat, lng)
+        yield rider_id, vehicle_type, lat, lng
+
+
+###########################################################################
+#                       Open Ride Requests Index                          #
+###########################################################################
+
+def load_open_rides():
+    from riders.models import Ride
+    from riders.utils import vehicle_type_id
+
+    rides = Ride.objects.filter(status="requested").values_list(
+        "id", "vehicle_type", "pickup_latitude", "pickup_longitude"
+    )
+    for ride_id, vehicle_type, lat, lng in rides:
+        yield ride_id, vehicle_type_id(vehicle_type), lat, lng
+
+
+def _setting(name, default):
+    from django.conf import settings
+    return getattr(settings, name, default)
+
+
+available_riders = GridIndex(
+    cell_degrees=_setting("GEO_INDEX_CELL_DEGREES", 0.02),
+    loader=load_available_riders,
+    change_log=_setting("AVAILABILITY_CHANGE_LOG_SIZE", 100000),
+)
+
+available_tiles = TileChanges(available_riders)
+
+open_rides = GridIndex(
+    cell_degrees=_setting("GEO_INDEX_CELL_DEGREES", 0.02),
+    loader=load_open_rides,
+)
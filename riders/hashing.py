@@ -0,0 +1,63 @@
+from riders.executors import BoundedExecutor, ExecutorBusy
+
+###########################################################################
+#                       Password Hashing Module                           #
+###########################################################################
+
+class HashingBusy(ExecutorBusy):
+    pass
+
+
+# Password hashing (PBKDF2, hundreds of milliseconds of CPU each) runs on
+# PASSWORD_HASH_WORKERS threads of its own instead of inline on whichever
+# request worker took the login or signup. hashlib drops the GIL while it
+# iterates, so the threads hash in parallel, and a burst of logins can take
+# at most PASSWORD_HASH_WORKERS cores: once PASSWORD_HASH_MAX_QUEUE calls
+# are waiting, make() and verify() raise HashingBusy straight away and the
+# views answer 503 with Retry-After.
+#
+# verify() also does Django's upgrade-on-login: when the stored hash uses an
+# older hasher or fewer iterations, the password is rehashed on the same
+# thread and returned so the caller can save it. snapshot() adds the number
+# of rehashes to the executor gauges (queue depth, wait and hash time).
+class PasswordHasherPool(BoundedExecutor):
+    busy = HashingBusy
+    workers_setting = "PASSWORD_HASH_WORKERS"
+    max_queue_setting = "PASSWORD_HASH_MAX_QUEUE"
+    default_workers = 4
+    default_max_queue = 32
+    thread_name_prefix = "hash"
+
+    def __init__(self, workers=None, max_queue=None):
+        super().__init__(workers, max_queue)
+        self.gauges["rehashed"] = 0
+
+    def make(self, password):
+        from django.contrib.auth.hashers import make_password
+
+        return self.call(make_password, password)
+
+    async def amake(self, password):
+        from django.contrib.auth.hashers import make_password
+
+        return await self.run(make_password, password)
+
+    # (matches, upgraded hash or None)
+    def verify(self, password, encoded):
+        return self.call(self._verify, password, encoded)
+
+    async def averify(self, password, encoded):
+        return await self.run(self._verify, password, encoded)
+
+    def _verify(self, password, encoded):
+        from django.contrib.auth.hashers import check_password, make_password
+
+        upgraded = []
+        matches = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+        if upgraded:
+            with self._lock:
+                self.gauges["rehashed"] += 1
+        return matches, (upgraded[0] if upgraded else None)
+
+
+password_hasher = PasswordHasherPool()
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import re
+import secrets
+import struct
+import tempfile
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct(">I")
+WORKER_ID = re.compile(r"^w\d+x[0-9a-f]{6}$")
+
+###########################################################################
+#                       Local Socket Channel Layer Module                 #
+###########################################################################
+
+# Channel layer for several ASGI workers on one machine, without a broker.
+# It only shares channels and groups: the geo indexes, availability
+# version, location buffer, batch dispatcher and principal cache stay per
+# process, so project/settings.py keeps InMemoryChannelLayer and a single
+# worker until that state is shared too.
+#
+# Every worker keeps its own InMemoryChannelLayer for the channels and group
+# members it owns (capacity and expiry work exactly as there) and listens on
+# a Unix socket <path>/<worker_id>.sock. The directory is created 0700 so
+# only the same user can reach the workers.
+#
+# - new_channel() puts the worker id in the channel name
+#   ("specific.<worker_id>!<random>"), so send() to a channel owned by
+#   another worker is forwarded to that worker's socket.
+# - group_add()/group_discard() only touch the local groups, because a
+#   worker only ever adds its own channels.
+# - group_send() delivers to the local members and forwards the message once
+#   to every other live worker, which delivers to its own members.
+#
+# Messages cross the socket as length-prefixed riders.encoding JSON, so they
+# must be JSON-serializable (no bytes values). Plain (non "!") channel names
+# are delivered in the sending process only. A forwarded message that hits a
+# full channel on the other side is dropped, as group_send would.
+class LocalSocketChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        peer_refresh=1.0,
+        **kwargs
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.local = InMemoryChannelLayer(
+            expiry=expiry,
+            group_expiry=group_expiry,
+            capacity=capacity,
+            channel_capacity=channel_capacity
+        )
+        self.path = path or os.path.join(tempfile.gettempdir(), f"ridebooking-channels-{os.getuid()}")
+        self.worker_id = f"w{os.getpid()}x{secrets.token_hex(3)}"
+        self.socket_path = os.path.join(self.path, f"{self.worker_id}.sock")
+        self.peer_refresh = peer_refresh
+
+        self._server = None
+        self._server_loop = None
+        self._server_task = None
+        self._writers = {}
+        self._peers = []
+        self._peers_listed_at = 0
+        self.stats = {"forwarded": 0, "received": 0, "dropped": 0}
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific."):
+        await self._ensure_server()
+        return f"{prefix}{self.worker_id}!{secrets.token_hex(6)}"
+
+    async def receive(self, channel):
+        await self._ensure_server()
+        return await self.local.receive(channel)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+
+        owner = self._owner(channel)
+        if owner is None or owner == self.worker_id:
+            await self.local.send(channel, message)
+            return
+
+        if not await self._forward(owner, self._frame("send", channel, message)):
+            self.stats["dropped"] += 1
+
+    async def group_add(self, group, channel):
+        await self.local.group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        await self.local.group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+
+        await self._deliver(group, message)
+
+        peers = self._list_peers()
+        if peers:
+            frame = self._frame("group", group, message)
+            for peer in list(peers):
+                await self._forward(peer, frame)
+
+    async def flush(self):
+        await self.local.flush()
+
+    async def close(self):
+        for entry in list(self._writers.values()):
+            writer = entry[1].result() if entry[1].done() and not entry[1].cancelled() else None
+            if writer is not None:
+                writer.close()
+        self._writers = {}
+
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            self._server_task = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    # Worker socket
+
+    async def _ensure_server(self):
+        loop = asyncio.get_running_loop()
+        if self._server_task is None or self._server_loop is not loop:
+            self._server_loop = loop
+            self._server_task = loop.create_task(self._start_server())
+        await self._server_task
+
+    async def _start_server(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        info = os.stat(self.path)
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise ImproperlyConfigured(f"Channel layer directory {self.path} must be owned by this user with mode 0700")
+
+        # Bind under a temporary name and move it into place once it is
+        # listening, so peers never see (and clean up) a refusing socket.
+        pending_path = f"{self.socket_path}.pending"
+        if os.path.exists(pending_path):
+            os.unlink(pending_path)
+        self._server = await asyncio.start_unix_server(self._serve, path=pending_path)
+        os.chmod(pending_path, 0o600)
+        os.replace(pending_path, self.socket_path)
+        self._peers_listed_at = 0
+
+    async def _serve(self, reader, writer):
+        from riders.encoding import loads
+
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                kind, target, message = loads(await reader.readexactly(FRAME_HEADER.unpack(header)[0]))
+                self.stats["received"] += 1
+                if kind == "group":
+                    await self._deliver(target, message)
+                    continue
+                try:
+                    await self.local.send(target, message)
+                except ChannelFull:
+                    self.stats["dropped"] += 1
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception("Channel layer peer connection failed")
+        finally:
+            writer.close()
+
+    # Delivers to the local members of a group one after the other. Local
+    # sends never block, so this skips the task per member that
+    # InMemoryChannelLayer.group_send creates; expired members are cleaned
+    # up by receive().
+    async def _deliver(self, group, message):
+        for channel in list(self.local.groups.get(group, ())):
+            try:
+                await self.local.send(channel, message)
+            except ChannelFull:
+                self.stats["dropped"] += 1
+
+    # Peers
+
+    def _owner(self, channel):
+        if "!" not in channel:
+            return None
+        owner = channel[:channel.index("!")].rsplit(".", 1)[-1]
+        return owner if WORKER_ID.match(owner) else None
+
+    def _list_peers(self):
+        now = time.monotonic()
+        if now - self._peers_listed_at >= self.peer_refresh:
+            try:
+                names = os.listdir(self.path)
+            except FileNotFoundError:
+                names = []
+            self._peers = [
+                name[:-len(".sock")]
+                for name in names
+                if name.endswith(".sock") and name[:-len(".sock")] != self.worker_id
+            ]
+            self._peers_listed_at = now
+        return self._peers
+
+    def _frame(self, kind, target, message):
+        from riders.encoding import dumpb
+
+        payload = dumpb([kind, target, message])
+        return FRAME_HEADER.pack(len(payload)) + payload
+
+    async def _forward(self, peer, frame):
+        writer = await self._writer(peer)
+        if writer is None:
+            return False
+        try:
+            writer.write(frame)
+            await writer.drain()
+        except ConnectionError:
+            self._writers.pop(peer, None)
+            writer.close()
+            return False
+        self.stats["forwarded"] += 1
+        return True
+
+    # One connection per peer and event loop; concurrent senders share the
+    # same connect task.
+    async def _writer(self, peer):
+        loop = asyncio.get_running_loop()
+        entry = self._writers.get(peer)
+        if entry is None or entry[0] is not loop or (entry[1].done() and entry[1].result() is None):
+            entry = (loop, loop.create_task(self._connect(peer)))
+            self._writers[peer] = entry
+
+        writer = await entry[1]
+        if writer is not None and writer.is_closing():
+            self._writers.pop(peer, None)
+            return None
+        return writer
+
+    async def _connect(self, peer):
+        path = os.path.join(self.path, f"{peer}.sock")
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+            return writer
+        except ConnectionRefusedError:
+            # Socket file left behind by a worker that is gone.
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        except OSError:
+            pass
+        if peer in self._peers:
+            self._peers.remove(peer)
+        return None
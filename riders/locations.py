@@ -0,0 +1,155 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+###########################################################################
+#                       Location Buffer Module                            #
+###########################################################################
+
+# Write-behind buffer for rider GPS pings. Only the latest position per rider
+# is kept; live reads come from here and the database is updated in batches
+# with bulk_update every LOCATION_FLUSH_INTERVAL seconds, or sooner when the
+# oldest unwritten ping is about to exceed LOCATION_MAX_STALENESS. Whatever
+# is still buffered is written out when the process exits.
+#
+# A position is only kept until it has been written: after that the
+# database row is as fresh, so idle, offline and deleted riders do not stay
+# in memory. A location saved on the profile directly (e.g. the REST profile
+# update) drops the buffered ping, so an older ping never wins over it.
+class LocationBuffer:
+    def __init__(self):
+        self._latest = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._task = None
+        self._last_flush = time.monotonic()
+        self.stats = {"pings": 0, "flushes": 0, "rows_written": 0}
+
+    def push(self, rider_id, lat, lng):
+        with self._lock:
+            self._latest[rider_id] = (float(lat), float(lng))
+            self._dirty.setdefault(rider_id, time.monotonic())
+            self.stats["pings"] += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def get(self, rider_id):
+        return self._latest.get(rider_id)
+
+    def discard(self, rider_id):
+        with self._lock:
+            self._latest.pop(rider_id, None)
+            self._dirty.pop(rider_id, None)
+
+    async def _run(self):
+        from django.conf import settings
+
+        tick = min(settings.LOCATION_FLUSH_INTERVAL, settings.LOCATION_MAX_STALENESS / 2)
+        while self._dirty:
+            await asyncio.sleep(tick)
+            if self._due(tick):
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Location flush failed")
+
+    def _due(self, tick):
+        from django.conf import settings
+
+        now = time.monotonic()
+        if now - self._last_flush >= settings.LOCATION_FLUSH_INTERVAL:
+            return True
+        oldest = min(self._dirty.values(), default=now)
+        return now - oldest + tick >= settings.LOCATION_MAX_STALENESS
+
+    def _take(self):
+        with self._lock:
+            rows = [(rider_id,) + self._latest[rider_id] for rider_id in self._dirty]
+            dirty, self._dirty = self._dirty, {}
+            self._last_flush = time.monotonic()
+            return rows, dirty
+
+    def _restore(self, dirty):
+        with self._lock:
+            for rider_id, since in dirty.items():
+                self._dirty[rider_id] = min(since, self._dirty.get(rider_id, since))
+
+    async def flush(self):
+        from riders.db import database_sync_to_async
+
+        rows, dirty = self._take()
+        if not rows:
+            return
+        try:
+            await database_sync_to_async(self._write, bounded=False)(rows)
+        except Exception:
+            self._restore(dirty)
+            raise
+        self._evict(rows)
+
+    def flush_sync(self):
+        rows, dirty = self._take()
+        if not rows:
+            return
+        try:
+            self._write(rows)
+        except Exception:
+            self._restore(dirty)
+            raise
+        self._evict(rows)
+
+    # Forgets the written positions, unless a newer ping came in meanwhile.
+    def _evict(self, rows):
+        with self._lock:
+            for rider_id, _, _ in rows:
+                if rider_id not in self._dirty:
+                    self._latest.pop(rider_id, None)
+
+    def _write(self, rows):
+        from django.conf import settings
+        from riders.models import RiderProfile
+
+        RiderProfile.objects.bulk_update(
+            [RiderProfile(id=rider_id, latitude=round(lat, 6), longitude=round(lng, 6)) for rider_id, lat, lng in rows],
+            ["latitude", "longitude"],
+            batch_size=settings.LOCATION_FLUSH_BATCH_SIZE
+        )
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(rows)
+
+
+location_buffer = LocationBuffer()
+
+
+###########################################################################
+#                       Buffer Invalidation Module                        #
+###########################################################################
+
+def profile_located(sender, instance, **kwargs):
+    update_fields = kwargs.get("update_fields")
+    # Saves that do not write the location keep the buffered ping.
+    if update_fields is not None and not {"latitude", "longitude"} & set(update_fields):
+        return
+    location_buffer.discard(instance.pk)
+
+
+# Called from RidersConfig.ready().
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    from riders.models import RiderProfile
+
+    post_save.connect(profile_located, sender=RiderProfile, dispatch_uid="location_profile_saved")
+    post_delete.connect(profile_located, sender=RiderProfile, dispatch_uid="location_profile_deleted")
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        location_buffer.flush_sync()
+    except Exception:
+        logger.exception("Location flush on exit failed")
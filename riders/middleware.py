@@ -0,0 +1,77 @@
+from urllib.parse import parse_qs
+
+AUTH_SUBPROTOCOL = "ridebooking.auth"
+TOKEN_SUBPROTOCOL_PREFIX = "ridebooking.bearer."
+
+###########################################################################
+#                       WebSocket Token Auth Module                       #
+###########################################################################
+
+# Authenticates a WebSocket handshake with the same JWT access token the
+# REST API uses, passed either as
+#
+#   ws://host/ws/riders/new_ride/7/?token=<access token>
+#
+# or, for browsers that should not put it in the URL, as a sub-protocol:
+#
+#   new WebSocket(url, ["ridebooking.auth", "ridebooking.bearer.<access token>"])
+#
+# The token sub-protocol is taken out of scope["subprotocols"] (the server
+# answers with "ridebooking.auth" or the consumer's own protocol). The
+# caller's riders.authentication.TokenPrincipal goes on scope["principal"]
+# and scope["user"] (None / AnonymousUser without a valid token); building
+# it needs no query unless the principal cache marked the user stale.
+class TokenAuthMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        from django.contrib.auth.models import AnonymousUser
+
+        scope = dict(scope)
+        raw_token, scope["subprotocols"] = self.token_from(scope)
+        principal = await self.principal_for(raw_token) if raw_token else None
+        scope["principal"] = principal
+        scope["user"] = principal or AnonymousUser()
+        return await self.inner(scope, receive, send)
+
+    def token_from(self, scope):
+        raw_token = None
+        subprotocols = []
+        for subprotocol in scope.get("subprotocols", []):
+            if subprotocol.startswith(TOKEN_SUBPROTOCOL_PREFIX):
+                raw_token = subprotocol[len(TOKEN_SUBPROTOCOL_PREFIX):]
+            else:
+                subprotocols.append(subprotocol)
+
+        if raw_token is None:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            raw_token = (query.get("token") or [None])[0]
+        return raw_token, subprotocols
+
+    async def principal_for(self, raw_token):
+        from rest_framework.exceptions import AuthenticationFailed
+        from riders.authentication import aprincipal_for_token, validate_token
+
+        try:
+            return await aprincipal_for_token(validate_token(raw_token))
+        except AuthenticationFailed:
+            return None
+
+
+###########################################################################
+#                       Server Loop Module                                #
+###########################################################################
+
+# Outermost ASGI wrapper in project/asgi.py: marks the event loop the ASGI
+# server runs the application on as the long-lived loop that coalesced
+# broadcasts may be scheduled on (riders.utils.is_server_loop).
+class ServerLoopMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        from riders.utils import mark_server_loop
+
+        mark_server_loop()
+        return await self.inner(scope, receive, send)
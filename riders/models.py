@@ -41,6 +41,13 @@ class RiderProfile(AbstractBaseUser, PermissionsMixin):
 
     objects = RiderManager()
 
+    class Meta:
+        indexes = [
+            # Keyset pages of the profile list (riders.pagination).
+            models.Index(fields=["created_at", "id"], name="rider_created_idx"),
+            models.Index(fields=["role", "created_at", "id"], name="rider_role_created_idx"),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -95,12 +102,22 @@ class Ride(models.Model):
         ('accepted', 'Accepted'),
         ('picked_up', 'Picked Up'),
         ('declined', 'Declined'),
-        ('completed', 'Completed')
+        ('completed', 'Completed'),
+        ('closed', 'Closed')
     ], default='requested')
     charges = models.DecimalField(max_digits=10, decimal_places=2)
     requested_at = models.DateTimeField(auto_now_add=True)
 
-    
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "requested_at"], name="ride_status_requested_idx"),
+            # Keyset pages of the ride list (riders.pagination); the status
+            # filter pages on ride_status_requested_idx.
+            models.Index(fields=["requested_at", "id"], name="ride_requested_idx"),
+            models.Index(fields=["rider", "requested_at", "id"], name="ride_rider_requested_idx"),
+            models.Index(fields=["user", "requested_at", "id"], name="ride_user_requested_idx"),
+        ]
+
     def __str__(self):
         return f"Ride {self.id} - {self.status}"
     
@@ -111,6 +128,13 @@ class RiderPayment(models.Model):
     paid = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pages of the payment list (riders.pagination).
+            models.Index(fields=["created_at", "id"], name="payment_created_idx"),
+            models.Index(fields=["rider", "created_at", "id"], name="payment_rider_created_idx"),
+        ]
+
     def __str__(self):
         return f"Payment for Ride {self.ride.id} - Paid: {self.paid}"
     
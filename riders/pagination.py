@@ -0,0 +1,121 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.response import Response
+from riders.encoding import dumpb, loads
+
+###########################################################################
+#                       Keyset Pagination Module                          #
+###########################################################################
+
+class InvalidPage(ValueError):
+    pass
+
+
+# Newest-first pages of a list endpoint, ordered by (ordering, id) and read
+# with a keyset condition instead of OFFSET:
+#
+#   GET /api/riders/ride/?status=completed&page_size=50
+#   GET /api/riders/ride/?status=completed&page_size=50&cursor=<next_cursor>
+#
+# The cursor is the (ordering, id) of the last row served, base64 encoded,
+# so every page is one index range scan of page_size + 1 rows however deep
+# the client goes or however large the table grows. `filters` maps query
+# parameters to (lookup, type) pairs; each model keeps an index starting
+# with the filtered column followed by (ordering, id). page_size defaults
+# to LIST_PAGE_SIZE and is capped at LIST_MAX_PAGE_SIZE. With ordering=None
+# pages go by id alone.
+class KeysetPaginator:
+    def __init__(self, ordering=None, filters=None):
+        self.ordering = ordering
+        self.filters = filters or {}
+
+    def page_size(self, request):
+        from django.conf import settings
+
+        default = getattr(settings, "LIST_PAGE_SIZE", 50)
+        maximum = getattr(settings, "LIST_MAX_PAGE_SIZE", 200)
+        try:
+            size = int(request.query_params.get("page_size", default))
+        except ValueError:
+            raise InvalidPage("page_size must be a number")
+        if size < 1:
+            raise InvalidPage("page_size must be at least 1")
+        return min(size, maximum)
+
+    def filter(self, queryset, request):
+        for param, (lookup, cast) in self.filters.items():
+            value = request.query_params.get(param)
+            if value in (None, ""):
+                continue
+            try:
+                queryset = queryset.filter(**{lookup: cast(value)})
+            except (ValueError, KeyError):
+                raise InvalidPage(f"Invalid {param} '{value}'")
+        return queryset
+
+    def encode(self, row):
+        key = [row.id] if self.ordering is None else [getattr(row, self.ordering).isoformat(), row.id]
+        return base64.urlsafe_b64encode(dumpb(key)).decode().rstrip("=")
+
+    def decode(self, cursor):
+        from django.utils.dateparse import parse_datetime
+
+        try:
+            key = loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if self.ordering is None:
+                (last_id,) = key
+                return None, int(last_id)
+            last_value, last_id = key
+            last_value = parse_datetime(last_value)
+            if last_value is None:
+                raise ValueError(cursor)
+            return last_value, int(last_id)
+        except (ValueError, TypeError, binascii.Error):
+            raise InvalidPage("Invalid cursor")
+
+    # (rows, next cursor or None on the last page)
+    def paginate(self, queryset, request):
+        size = self.page_size(request)
+        queryset = self.filter(queryset, request)
+
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            last_value, last_id = self.decode(cursor)
+            if self.ordering is None:
+                queryset = queryset.filter(id__lt=last_id)
+            else:
+                # The plain range on the ordering column is what the index
+                # seeks on; the OR only settles ties on the same timestamp.
+                queryset = queryset.filter(**{f"{self.ordering}__lte": last_value}).filter(
+                    Q(**{f"{self.ordering}__lt": last_value}) | Q(**{self.ordering: last_value, "id__lt": last_id})
+                )
+
+        ordering = ["-id"] if self.ordering is None else [f"-{self.ordering}", "-id"]
+        rows = list(queryset.order_by(*ordering)[:size + 1])
+        if len(rows) > size:
+            rows = rows[:size]
+            return rows, self.encode(rows[-1])
+        return rows, None
+
+
+# The usual {"status", "message", "data"} answer for one page, with the
+# cursor of the next page beside it (null on the last one).
+def paginated_response(request, queryset, paginator, serializer_class, message):
+    try:
+        rows, next_cursor = paginator.paginate(queryset, request)
+    except InvalidPage as exc:
+        return Response({
+            "status": False,
+            "message": str(exc),
+            "data": None
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        "status": True,
+        "message": message,
+        "data": serializer_class(rows, many=True).data,
+        "next_cursor": next_cursor
+    }, status=status.HTTP_200_OK)
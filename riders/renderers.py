@@ -0,0 +1,30 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from riders.encoding import dumpb, loads
+
+###########################################################################
+#                       Fast JSON Renderer & Parser Module                #
+###########################################################################
+
+# Drop-in replacements for DRF's JSONRenderer/JSONParser that go through
+# riders.encoding. Indented output (browsable API, "; indent=4" in the
+# Accept header) is still left to DRF.
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumpb(data)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
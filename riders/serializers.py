@@ -1,6 +1,6 @@
 from rest_framework import serializers
-from .models import RiderProfile, Vehicle, Ride, RiderPayment, Ratings
-from django.contrib.auth.hashers import make_password
+from .models import RiderProfile, Vehicle, Ride, RiderPayment
+from riders.hashing import password_hasher
 
 class RiderProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,13 +19,16 @@ class RiderProfileSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(errors)
         return data
     
+    # context={"password_hashed": True}: the password was already hashed
+    # (async signup, riders.hashing.password_hasher.amake).
     def create(self, validated_data):
-        validated_data['password'] = make_password(validated_data['password'])
+        if not self.context.get("password_hashed"):
+            validated_data['password'] = password_hasher.make(validated_data['password'])
         return super().create(validated_data)
     
     def update(self, instance, validated_data):
         if 'password' in validated_data:
-            instance.password = make_password(validated_data['password'])
+            instance.password = password_hasher.make(validated_data['password'])
             validated_data.pop('password')
         return super().update(instance, validated_data)
     
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import io
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.test import APIClient, APIRequestFactory
+from riders import dispatch, geo, utils
+from riders.authentication import principal_cache, principal_for_token, principal_token
+from riders.db import unit_of_work
+from riders.encoding import dumps, loads
+from riders.executors import BoundedExecutor, ExecutorBusy
+from riders.hashing import HashingBusy, password_hasher
+from riders.geo import ANY, GridIndex
+from riders.layers import LocalSocketChannelLayer
+from riders.locations import LocationBuffer, location_buffer
+from riders.models import RiderProfile, Ride, Vehicle
+from riders.pagination import InvalidPage, KeysetPaginator
+from riders.renderers import FastJSONParser, FastJSONRenderer
+from riders.timeouts import TimingWheel, expire_rides
+from riders.trails import Trail, TrailStore
+from riders.wire import ABSOLUTE_FRAME, DELTA_FRAME, LocationDecoder, LocationEncoder, WireError
+from riders.transitions import sources, transition, transition_many
+
+
+def create_profile(email, role, **fields):
+    return RiderProfile.objects.create(
+        name=email.split("@")[0], email=email, phone="9876543210",
+        role=role, latitude=23.0225, longitude=72.5714, **fields
+    )
+
+
+def create_ride(user, **fields):
+    fields.setdefault("vehicle_type", "CAR")
+    return Ride.objects.create(
+        user=user, user_name=user.name, user_phone=user.phone,
+        pickup_location="A", pickup_latitude=23.0225, pickup_longitude=72.5714,
+        drop_location="B", drop_latitude=23.0325, drop_longitude=72.5814,
+        charges=100, **fields
+    )
+
+
+def create_vehicle(rider, vehicle_type="CAR"):
+    return Vehicle.objects.create(rider=rider, vehicle_number=f"GJ01{rider.id:04d}", vehicle_type=vehicle_type)
+
+
+# APIClient sending `profile`'s access token.
+def client_for(profile):
+    return client_for_token(principal_token(profile).access_token)
+
+
+def client_for_token(token):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+###########################################################################
+#                       Ride State Machine Tests                          #
+###########################################################################
+
+class RideTransitionTableTests(SimpleTestCase):
+    def test_sources_are_the_legal_predecessors(self):
+        self.assertEqual(sources("accepted"), {"requested"})
+        self.assertEqual(sources("picked_up"), {"accepted"})
+        self.assertEqual(sources("completed"), {"accepted", "picked_up"})
+        self.assertEqual(sources("declined"), {"requested", "accepted"})
+        self.assertEqual(sources("requested"), {"accepted"})
+        self.assertEqual(sources("closed"), {"requested"})
+
+    def test_expected_narrows_the_sources(self):
+        self.assertEqual(sources("declined", expected=["accepted"]), {"accepted"})
+
+    def test_illegal_expected_state_is_rejected(self):
+        with self.assertRaises(ValueError):
+            sources("accepted", expected=["completed"])
+
+    def test_unknown_target_is_rejected(self):
+        with self.assertRaises(ValueError):
+            sources("flying")
+
+
+class RideTransitionTests(TestCase):
+    def setUp(self):
+        self.user = create_profile("user@example.com", "USER")
+        self.first = create_profile("first@example.com", "RIDER")
+        self.second = create_profile("second@example.com", "RIDER")
+        self.ride = create_ride(self.user)
+
+    def test_only_the_first_accept_wins(self):
+        self.assertTrue(transition(self.ride.id, "accepted", rider_id=self.first.id, otp="123456"))
+        self.assertFalse(transition(self.ride.id, "accepted", rider_id=self.second.id, otp="654321"))
+
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.status, "accepted")
+        self.assertEqual(self.ride.rider_id, self.first.id)
+        self.assertEqual(self.ride.otp, "123456")
+
+    def test_illegal_transition_changes_nothing(self):
+        self.assertFalse(transition(self.ride.id, "picked_up"))
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.status, "requested")
+
+    def test_where_filters_the_update(self):
+        transition(self.ride.id, "accepted", rider_id=self.first.id)
+
+        self.assertFalse(transition(self.ride.id, "completed", where={"rider_id": self.second.id}))
+        self.assertTrue(transition(self.ride.id, "completed", where={"rider_id": self.first.id}))
+
+    def test_finished_rides_stay_finished(self):
+        transition(self.ride.id, "declined")
+        for state in ("accepted", "requested", "closed"):
+            self.assertFalse(transition(self.ride.id, state))
+
+    def test_transition_many_moves_only_legal_rides(self):
+        open_ride = create_ride(self.user)
+        taken_ride = create_ride(self.user)
+        transition(taken_ride.id, "accepted", rider_id=self.first.id)
+
+        moved = transition_many([self.ride.id, open_ride.id, taken_ride.id], "closed")
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(
+            dict(Ride.objects.values_list("id", "status")),
+            {self.ride.id: "closed", open_ride.id: "closed", taken_ride.id: "accepted"}
+        )
+        self.assertEqual(transition_many([self.ride.id, open_ride.id], "closed"), 0)
+
+
+# The REST actions and their async twins must not act on a ride that was
+# handed to another rider after it was read.
+class RideActionRiderTests(TestCase):
+    actions = ["/api/riders/ride/{}/{}/", "/api/riders/async/ride/{}/{}/"]
+
+    def setUp(self):
+        principal_cache.clear()
+        self.user = create_profile("user@example.com", "USER")
+        self.first = create_profile("first@example.com", "RIDER")
+        self.second = create_profile("second@example.com", "RIDER")
+        create_vehicle(self.first)
+        create_vehicle(self.second)
+
+    def test_rider_cannot_pick_up_another_riders_ride(self):
+        for url in self.actions:
+            with self.subTest(url=url):
+                ride = create_ride(self.user)
+                transition(ride.id, "accepted", rider_id=self.first.id)
+
+                response = client_for(self.second).post(url.format(ride.id, "pickup"))
+
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(Ride.objects.get(id=ride.id).status, "accepted")
+                self.assertEqual(client_for(self.first).post(url.format(ride.id, "pickup")).status_code, 200)
+
+    def test_stale_decline_leaves_the_new_riders_ride_alone(self):
+        for url in self.actions:
+            with self.subTest(url=url):
+                ride = create_ride(self.user)
+                transition(ride.id, "accepted", rider_id=self.first.id)
+                stale = Ride.objects.get(id=ride.id)
+
+                # The first rider gives the ride back and the second takes it
+                # before the first rider's decline gets to the UPDATE.
+                transition(ride.id, "requested", rider_id=None)
+                transition(ride.id, "accepted", rider_id=self.second.id)
+                with mock.patch.object(QuerySet, "get", return_value=stale), \
+                        mock.patch.object(QuerySet, "aget", return_value=stale, new_callable=mock.AsyncMock):
+                    response = client_for(self.first).post(url.format(ride.id, "decline"))
+
+                self.assertEqual(response.status_code, 400)
+                ride.refresh_from_db()
+                self.assertEqual((ride.status, ride.rider_id), ("accepted", self.second.id))
+
+
+# The consumer's database work runs on riders.db.db_executor threads, which
+# only see committed rows.
+class RideConsumerAcceptTests(TransactionTestCase):
+    def setUp(self):
+        from channels.layers import get_channel_layer
+        from riders.consumers import RideConsumer
+
+        principal_cache.clear()
+        self.user = create_profile("user@example.com", "USER")
+        self.rider = create_profile("rider@example.com", "RIDER")
+        create_vehicle(self.rider)
+        self.consumer = RideConsumer()
+        self.consumer.rider_id = self.rider.id
+        self.consumer.channel_layer = get_channel_layer()
+        self.consumer.send = mock.AsyncMock()
+
+    def accept(self, ride):
+        with mock.patch("riders.broadcasts.broadcast_scheduler.request") as request:
+            asyncio.run(self.consumer.accept_ride(ride.id))
+        return request
+
+    def test_winner_requests_an_availability_broadcast(self):
+        ride = create_ride(self.user)
+
+        request = self.accept(ride)
+
+        request.assert_called_once_with(availability=True)
+        self.assertEqual(Ride.objects.get(id=ride.id).rider_id, self.rider.id)
+
+    def test_loser_requests_no_broadcast(self):
+        other = create_profile("other@example.com", "RIDER")
+        ride = create_ride(self.user, status="accepted", rider=other)
+
+        request = self.accept(ride)
+
+        request.assert_not_called()
+        self.assertIn("Ride already taken", self.consumer.send.call_args.kwargs["text_data"])
+
+
+###########################################################################
+#                       Grid Index Delta Tests                            #
+###########################################################################
+
+class GridIndexChangesTests(SimpleTestCase):
+    def setUp(self):
+        self.index = GridIndex(cell_degrees=1.0, change_log=16)
+
+    def test_changes_are_compacted_per_entry(self):
+        self.index.add(1, "CAR", 0.5, 0.5)
+        self.index.add(2, "CAR", 0.6, 0.6)
+        version = self.index.version
+
+        self.index.move(1, 0.7, 0.7)
+        self.index.move(1, 0.8, 0.8)
+        self.index.add(3, "BIKE", 0.1, 0.1)
+        self.index.move(3, 0.2, 0.2)
+        self.index.remove(2)
+
+        self.assertEqual(self.index.changes_since(version), (7, [
+            ("move", 1, "CAR", 0.8, 0.8),
+            ("add", 3, "BIKE", 0.2, 0.2),
+            ("remove", 2, None, None, None),
+        ]))
+
+    def test_up_to_date_caller_gets_no_changes(self):
+        self.index.add(1, "CAR", 0.5, 0.5)
+        self.assertEqual(self.index.changes_since(self.index.version), (1, []))
+
+    def test_replaying_the_changes_rebuilds_the_index(self):
+        self.index.add(1, "CAR", 0.5, 0.5)
+        self.index.add(2, "CAR", 0.6, 0.6)
+        version, entries = self.index.snapshot()
+        replica = {entry_id: (key, lat, lng) for entry_id, key, lat, lng in entries}
+
+        self.index.move(2, 0.9, 0.9)
+        self.index.remove(1)
+        self.index.add(1, "BIKE", 0.3, 0.3)
+        self.index.add(4, "CAR", 0.4, 0.4)
+
+        _, changes = self.index.changes_since(version)
+        for op, entry_id, key, lat, lng in changes:
+            if op == "remove":
+                replica.pop(entry_id, None)
+            else:
+                replica[entry_id] = (key, lat, lng)
+
+        self.assertEqual(replica, {
+            entry_id: (key, lat, lng) for entry_id, key, lat, lng in self.index.snapshot()[1]
+        })
+
+    def test_caller_behind_the_horizon_needs_a_snapshot(self):
+        index = GridIndex(cell_degrees=1.0, change_log=2)
+        for entry_id in range(3):
+            index.add(entry_id, "CAR", 0.5, 0.5)
+
+        self.assertEqual(index.changes_since(0), (3, None))
+        self.assertIsNotNone(index.changes_since(1)[1])
+
+    def test_caller_ahead_of_the_index_needs_a_snapshot(self):
+        self.index.add(1, "CAR", 0.5, 0.5)
+        self.assertEqual(self.index.changes_since(5), (1, None))
+
+    def test_index_without_a_change_log_has_no_deltas(self):
+        index = GridIndex(cell_degrees=1.0)
+        index.add(1, "CAR", 0.5, 0.5)
+        self.assertEqual(index.changes_since(0), (0, None))
+
+    def test_cells_filter_turns_crossings_into_adds_and_removes(self):
+        self.index.add(1, "CAR", 0.5, 0.5)
+        self.index.add(2, "CAR", 5.5, 5.5)
+        self.index.add(3, "CAR", 0.4, 0.4)
+        version = self.index.version
+
+        self.index.move(1, 5.6, 5.6)
+        self.index.move(2, 0.6, 0.6)
+        self.index.move(3, 0.3, 0.3)
+        self.index.add(4, "CAR", 9.5, 9.5)
+
+        self.assertEqual(self.index.changes_since(version, cells={(0, 0)}), (7, [
+            ("remove", 1, None, None, None),
+            ("add", 2, "CAR", 0.6, 0.6),
+            ("move", 3, "CAR", 0.3, 0.3),
+        ]))
+
+    def test_cells_filter_without_crossing_history_sends_adds(self):
+        index = GridIndex(cell_degrees=1.0, change_log=16)
+        index.add(1, "CAR", 0.5, 0.5)
+        version = index.version
+        for step in range(10):
+            index.move(1, 0.5 + step % 2 * 5, 0.5)
+
+        self.assertEqual(index.changes_since(version, cells={(0, 0)})[1], [
+            ("remove", 1, None, None, None)
+        ])
+        index.move(1, 0.5, 0.5)
+        self.assertEqual(index.changes_since(version, cells={(0, 0)})[1], [
+            ("add", 1, "CAR", 0.5, 0.5)
+        ])
+
+
+###########################################################################
+#                       Ride Expiry Tests                                 #
+###########################################################################
+
+class TimingWheelTests(SimpleTestCase):
+    def setUp(self):
+        self.wheel = TimingWheel(tick=1.0, slots=8)
+        self.start = self.wheel._cursor * self.wheel.tick
+
+    def test_deadline_fires_once_its_tick_has_passed(self):
+        self.wheel.schedule("ride", self.start + 2.5)
+
+        self.assertEqual(self.wheel.advance(self.start + 2.9), [])
+        self.assertEqual(self.wheel.advance(self.start + 3.0), ["ride"])
+        self.assertNotIn("ride", self.wheel)
+        self.assertEqual(self.wheel.advance(self.start + 4.0), [])
+
+    def test_cancelled_deadline_never_fires(self):
+        self.wheel.schedule("ride", self.start + 1.5)
+
+        self.assertTrue(self.wheel.cancel("ride"))
+        self.assertFalse(self.wheel.cancel("ride"))
+        self.assertEqual(self.wheel.advance(self.start + 5.0), [])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_rescheduling_replaces_the_deadline(self):
+        self.wheel.schedule("ride", self.start + 1.5)
+        self.wheel.schedule("ride", self.start + 4.5)
+
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self.wheel.advance(self.start + 3.0), [])
+        self.assertEqual(self.wheel.advance(self.start + 5.0), ["ride"])
+
+    def test_deadline_a_turn_away_waits_for_its_turn(self):
+        self.wheel.schedule("ride", self.start + 10.5)
+
+        self.assertEqual(self.wheel.advance(self.start + 8.0), [])
+        self.assertIn("ride", self.wheel)
+        self.assertEqual(self.wheel.advance(self.start + 11.0), ["ride"])
+
+    def test_past_deadline_fires_on_the_next_advance(self):
+        self.wheel.advance(self.start + 3.0)
+        self.wheel.schedule("ride", self.start - 10.0)
+
+        self.assertEqual(self.wheel.advance(self.start + 4.0), ["ride"])
+
+    def test_stall_longer_than_a_turn_expires_everything_due(self):
+        for offset in range(1, 6):
+            self.wheel.schedule(offset, self.start + offset + 0.5)
+
+        self.assertEqual(sorted(self.wheel.advance(self.start + 100.0)), [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.wheel), 0)
+
+
+@override_settings(RIDE_REQUEST_TIMEOUT=300, RIDE_EXPIRY_BATCH_SIZE=10)
+class ExpireRidesTests(TestCase):
+    def setUp(self):
+        self.user = create_profile("user@example.com", "USER")
+        self.rider = create_profile("rider@example.com", "RIDER")
+        self.now = timezone.now()
+
+    def requested(self, seconds_ago, **fields):
+        ride = create_ride(self.user, **fields)
+        Ride.objects.filter(id=ride.id).update(requested_at=self.now - timedelta(seconds=seconds_ago))
+        return ride
+
+    def test_closes_only_timed_out_requests(self):
+        old = self.requested(600)
+        fresh = self.requested(60)
+        accepted = self.requested(600, status="accepted", rider=self.rider)
+
+        self.assertEqual(expire_rides(now=self.now), [(old.id, self.user.id)])
+        self.assertEqual(
+            dict(Ride.objects.values_list("id", "status")),
+            {old.id: "closed", fresh.id: "requested", accepted.id: "accepted"}
+        )
+        self.assertEqual(expire_rides(now=self.now), [])
+
+    def test_closes_the_given_rides_regardless_of_age(self):
+        first = self.requested(60)
+        second = self.requested(30)
+        accepted = self.requested(60, status="accepted", rider=self.rider)
+
+        expired = expire_rides(ride_ids=[first.id, second.id, accepted.id])
+
+        self.assertEqual(expired, [(first.id, self.user.id), (second.id, self.user.id)])
+        self.assertEqual(Ride.objects.get(id=accepted.id).status, "accepted")
+
+    @override_settings(RIDE_EXPIRY_BATCH_SIZE=2)
+    def test_closes_at_most_one_batch_oldest_first(self):
+        rides = [self.requested(900 - step * 100) for step in range(3)]
+
+        self.assertEqual([ride_id for ride_id, _ in expire_rides(now=self.now)], [rides[0].id, rides[1].id])
+        self.assertEqual([ride_id for ride_id, _ in expire_rides(now=self.now)], [rides[2].id])
+
+
+###########################################################################
+#                       Location Wire Format Tests                        #
+###########################################################################
+
+class LocationWireTests(SimpleTestCase):
+    def test_points_round_trip_through_one_message(self):
+        encoder = LocationEncoder()
+        points = [
+            (23.022505, 72.571362, 1700000000000),
+            (23.022611, 72.571401, 1700000001000),
+            (23.022700, 72.571300, 1700000002500),
+        ]
+
+        message = b"".join(encoder.encode(*point) for point in points)
+
+        self.assertEqual(len(message), ABSOLUTE_FRAME.size + 2 * DELTA_FRAME.size)
+        self.assertEqual(LocationDecoder().decode(message), points)
+
+    def test_large_jumps_fall_back_to_absolute_records(self):
+        encoder = LocationEncoder()
+        decoder = LocationDecoder()
+        points = [
+            (23.0225, 72.5714, 1700000000000),
+            (28.6139, 77.2090, 1700000001000),
+            (28.6139, 77.2090, 1700000100000),
+            (28.6139, 77.2090, 1699999999000),
+        ]
+
+        for point in points:
+            data = encoder.encode(*point)
+            self.assertEqual(len(data), ABSOLUTE_FRAME.size)
+            self.assertEqual(decoder.decode(data), [point])
+
+    def test_decoder_keeps_its_reference_across_messages(self):
+        encoder = LocationEncoder()
+        decoder = LocationDecoder()
+
+        decoder.decode(encoder.encode(23.0225, 72.5714, 1700000000000))
+        data = encoder.encode(23.0226, 72.5715, 1700000000500)
+
+        self.assertEqual(len(data), DELTA_FRAME.size)
+        self.assertEqual(decoder.decode(data), [(23.0226, 72.5715, 1700000000500)])
+
+    def test_malformed_messages_are_rejected(self):
+        absolute = LocationEncoder().encode(23.0225, 72.5714, 1700000000000)
+        delta = DELTA_FRAME.pack(2, 10, 10, 100)
+
+        for data in (absolute[:-1], b"\x07" + absolute[1:], delta):
+            with self.assertRaises(WireError):
+                LocationDecoder().decode(data)
+
+
+###########################################################################
+#                       Keyset Pagination Tests                           #
+###########################################################################
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.user = create_profile("user@example.com", "USER")
+        self.rider = create_profile("rider@example.com", "RIDER")
+        self.paginator = KeysetPaginator("requested_at", {
+            "status": ("status", str),
+            "rider": ("rider_id", int),
+        })
+
+        # Two pairs of rides share a timestamp, so pages have to break ties
+        # on id.
+        now = timezone.now()
+        self.rides = []
+        for seconds_ago in (50, 40, 40, 30, 30, 20, 10):
+            ride = create_ride(self.user)
+            Ride.objects.filter(id=ride.id).update(requested_at=now - timedelta(seconds=seconds_ago))
+            self.rides.append(ride.id)
+
+    def request(self, **params):
+        return Request(APIRequestFactory().get("/", params))
+
+    def walk(self, **params):
+        pages = []
+        cursor = None
+        while True:
+            query = dict(params, cursor=cursor) if cursor else params
+            rows, cursor = self.paginator.paginate(Ride.objects.all(), self.request(**query))
+            pages.append([row.id for row in rows])
+            if cursor is None:
+                return pages
+
+    def test_pages_walk_every_row_once_newest_first(self):
+        pages = self.walk(page_size=2)
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), [
+            self.rides[6], self.rides[5], self.rides[4], self.rides[3],
+            self.rides[2], self.rides[1], self.rides[0],
+        ])
+
+    def test_last_full_page_has_no_cursor(self):
+        rows, cursor = self.paginator.paginate(Ride.objects.all(), self.request(page_size=7))
+        self.assertEqual(len(rows), 7)
+        self.assertIsNone(cursor)
+
+    def test_cursor_round_trips(self):
+        ride = Ride.objects.get(id=self.rides[2])
+        self.assertEqual(self.paginator.decode(self.paginator.encode(ride)), (ride.requested_at, ride.id))
+
+        by_id = KeysetPaginator()
+        self.assertEqual(by_id.decode(by_id.encode(ride)), (None, ride.id))
+
+    def test_filters_apply_to_every_page(self):
+        Ride.objects.filter(id__in=self.rides[:3]).update(status="accepted", rider=self.rider)
+
+        self.assertEqual(self.walk(page_size=2, status="accepted"), [
+            [self.rides[2], self.rides[1]], [self.rides[0]]
+        ])
+        self.assertEqual(sum(self.walk(rider=self.rider.id), []), self.rides[2::-1])
+
+    def test_page_size_is_capped(self):
+        with self.settings(LIST_MAX_PAGE_SIZE=3):
+            rows, cursor = self.paginator.paginate(Ride.objects.all(), self.request(page_size=100))
+        self.assertEqual(len(rows), 3)
+        self.assertIsNotNone(cursor)
+
+    def test_bad_input_is_rejected(self):
+        cases = [
+            ({"cursor": "not a cursor"}, "Invalid cursor"),
+            ({"cursor": KeysetPaginator().encode(Ride.objects.first())}, "Invalid cursor"),
+            ({"page_size": "ten"}, "page_size must be a number"),
+            ({"page_size": "0"}, "page_size must be at least 1"),
+            ({"rider": "abc"}, "Invalid rider 'abc'"),
+        ]
+        for params, message in cases:
+            with self.subTest(params=params):
+                with self.assertRaisesMessage(InvalidPage, message):
+                    self.paginator.paginate(Ride.objects.all(), self.request(**params))
+
+
+###########################################################################
+#                       Bounded Executor Tests                            #
+###########################################################################
+
+class BoundedExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = BoundedExecutor(workers=1, max_queue=1)
+        self.release = threading.Event()
+        self.threads = []
+
+    def tearDown(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(5)
+
+    def call_in_thread(self, **kwargs):
+        thread = threading.Thread(target=self.executor.call, args=(self.release.wait, 5), kwargs=kwargs)
+        thread.start()
+        self.threads.append(thread)
+
+    def wait_for(self, **gauges):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            snapshot = self.executor.snapshot()
+            if all(snapshot[name] == value for name, value in gauges.items()):
+                return
+            time.sleep(0.01)
+        self.fail(f"executor never reached {gauges}")
+
+    def test_full_queue_rejects_straight_away(self):
+        self.call_in_thread()
+        self.wait_for(in_flight=1, queued=0)
+        self.call_in_thread()
+        self.wait_for(queued=1)
+
+        with self.assertRaises(ExecutorBusy):
+            self.executor.call(len, "ride")
+        self.assertEqual(self.executor.snapshot()["rejected"], 1)
+
+        self.release.set()
+        self.wait_for(completed=2)
+        self.assertEqual(self.executor.call(len, "ride"), 4)
+
+    def test_unbounded_calls_skip_the_limit(self):
+        self.call_in_thread()
+        self.wait_for(in_flight=1, queued=0)
+        self.call_in_thread()
+        self.wait_for(queued=1)
+        self.call_in_thread(bounded=False)
+        self.wait_for(queued=2)
+
+        self.release.set()
+        self.wait_for(completed=3, queued=0, in_flight=0)
+        self.assertEqual(self.executor.snapshot()["rejected"], 0)
+
+    def test_cancelled_waiting_calls_leave_the_queue(self):
+        executor = BoundedExecutor(workers=1, max_queue=3)
+        self.executor = executor
+        self.call_in_thread()
+        self.wait_for(in_flight=1, queued=0)
+
+        async def cancel_waiting():
+            tasks = [asyncio.ensure_future(executor.run(len, "ride")) for _ in range(3)]
+            await asyncio.sleep(0)
+            self.assertEqual(executor.snapshot()["queued"], 3)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run(cancel_waiting())
+        self.assertEqual(executor.snapshot()["queued"], 0)
+
+        self.release.set()
+        self.wait_for(completed=1, in_flight=0)
+        self.assertEqual(executor.call(len, "ride"), 4)
+        self.assertEqual(executor.snapshot()["rejected"], 0)
+
+
+###########################################################################
+#                       Token Principal Tests                             #
+###########################################################################
+
+@override_settings(PRINCIPAL_CACHE_TTL=60)
+class TokenPrincipalTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.rider = create_profile("rider@example.com", "RIDER")
+        create_vehicle(self.rider, "BIKE")
+        principal_cache.clear()
+
+    def token(self, age=0):
+        token = principal_token(self.rider).access_token
+        token["iat"] = int(time.time()) - age
+        return token
+
+    def test_fresh_token_claims_need_no_query(self):
+        token = self.token()
+        with self.assertNumQueries(0):
+            principal = principal_for_token(token)
+        self.assertEqual((principal.id, principal.role, principal.vehicle_type), (self.rider.id, "RIDER", "BIKE"))
+
+    def test_token_claims_expire_after_the_ttl(self):
+        # Changed behind the signals' back, as another process would.
+        RiderProfile.objects.filter(id=self.rider.id).update(role="USER")
+
+        self.assertEqual(principal_for_token(self.token(age=30)).role, "RIDER")
+        with self.assertNumQueries(1):
+            self.assertEqual(principal_for_token(self.token(age=90)).role, "USER")
+        with self.assertNumQueries(0):
+            self.assertEqual(principal_for_token(self.token(age=90)).role, "USER")
+
+    def test_role_change_is_reloaded(self):
+        token = self.token()
+        principal_for_token(token)
+
+        self.rider.role = "ADMIN"
+        self.rider.save()
+
+        self.assertEqual(principal_for_token(token).role, "ADMIN")
+
+    def test_vehicle_change_is_reloaded(self):
+        token = self.token()
+        principal_for_token(token)
+
+        vehicle = self.rider.vehicle
+        vehicle.vehicle_type = "AUTO"
+        vehicle.save()
+
+        self.assertEqual(principal_for_token(token).vehicle_type, "AUTO")
+
+    def test_location_save_keeps_the_cached_claims(self):
+        token = self.token()
+        principal_for_token(token)
+
+        self.rider.latitude = 23.1
+        self.rider.save(update_fields=["latitude"])
+
+        with self.assertNumQueries(0):
+            principal_for_token(token)
+
+    def test_deleted_user_is_rejected(self):
+        token = self.token()
+        principal_for_token(token)
+
+        self.rider.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            principal_for_token(token)
+        response = client_for_token(token).get("/api/riders/ride/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_without_claims_loads_them(self):
+        token = RefreshToken.for_user(self.rider).access_token
+        self.assertNotIn("role", token)
+
+        with self.assertNumQueries(1):
+            principal = principal_for_token(token)
+        self.assertEqual((principal.role, principal.vehicle_type), ("RIDER", "BIKE"))
+
+
+###########################################################################
+#                       Local Socket Channel Layer Tests                  #
+###########################################################################
+
+class LocalSocketChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.path = os.path.join(root, "channels")
+
+    def layer(self):
+        return LocalSocketChannelLayer(path=self.path, peer_refresh=0)
+
+    def run_layers(self, scenario, *layers):
+        async def run():
+            try:
+                await scenario(*layers)
+            finally:
+                for layer in layers:
+                    await layer.close()
+        asyncio.run(run())
+
+    def test_send_is_forwarded_to_the_owning_worker(self):
+        async def scenario(first, second):
+            channel = await second.new_channel()
+            await first.new_channel()
+
+            await first.send(channel, {"type": "ride.update", "ride_id": 7})
+
+            message = await asyncio.wait_for(second.receive(channel), 2)
+            self.assertEqual(message, {"type": "ride.update", "ride_id": 7})
+            self.assertEqual(first.stats["forwarded"], 1)
+
+        self.run_layers(scenario, self.layer(), self.layer())
+
+    def test_group_send_reaches_members_in_every_worker(self):
+        async def scenario(first, second):
+            local = await first.new_channel()
+            remote = await second.new_channel()
+            await first.group_add("rider_availability", local)
+            await second.group_add("rider_availability", remote)
+
+            await first.group_send("rider_availability", {"type": "availability", "version": 3})
+
+            for layer, channel in ((first, local), (second, remote)):
+                message = await asyncio.wait_for(layer.receive(channel), 2)
+                self.assertEqual(message["version"], 3)
+
+        self.run_layers(scenario, self.layer(), self.layer())
+
+    def test_socket_of_a_dead_worker_is_cleaned_up(self):
+        async def scenario(layer):
+            await layer.new_channel()
+            stale = os.path.join(self.path, "w1x000000.sock")
+            with socket.socket(socket.AF_UNIX) as dead:
+                dead.bind(stale)
+
+            await layer.send("specific.w1x000000!abc", {"type": "ride.update"})
+
+            self.assertEqual(layer.stats["dropped"], 1)
+            self.assertFalse(os.path.exists(stale))
+            await layer.group_send("rider_availability", {"type": "availability"})
+            self.assertEqual(layer.stats["forwarded"], 0)
+
+        self.run_layers(scenario, self.layer())
+
+    def test_directory_open_to_other_users_is_refused(self):
+        os.makedirs(self.path)
+        os.chmod(self.path, 0o755)
+
+        async def scenario(layer):
+            with self.assertRaises(ImproperlyConfigured):
+                await layer.new_channel()
+
+        self.run_layers(scenario, self.layer())
+        self.assertEqual(os.listdir(self.path), [])
+
+
+###########################################################################
+#                       Location Buffer Tests                             #
+###########################################################################
+
+# flush() writes on riders.db.db_executor threads, which only see committed
+# rows.
+@override_settings(LOCATION_FLUSH_INTERVAL=60, LOCATION_MAX_STALENESS=120)
+class LocationBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.rider = create_profile("rider@example.com", "RIDER")
+        self.addCleanup(location_buffer.discard, self.rider.id)
+
+    def test_push_flush_get(self):
+        buffer = LocationBuffer()
+
+        async def push_and_flush():
+            buffer.push(self.rider.id, 23.05, 72.55)
+            self.assertEqual(buffer.get(self.rider.id), (23.05, 72.55))
+            await buffer.flush()
+
+        asyncio.run(push_and_flush())
+
+        self.assertIsNone(buffer.get(self.rider.id))
+        self.rider.refresh_from_db()
+        self.assertEqual((float(self.rider.latitude), float(self.rider.longitude)), (23.05, 72.55))
+        self.assertEqual(buffer.stats["rows_written"], 1)
+
+    def test_ping_newer_than_the_flush_is_kept(self):
+        buffer = LocationBuffer()
+
+        async def push_during_flush():
+            buffer.push(self.rider.id, 23.05, 72.55)
+            with mock.patch.object(buffer, "_write", side_effect=lambda rows: buffer.push(self.rider.id, 23.06, 72.56)):
+                await buffer.flush()
+
+        asyncio.run(push_during_flush())
+
+        self.assertEqual(buffer.get(self.rider.id), (23.06, 72.56))
+
+    def test_direct_location_save_drops_the_buffered_ping(self):
+        from riders.geo import load_available_riders
+
+        async def push():
+            location_buffer.push(self.rider.id, 23.05, 72.55)
+
+        asyncio.run(push())
+        self.rider.is_available = False
+        self.rider.save(update_fields=["is_available"])
+        self.assertEqual(location_buffer.get(self.rider.id), (23.05, 72.55))
+
+        self.rider.is_available = True
+        self.rider.latitude = 23.1
+        self.rider.save()
+
+        self.assertIsNone(location_buffer.get(self.rider.id))
+        self.assertEqual([float(lat) for _, _, lat, _ in load_available_riders()], [23.1])
+
+
+###########################################################################
+#                       Location Trail Tests                              #
+###########################################################################
+
+class TrailTests(SimpleTestCase):
+    def test_ring_keeps_the_newest_points_in_order(self):
+        trail = Trail(3)
+        for step in range(5):
+            trail.append(23.0 + step / 100, 72.5, 1000.0 + step)
+
+        self.assertEqual(len(trail), 3)
+        self.assertEqual(trail.points(), [(23.02, 72.5, 1002.0), (23.03, 72.5, 1003.0), (23.04, 72.5, 1004.0)])
+        self.assertEqual(trail.latest(), (23.04, 72.5, 1004.0))
+
+    def test_since_returns_only_later_points_across_the_wrap(self):
+        trail = Trail(4)
+        for step in range(6):
+            trail.append(23.0, 72.5, 1000.0 + step)
+
+        self.assertEqual([point[2] for point in trail.points(since=1002.0)], [1003.0, 1004.0, 1005.0])
+        self.assertEqual([point[2] for point in trail.points(since=1002.5)], [1003.0, 1004.0, 1005.0])
+        self.assertEqual(len(trail.points(since=999.0)), 4)
+        self.assertEqual(trail.points(since=1005.0), [])
+
+    def test_timestamps_never_go_backwards(self):
+        trail = Trail(3)
+        trail.append(23.0, 72.5, 1000.0)
+        trail.append(23.1, 72.5, 990.0)
+
+        self.assertEqual(trail.latest(), (23.1, 72.5, 1000.0))
+
+
+class TrailStoreTests(SimpleTestCase):
+    def test_motion_gives_heading_and_speed(self):
+        from riders.utils import distance_km
+
+        store = TrailStore(size=10)
+        store.append(1, 23.00, 72.50, 1000.0)
+        self.assertIsNone(store.motion(1))
+
+        store.append(1, 23.01, 72.50, 1030.0)
+        self.assertEqual(store.motion(1), {
+            "heading": 0.0,
+            "speed_kmh": round(distance_km(23.00, 72.50, 23.01, 72.50) / 30 * 3600, 1),
+        })
+
+        store.append(1, 23.01, 72.51, 1060.0)
+        self.assertEqual(store.motion(1, window=30)["heading"], 90.0)
+        self.assertIsNone(store.motion(2))
+
+    def test_eta_needs_a_moving_rider(self):
+        store = TrailStore(size=10)
+        store.append(1, 23.00, 72.50, 1000.0)
+        store.append(1, 23.00, 72.50, 1030.0)
+        self.assertIsNone(store.eta_seconds(1, 23.10, 72.50))
+
+        store.append(1, 23.01, 72.50, 1060.0)
+        self.assertEqual(store.eta_seconds(1, 23.02, 72.50), 30)
+
+    def test_idle_trails_are_dropped(self):
+        store = TrailStore(size=10, idle_ttl=600)
+        start = store._pruned_at
+        with mock.patch("riders.trails.time.monotonic", return_value=start + 300):
+            store.append(1, 23.0, 72.5)
+            store.append(2, 23.0, 72.5)
+        with mock.patch("riders.trails.time.monotonic", return_value=start + 800):
+            store.append(2, 23.1, 72.5)
+        self.assertEqual(len(store), 2)
+
+        # The next check is due 600 seconds after the last one.
+        with mock.patch("riders.trails.time.monotonic", return_value=start + 1400):
+            store.append(3, 23.0, 72.5)
+
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.points(1), [])
+        self.assertEqual(len(store.points(2)), 2)
+
+
+###########################################################################
+#                       Distance Kernel Tests                             #
+###########################################################################
+
+class DistanceKernelTests(SimpleTestCase):
+    origin = (23.0225, 72.5714)
+
+    def setUp(self):
+        # Scattered points within ~15 km of the origin, plus the origin.
+        points = random.Random(1)
+        self.lats = [self.origin[0]] + [self.origin[0] + points.uniform(-0.1, 0.1) for _ in range(2000)]
+        self.lngs = [self.origin[1]] + [self.origin[1] + points.uniform(-0.1, 0.1) for _ in range(2000)]
+
+    def test_python_path_matches_the_scalar_haversine(self):
+        with mock.patch.object(utils, "np", None):
+            distances, mask = utils.distances_km(*self.origin, self.lats, self.lngs, 5)
+
+        for lat, lng, distance, inside in zip(self.lats, self.lngs, distances, mask):
+            expected = utils.distance_km(*self.origin, lat, lng)
+            self.assertAlmostEqual(distance, expected, places=9)
+            self.assertEqual(inside, expected <= 5)
+
+    @unittest.skipIf(utils.np is None, "NumPy is not installed")
+    def test_numpy_and_python_paths_agree(self):
+        python_distances, python_mask = utils._distances_km_python(*self.origin, self.lats, self.lngs, 5)
+        numpy_distances, numpy_mask = utils._distances_km_numpy(*self.origin, self.lats, self.lngs, 5)
+
+        for expected, distance in zip(python_distances, numpy_distances):
+            self.assertAlmostEqual(float(distance), expected, places=9)
+        self.assertEqual([bool(inside) for inside in numpy_mask], python_mask)
+
+    # Each point's own distance (from either kernel) as the radius puts it
+    # right on the boundary.
+    @unittest.skipIf(utils.np is None, "NumPy is not installed")
+    def test_points_on_the_radius_are_inside_for_both_paths(self):
+        python_distances, _ = utils._distances_km_python(*self.origin, self.lats, self.lngs)
+        numpy_distances, _ = utils._distances_km_numpy(*self.origin, self.lats, self.lngs)
+
+        for lat, lng, *radii in zip(self.lats, self.lngs, python_distances, numpy_distances):
+            for radius in radii:
+                _, python_mask = utils._distances_km_python(*self.origin, [lat], [lng], float(radius))
+                _, numpy_mask = utils._distances_km_numpy(*self.origin, [lat], [lng], float(radius))
+                self.assertEqual((python_mask[0], bool(numpy_mask[0])), (True, True), (lat, lng, radius))
+
+    def test_no_candidates(self):
+        distances, mask = utils.distances_km(*self.origin, [], [], 5)
+        self.assertEqual((len(distances), len(mask)), (0, 0))
+
+
+###########################################################################
+#                       Nearest Riders Tests                              #
+###########################################################################
+
+CAR = Vehicle.VEHICLE_TYPE_IDS["CAR"]
+BIKE = Vehicle.VEHICLE_TYPE_IDS["BIKE"]
+
+
+def north_of(lat, lng, km):
+    return lat + km / 111.195, lng
+
+
+class GridIndexWithinTests(SimpleTestCase):
+    def test_radius_search_crosses_cell_borders(self):
+        index = GridIndex(cell_degrees=0.02)
+        # Either side of the border between two rows of cells, ~22 m apart.
+        index.add(1, CAR, 23.0199, 72.5714)
+        index.add(2, CAR, 23.0201, 72.5714)
+        index.add(3, CAR, 23.0201, 72.5794)
+        self.assertNotEqual(index.cell_of(1), index.cell_of(2))
+
+        found = index.within(23.0200, 72.5714, 0.5)
+
+        self.assertEqual(sorted(entry[0] for entry in found), [1, 2])
+        for entry in found:
+            self.assertLess(entry[4], 0.02)
+
+    def test_key_filters_candidates(self):
+        index = GridIndex(cell_degrees=0.02)
+        index.add(1, CAR, 23.0225, 72.5714)
+        index.add(2, BIKE, 23.0226, 72.5714)
+
+        self.assertEqual([entry[0] for entry in index.candidates(23.0225, 72.5714, 1, key=BIKE)], [2])
+        self.assertEqual(sorted(entry[0] for entry in index.candidates(23.0225, 72.5714, 1, key=ANY)), [1, 2])
+        self.assertEqual(index.within(23.0225, 72.5714, 1, key=Vehicle.VEHICLE_TYPE_IDS["AUTO"]), [])
+
+
+@override_settings(NEAREST_RIDERS_LIMIT=3, NEAREST_RIDERS_START_RADIUS_KM=1, NEAREST_RIDERS_MAX_RADIUS_KM=10)
+class NearestRidersTests(SimpleTestCase):
+    origin = (23.0225, 72.5714)
+
+    def setUp(self):
+        self.index = GridIndex(cell_degrees=0.02)
+        patcher = mock.patch.object(geo, "available_riders", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, rider_id, vehicle_type, km):
+        self.index.add(rider_id, vehicle_type, *north_of(*self.origin, km))
+
+    def test_closest_riders_of_the_vehicle_type_first(self):
+        for rider_id, km in ((1, 0.9), (2, 0.2), (3, 0.5), (4, 0.7), (5, 0.4)):
+            self.add(rider_id, CAR, km)
+        self.add(6, BIKE, 0.1)
+
+        riders = utils.nearest_riders(*self.origin, vehicle_type="CAR")
+
+        self.assertEqual([rider[0] for rider in riders], [2, 5, 3])
+        self.assertEqual([rider[4] for rider in riders], sorted(rider[4] for rider in riders))
+        self.assertEqual([rider[0] for rider in utils.nearest_riders(*self.origin, vehicle_type="BIKE")], [6])
+        self.assertEqual(len(utils.nearest_riders(*self.origin)), 3)
+
+    def test_radius_grows_until_enough_riders_are_found(self):
+        self.add(1, CAR, 0.5)
+        self.add(2, CAR, 3.5)
+        self.add(3, CAR, 7.5)
+        self.add(4, CAR, 12)
+
+        self.assertEqual([rider[0] for rider in utils.nearest_riders(*self.origin, vehicle_type="CAR")], [1, 2, 3])
+        self.assertEqual([rider[0] for rider in utils.nearest_riders(*self.origin, vehicle_type="CAR", k=10)], [1, 2, 3])
+        self.assertEqual([rider[0] for rider in utils.nearest_riders(*self.origin, k=10, max_radius=20)], [1, 2, 3, 4])
+
+    def test_unknown_vehicle_type_finds_nobody(self):
+        self.add(1, CAR, 0.5)
+        self.assertEqual(utils.nearest_riders(*self.origin, vehicle_type="TRUCK"), [])
+
+    def test_new_ride_is_offered_to_the_nearest_riders(self):
+        self.index.loaded = True
+        for rider_id, km in ((1, 0.9), (2, 0.2), (3, 0.5), (4, 0.7)):
+            self.add(rider_id, CAR, km)
+        self.add(5, BIKE, 0.1)
+        ride = Ride(
+            id=9, user_id=1, user_name="user", user_phone="9876543210",
+            pickup_location="A", pickup_latitude=self.origin[0], pickup_longitude=self.origin[1],
+            drop_location="B", drop_latitude=23.0325, drop_longitude=72.5814,
+            vehicle_type="CAR", charges=100
+        )
+        layer = mock.Mock(group_send=mock.AsyncMock())
+
+        with mock.patch("channels.layers.get_channel_layer", return_value=layer):
+            result = asyncio.run(utils.fan_out_new_ride(ride))
+
+        self.assertEqual(result["targeted"], 3)
+        groups = sorted(call.args[0] for call in layer.group_send.call_args_list)
+        self.assertEqual(groups, ["rider_2", "rider_3", "rider_4"])
+        message = layer.group_send.call_args.args[1]
+        self.assertEqual((message["type"], message["data"]["data"]["id"]), ("rides_update", 9))
+
+
+###########################################################################
+#                       WebSocket Authentication Tests                    #
+###########################################################################
+
+class SocketAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = create_profile("user@example.com", "USER")
+        self.other = create_profile("other@example.com", "USER")
+        self.rider = create_profile("rider@example.com", "RIDER")
+        self.tokens = {
+            profile.id: str(principal_token(profile).access_token)
+            for profile in (self.user, self.rider)
+        }
+        principal_cache.clear()
+
+    async def connect(self, path, subprotocols=None):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from riders.middleware import TokenAuthMiddleware
+        from riders.routing import websocket_urlpatterns
+
+        communicator = WebsocketCommunicator(TokenAuthMiddleware(URLRouter(websocket_urlpatterns)), path, subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        await communicator.disconnect()
+        return connected, subprotocol
+
+    def token(self, profile):
+        return self.tokens[profile.id]
+
+    async def test_socket_without_a_token_is_rejected(self):
+        connected, _ = await self.connect(f"/ws/riders/user_ride/{self.user.id}/")
+        self.assertFalse(connected)
+
+    async def test_socket_with_an_invalid_token_is_rejected(self):
+        connected, _ = await self.connect(f"/ws/riders/user_ride/{self.user.id}/?token=not-a-token")
+        self.assertFalse(connected)
+
+    async def test_socket_for_another_users_id_is_rejected(self):
+        connected, _ = await self.connect(f"/ws/riders/user_ride/{self.other.id}/?token={self.token(self.user)}")
+        self.assertFalse(connected)
+
+    async def test_socket_for_another_role_is_rejected(self):
+        connected, _ = await self.connect(f"/ws/riders/user_ride/{self.rider.id}/?token={self.token(self.rider)}")
+        self.assertFalse(connected)
+
+    async def test_own_socket_is_accepted_with_a_query_token(self):
+        connected, _ = await self.connect(f"/ws/riders/user_ride/{self.user.id}/?token={self.token(self.user)}")
+        self.assertTrue(connected)
+
+    async def test_own_socket_is_accepted_with_a_token_subprotocol(self):
+        from riders.middleware import AUTH_SUBPROTOCOL, TOKEN_SUBPROTOCOL_PREFIX
+
+        connected, subprotocol = await self.connect(
+            f"/ws/riders/user_ride/{self.user.id}/",
+            subprotocols=[AUTH_SUBPROTOCOL, TOKEN_SUBPROTOCOL_PREFIX + self.token(self.user)]
+        )
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, AUTH_SUBPROTOCOL)
+
+
+###########################################################################
+#                       Batch Dispatch Tests                              #
+###########################################################################
+
+def open_ride(ride_id, lat, lng, vehicle_type="CAR"):
+    return Ride(
+        id=ride_id, user_id=1, user_name="user", user_phone="9876543210",
+        pickup_location="A", pickup_latitude=lat, pickup_longitude=lng,
+        drop_location="B", drop_latitude=23.0325, drop_longitude=72.5814,
+        vehicle_type=vehicle_type, charges=100
+    )
+
+
+class AssignmentSolverTests(SimpleTestCase):
+    # Greedy gives rider 0 to ride 0 (cost 1) and leaves ride 1 with rider 1
+    # (cost 9); the optimal assignment swaps them for a total of 4.
+    costs = [[1, 2], [2, 9]]
+
+    def assert_valid(self, assignments, costs, max_cost):
+        self.assertEqual(len({ride for ride, _ in assignments}), len(assignments))
+        self.assertEqual(len({rider for _, rider in assignments}), len(assignments))
+        for ride, rider in assignments:
+            self.assertIsNotNone(costs[ride][rider])
+            self.assertLessEqual(costs[ride][rider], max_cost)
+
+    def test_greedy_takes_the_cheapest_pairs_first(self):
+        assignments = dispatch._solve_greedy(self.costs, 10)
+        self.assert_valid(assignments, self.costs, 10)
+        self.assertEqual(sorted(assignments), [(0, 0), (1, 1)])
+
+    @unittest.skipIf(dispatch.linear_sum_assignment is None, "SciPy is not installed")
+    def test_optimal_minimises_the_total(self):
+        assignments = dispatch._solve_optimal(self.costs, 10)
+        self.assert_valid(assignments, self.costs, 10)
+        self.assertEqual(sorted(assignments), [(0, 1), (1, 0)])
+
+    def test_non_candidates_and_far_riders_stay_unassigned(self):
+        costs = [[None, 12], [3, None]]
+        for solve in (dispatch._solve_greedy, dispatch.solve_assignment):
+            with self.subTest(solve=solve.__name__):
+                self.assertEqual(solve(costs, 10), [(1, 0)])
+
+
+@override_settings(RIDE_BATCH_MAX_ROUNDS=2, RIDE_BATCH_CANDIDATES=10, RIDE_BATCH_SOLVER_WORKERS=0)
+class BatchDispatcherTests(SimpleTestCase):
+    origin = (23.0225, 72.5714)
+
+    def setUp(self):
+        index = GridIndex(cell_degrees=0.02)
+        index.loaded = True
+        index.add(1, CAR, *north_of(*self.origin, 0.3))
+        index.add(2, CAR, *north_of(*self.origin, 0.6))
+        index.add(3, BIKE, *north_of(*self.origin, 0.1))
+        patcher = mock.patch.object(geo, "available_riders", index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.dispatcher = dispatch.BatchDispatcher()
+        self.dispatcher.send_offer = mock.AsyncMock()
+        self.dispatcher.fall_back = mock.AsyncMock()
+
+    def offers(self):
+        offers = [(call.args[0].id, call.args[1]) for call in self.dispatcher.send_offer.call_args_list]
+        self.dispatcher.send_offer.reset_mock()
+        return sorted(offers)
+
+    def run_windows(self, count):
+        async def windows():
+            for _ in range(count):
+                await self.dispatcher.dispatch_window()
+        asyncio.run(windows())
+
+    def test_each_rider_gets_one_offer_per_window(self):
+        self.dispatcher._pending = {
+            ride.id: {"ride": ride, "rounds": 0, "offered": set()}
+            for ride in (open_ride(10, *self.origin), open_ride(11, *north_of(*self.origin, 0.5)))
+        }
+
+        self.run_windows(1)
+
+        self.assertEqual(self.offers(), [(10, 1), (11, 2)])
+
+    def test_next_window_offers_a_different_rider(self):
+        ride = open_ride(10, *self.origin)
+        self.dispatcher._pending = {ride.id: {"ride": ride, "rounds": 0, "offered": set()}}
+
+        self.run_windows(1)
+        self.assertEqual(self.offers(), [(10, 1)])
+        self.run_windows(1)
+        self.assertEqual(self.offers(), [(10, 2)])
+
+    def test_unmatched_ride_falls_back_after_the_last_round(self):
+        ride = open_ride(10, *self.origin, vehicle_type="AUTO")
+        self.dispatcher._pending = {ride.id: {"ride": ride, "rounds": 0, "offered": set()}}
+
+        self.run_windows(1)
+        self.dispatcher.fall_back.assert_not_called()
+        self.run_windows(1)
+
+        self.assertEqual(self.offers(), [])
+        self.dispatcher.fall_back.assert_awaited_once_with(ride)
+        self.assertEqual(self.dispatcher._pending, {})
+
+    def test_accepted_ride_does_not_fall_back(self):
+        ride = open_ride(10, *self.origin)
+        self.dispatcher._pending = {ride.id: {"ride": ride, "rounds": 1, "offered": set()}}
+        self.dispatcher.send_offer.side_effect = lambda ride, rider_id: self.dispatcher.discard(ride.id)
+
+        self.run_windows(1)
+
+        self.dispatcher.fall_back.assert_not_called()
+
+
+###########################################################################
+#                       Unit Of Work Tests                                #
+###########################################################################
+
+# The unit runs on a riders.db.db_executor thread, which only sees committed
+# rows.
+class UnitOfWorkTests(TransactionTestCase):
+    def setUp(self):
+        self.user = create_profile("user@example.com", "USER")
+        self.ride = create_ride(self.user)
+
+    def test_returns_the_result(self):
+        @unit_of_work
+        def close(ride_id):
+            return transition(ride_id, "closed")
+
+        self.assertTrue(asyncio.run(close(self.ride.id)))
+        self.assertEqual(Ride.objects.get(id=self.ride.id).status, "closed")
+
+    def test_rolls_back_when_the_function_raises(self):
+        @unit_of_work
+        def close_and_fail(ride_id):
+            transition(ride_id, "closed")
+            create_ride(self.user)
+            raise ValueError("boom")
+
+        with self.assertRaisesMessage(ValueError, "boom"):
+            asyncio.run(close_and_fail(self.ride.id))
+
+        self.assertEqual(list(Ride.objects.values_list("id", "status")), [(self.ride.id, "requested")])
+
+    def test_autocommit_unit_keeps_the_statements_before_the_error(self):
+        @unit_of_work(atomic=False)
+        def close_and_fail(ride_id):
+            transition(ride_id, "closed")
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(close_and_fail(self.ride.id))
+
+        self.assertEqual(Ride.objects.get(id=self.ride.id).status, "closed")
+
+
+###########################################################################
+#                       Async View Parity Tests                           #
+###########################################################################
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+def post_json(client, url, data):
+    return client.post(url, dumps(data), content_type="application/json")
+
+
+# The async signup validates and saves on riders.db.db_executor threads,
+# which only see committed rows.
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class HashingBusyTests(TransactionTestCase):
+    busy = {"status": False, "message": "Server busy, please try again", "data": None}
+
+    def setUp(self):
+        RiderProfile.objects.create_user(
+            "user@example.com", "9876543210", "user", password="secret123",
+            role="USER", latitude=23.0225, longitude=72.5714
+        )
+        patcher = mock.patch.object(password_hasher, "_enqueue", side_effect=HashingBusy("full"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_busy(self, response):
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(loads(response.content), self.busy)
+
+    def test_login_answers_503_with_retry_after(self):
+        for url in ("/api/riders/login/", "/api/riders/async/login/"):
+            with self.subTest(url=url):
+                self.assert_busy(post_json(self.client, url, {"email": "user@example.com", "password": "secret123"}))
+
+    def test_signup_answers_503_with_retry_after(self):
+        for url in ("/api/riders/profile/", "/api/riders/async/signup/"):
+            with self.subTest(url=url):
+                self.assert_busy(post_json(self.client, url, {
+                    "name": "new", "email": "new@example.com", "phone": "9123456789", "password": "secret123",
+                    "role": "USER", "latitude": 23.0225, "longitude": 72.5714
+                }))
+        self.assertFalse(RiderProfile.objects.filter(email="new@example.com").exists())
+
+
+###########################################################################
+#                       JSON Encoding Tests                               #
+###########################################################################
+
+# riders.encoding as it loads without orjson installed.
+def stdlib_encoding():
+    import riders.encoding
+
+    spec = importlib.util.spec_from_file_location("riders_encoding_stdlib", riders.encoding.__file__)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(sys.modules, {"orjson": None}):
+        spec.loader.exec_module(module)
+    return module
+
+
+class FastJSONTests(SimpleTestCase):
+    requested_at = datetime(2026, 10, 18, 9, 30, 15, 123456, tzinfo=dt_timezone.utc)
+    payload = {
+        "charges": Decimal("125.50"),
+        "requested_at": requested_at,
+        "day": date(2026, 10, 18),
+        "riders": [{"id": 1, "latitude": Decimal("23.022500")}],
+        "name": "Rāj",
+    }
+
+    def round_trip(self, data):
+        return FastJSONParser().parse(io.BytesIO(FastJSONRenderer().render(data)))
+
+    def test_decimal_and_datetime_values_round_trip(self):
+        from django.utils.dateparse import parse_date, parse_datetime
+
+        parsed = self.round_trip(self.payload)
+
+        self.assertEqual(Decimal(str(parsed["charges"])), self.payload["charges"])
+        self.assertEqual(Decimal(str(parsed["riders"][0]["latitude"])), Decimal("23.0225"))
+        self.assertEqual(parse_datetime(parsed["requested_at"]), self.requested_at)
+        self.assertEqual(parse_date(parsed["day"]), self.payload["day"])
+        self.assertEqual(parsed["name"], "Rāj")
+
+    def test_stdlib_fallback_gives_the_same_values(self):
+        fallback = stdlib_encoding()
+
+        self.assertIsNone(fallback.orjson)
+        self.assertEqual(fallback.loads(fallback.dumpb(self.payload)), self.round_trip(self.payload))
+
+    def test_indented_output_is_left_to_drf(self):
+        rendered = FastJSONRenderer().render({"charges": Decimal("1.5")}, "application/json; indent=2")
+        self.assertIn(b'\n  "charges"', rendered)
+
+    def test_invalid_json_is_a_parse_error(self):
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b"{not json"))
+
+
+# Each async ride view against its RideViewSet action: the same status code
+# and body for the same request on two identical rides.
+class AsyncRideViewParityTests(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.user = create_profile("user@example.com", "USER")
+        self.rider = create_profile("rider@example.com", "RIDER")
+        create_vehicle(self.rider)
+
+    def compare(self, action, status_code, **ride_fields):
+        answers = []
+        for url in ("/api/riders/ride/{}/{}/", "/api/riders/async/ride/{}/{}/"):
+            ride = create_ride(self.user, **ride_fields)
+            response = client_for(self.rider).post(url.format(ride.id, action))
+            body = loads(response.content)
+            if body["data"] is not None:
+                self.assertEqual(body["data"].pop("id"), ride.id)
+            answers.append((response.status_code, body, Ride.objects.get(id=ride.id).status))
+
+        self.assertEqual(answers[0][0], status_code)
+        self.assertEqual(answers[1], answers[0])
+        return answers[0]
+
+    def test_accept(self):
+        self.assertEqual(self.compare("accept", 200)[2], "accepted")
+
+    def test_accept_of_a_taken_ride(self):
+        _, body, _ = self.compare("accept", 400, status="completed")
+        self.assertEqual(body["message"], "Cannot accept ride with status 'completed'")
+
+    def test_pickup(self):
+        self.assertEqual(self.compare("pickup", 200, status="accepted", rider=self.rider)[2], "picked_up")
+
+    def test_decline(self):
+        self.assertEqual(self.compare("decline", 200, status="accepted", rider=self.rider)[2], "declined")
+
+    def test_complete(self):
+        self.assertEqual(self.compare("complete", 200, status="picked_up", rider=self.rider)[2], "completed")
+
+    def test_without_a_token(self):
+        ride = create_ride(self.user)
+        for action in ("accept", "pickup", "decline", "complete"):
+            with self.subTest(action=action):
+                rest = APIClient().post(f"/api/riders/ride/{ride.id}/{action}/")
+                answer = APIClient().post(f"/api/riders/async/ride/{ride.id}/{action}/")
+
+                self.assertEqual(rest.status_code, 401)
+                self.assertEqual((answer.status_code, loads(answer.content)), (rest.status_code, loads(rest.content)))
+
+
+# The async signup validates and saves on riders.db.db_executor threads,
+# which only see committed rows.
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncAccountViewParityTests(TransactionTestCase):
+    views = {
+        "login": ("/api/riders/login/", "/api/riders/async/login/"),
+        "signup": ("/api/riders/profile/", "/api/riders/async/signup/"),
+    }
+
+    def setUp(self):
+        principal_cache.clear()
+        self.user = RiderProfile.objects.create_user(
+            "user@example.com", "9876543210", "user", password="secret123",
+            role="USER", latitude=23.0225, longitude=72.5714
+        )
+
+    def compare(self, view, data, status_code):
+        answers = []
+        for url in self.views[view]:
+            response = post_json(self.client, url, data(url) if callable(data) else data)
+            answers.append((response.status_code, loads(response.content)))
+
+        self.assertEqual(answers[0][0], status_code)
+        self.assertEqual(answers[1], answers[0])
+        return answers[0][1]
+
+    def test_login(self):
+        answers = []
+        for url in self.views["login"]:
+            response = post_json(self.client, url, {"email": "user@example.com", "password": "secret123"})
+            body = loads(response.content)
+            tokens = body["data"].pop("tokens")
+            self.assertEqual(principal_for_token(RefreshToken(tokens["refresh"]).access_token).id, self.user.id)
+            answers.append((response.status_code, body))
+
+        self.assertEqual(answers[0][0], 200)
+        self.assertEqual(answers[1], answers[0])
+
+    def test_login_errors(self):
+        self.compare("login", {"email": "user@example.com", "password": "wrong"}, 400)
+        self.compare("login", {"email": "nobody@example.com", "password": "secret123"}, 400)
+        body = self.compare("login", {}, 400)
+        self.assertEqual(body["message"], "Email is required. Password is required.")
+
+    def test_signup(self):
+        def signup(url):
+            suffix = "2" if "async" in url else "1"
+            return {
+                "name": "new", "email": f"new{suffix}@example.com", "phone": f"912345678{suffix}",
+                "password": "secret123", "role": "RIDER", "latitude": 23.0225, "longitude": 72.5714
+            }
+
+        answers = []
+        for url in self.views["signup"]:
+            response = post_json(self.client, url, signup(url))
+            body = loads(response.content)
+            for field in ("id", "email", "phone", "created_at"):
+                body["data"].pop(field)
+            answers.append((response.status_code, body))
+
+        self.assertEqual(answers[0][0], 201)
+        self.assertEqual(answers[1], answers[0])
+        for email in ("new1@example.com", "new2@example.com"):
+            self.assertTrue(RiderProfile.objects.get(email=email).check_password("secret123"))
+
+    def test_signup_errors(self):
+        valid = {
+            "name": "new", "email": "new@example.com", "phone": "9123456789",
+            "password": "secret123", "role": "USER", "latitude": 23.0225, "longitude": 72.5714
+        }
+        self.compare("signup", dict(valid, email="user@example.com"), 400)
+        self.compare("signup", dict(valid, phone="12345"), 400)
+        self.compare("signup", dict(valid, role="PILOT"), 404)
+        self.compare("signup", dict(valid, name=""), 400)
+        self.assertFalse(RiderProfile.objects.filter(email="new@example.com").exists())
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+###########################################################################
+#                       Timing Wheel Module                               #
+###########################################################################
+
+# Hashed timing wheel: `slots` buckets of `tick` seconds each. A deadline
+# goes into the bucket of its tick, so schedule and cancel are one dict
+# operation each. advance() walks the buckets whose tick has fully passed;
+# entries whose deadline is a whole turn of the wheel or more away stay put
+# until the wheel comes round again.
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self._where = {}
+        self._cursor = int(time.time() // tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        # A deadline in a tick that has already been walked goes into the
+        # current bucket and fires on the next advance().
+        index = max(int(deadline // self.tick), self._cursor) % len(self.slots)
+        self.slots[index][key] = deadline
+        self._where[key] = index
+
+    def cancel(self, key):
+        index = self._where.pop(key, None)
+        if index is None:
+            return False
+        self.slots[index].pop(key, None)
+        return True
+
+    def advance(self, now):
+        expired = []
+        last = int(now // self.tick) - 1
+        # After a stall longer than a full turn every bucket is due once.
+        first = max(self._cursor, last - len(self.slots) + 1)
+        for current in range(first, last + 1):
+            bucket = self.slots[current % len(self.slots)]
+            for key, deadline in list(bucket.items()):
+                if deadline <= now:
+                    del bucket[key]
+                    del self._where[key]
+                    expired.append(key)
+        self._cursor = max(self._cursor, last + 1)
+        return expired
+
+
+###########################################################################
+#                       Ride Expiry Module                                #
+###########################################################################
+
+expiry_stats = {"sweeps": 0, "expired": 0, "last_duration_ms": 0.0, "total_duration_ms": 0.0}
+
+# Closes requested rides whose request timed out with one conditional
+# UPDATE: the given rides, or every requested ride older than
+# RIDE_REQUEST_TIMEOUT when ride_ids is None, at most
+# RIDE_EXPIRY_BATCH_SIZE per call. Rows are locked (skipping rows another
+# transaction holds) so the returned [(ride_id, user_id), ...] are exactly
+# the rides this call closed.
+def expire_rides(ride_ids=None, now=None):
+    from datetime import timedelta
+    from django.conf import settings
+    from django.db import transaction
+    from django.utils import timezone
+    from riders.models import Ride
+    from riders.transitions import transition_many
+
+    started = time.perf_counter()
+
+    rides = Ride.objects.filter(status="requested")
+    if ride_ids is None:
+        cutoff = (now or timezone.now()) - timedelta(seconds=settings.RIDE_REQUEST_TIMEOUT)
+        rides = rides.filter(requested_at__lte=cutoff)
+    else:
+        rides = rides.filter(id__in=list(ride_ids))
+
+    with transaction.atomic():
+        expired = list(
+            rides.select_for_update(skip_locked=True)
+            .order_by("requested_at")
+            .values_list("id", "user_id")[:settings.RIDE_EXPIRY_BATCH_SIZE]
+        )
+        if expired:
+            transition_many([ride_id for ride_id, _ in expired], "closed")
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    expiry_stats["sweeps"] += 1
+    expiry_stats["expired"] += len(expired)
+    expiry_stats["last_duration_ms"] = elapsed_ms
+    expiry_stats["total_duration_ms"] += elapsed_ms
+    if expired:
+        logger.debug("Expired %d ride requests in %.1f ms", len(expired), elapsed_ms)
+    return expired
+
+# expire_rides() plus the in-memory cleanup and one batch of "timeout"
+# notifications to the users.
+async def close_expired_rides(ride_ids=None):
+    from channels.layers import get_channel_layer
+    from riders.geo import open_rides
+    from riders.db import database_sync_to_async
+    from riders.dispatch import batch_dispatcher
+    from riders.utils import group_send_many
+
+    expired = await database_sync_to_async(expire_rides, bounded=False)(ride_ids)
+
+    for ride_id, _ in expired:
+        open_rides.remove(ride_id)
+        batch_dispatcher.discard(ride_id)
+        ride_timeouts.cancel(ride_id)
+
+    await group_send_many(get_channel_layer(), "ride_declined", [
+        (
+            f"user_{user_id}",
+            {
+                "ride_id": ride_id,
+                "status": "timeout",
+                "message": "No rider accept your ride"
+            }
+        )
+        for ride_id, user_id in expired
+    ])
+    return expired
+
+
+###########################################################################
+#                       Ride Request Timeout Module                       #
+###########################################################################
+
+# Closes requested rides RIDE_REQUEST_TIMEOUT seconds after they were
+# requested. One driver task on the ASGI event loop advances the wheel every
+# tick and closes whatever fell due in one close_expired_rides() call.
+# Deadlines are derived from Ride.requested_at, so when the driver starts it
+# reloads every ride that is still requested and a restart loses nothing.
+# Every RIDE_EXPIRY_SWEEP_INTERVAL seconds it also sweeps the database for
+# stale requests no wheel knows about (e.g. created where no event loop
+# was running). Timers still pending for a ride accepted elsewhere do
+# nothing, because only requested rows are closed.
+class RideTimeouts:
+    def __init__(self):
+        self.wheel = TimingWheel(
+            tick=_setting("RIDE_TIMEOUT_TICK", 1),
+            slots=_setting("RIDE_TIMEOUT_SLOTS", 512)
+        )
+        self._lock = threading.Lock()
+        self._task = None
+        self._restored = False
+        self._sweeping = False
+        self.stats = {"scheduled": 0, "cancelled": 0, "expired": 0}
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def schedule(self, ride_id, deadline):
+        with self._lock:
+            self.wheel.schedule(ride_id, deadline)
+            self.stats["scheduled"] += 1
+        self.ensure_started()
+
+    def schedule_ride(self, ride):
+        self.schedule(ride.id, self.deadline(ride.requested_at))
+
+    def deadline(self, requested_at):
+        from django.conf import settings
+
+        return requested_at.timestamp() + settings.RIDE_REQUEST_TIMEOUT
+
+    def cancel(self, ride_id):
+        with self._lock:
+            cancelled = self.wheel.cancel(ride_id)
+            if cancelled:
+                self.stats["cancelled"] += 1
+        return cancelled
+
+    def ensure_started(self):
+        from riders.utils import server_event_loop
+
+        if self._task is not None and not self._task.done() and not self._task.get_loop().is_closed():
+            return
+        loop = server_event_loop()
+        if loop is None:
+            # No event loop here; a worker picks the ride up from the
+            # database when its driver starts or sweeps.
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._start()
+        else:
+            loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        if self._task is None or self._task.done() or self._task.get_loop().is_closed():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        from django.conf import settings
+        from riders.db import database_sync_to_async
+
+        if not self._restored:
+            try:
+                await database_sync_to_async(self.restore, bounded=False)()
+            except Exception:
+                logger.exception("Restoring ride timeouts failed")
+
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(self.wheel.tick - time.time() % self.wheel.tick)
+            with self._lock:
+                expired = self.wheel.advance(time.time())
+            if expired:
+                self.stats["expired"] += len(expired)
+                asyncio.ensure_future(self.expire(expired))
+
+            if time.monotonic() - last_sweep >= settings.RIDE_EXPIRY_SWEEP_INTERVAL and not self._sweeping:
+                last_sweep = time.monotonic()
+                asyncio.ensure_future(self.sweep())
+
+    def restore(self):
+        from riders.models import Ride
+
+        rides = list(Ride.objects.filter(status="requested").values_list("id", "requested_at"))
+        with self._lock:
+            for ride_id, requested_at in rides:
+                if ride_id not in self.wheel:
+                    self.wheel.schedule(ride_id, self.deadline(requested_at))
+            self._restored = True
+
+    async def expire(self, ride_ids):
+        try:
+            await close_expired_rides(ride_ids)
+        except Exception:
+            logger.exception("Closing %d timed out rides failed", len(ride_ids))
+
+    async def sweep(self):
+        from django.conf import settings
+
+        self._sweeping = True
+        try:
+            # A full batch means there may be more stale requests left.
+            while len(await close_expired_rides()) >= settings.RIDE_EXPIRY_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception("Ride expiry sweep failed")
+        finally:
+            self._sweeping = False
+
+
+def _setting(name, default):
+    from django.conf import settings
+    return getattr(settings, name, default)
+
+
+ride_timeouts = RideTimeouts()
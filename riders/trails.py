@@ -0,0 +1,170 @@
+import threading
+import time
+from array import array
+from math import atan2, cos, degrees, radians, sin
+
+MICRODEGREES = 1000000
+
+###########################################################################
+#                       Location Trail Module                             #
+###########################################################################
+
+# Last `size` GPS points of one rider, kept in three parallel fixed-size
+# arrays used as a ring buffer: latitude and longitude as micro-degree ints
+# and the timestamp as float seconds, 16 bytes per point allocated up front.
+# Timestamps never go backwards, so range reads can binary search them.
+class Trail:
+    __slots__ = ("size", "lats", "lngs", "times", "start", "count")
+
+    def __init__(self, size):
+        self.size = size
+        self.lats = array("i", [0]) * size
+        self.lngs = array("i", [0]) * size
+        self.times = array("d", [0.0]) * size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, lat, lng, timestamp):
+        if self.count:
+            timestamp = max(timestamp, self.times[self._slot(self.count - 1)])
+
+        if self.count < self.size:
+            slot = self._slot(self.count)
+            self.count += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.size
+
+        self.lats[slot] = round(float(lat) * MICRODEGREES)
+        self.lngs[slot] = round(float(lng) * MICRODEGREES)
+        self.times[slot] = timestamp
+
+    def point(self, index):
+        slot = self._slot(index)
+        return self.lats[slot] / MICRODEGREES, self.lngs[slot] / MICRODEGREES, self.times[slot]
+
+    def latest(self):
+        return self.point(self.count - 1) if self.count else None
+
+    # Points with a timestamp after `since` (all of them when None), oldest
+    # first.
+    def points(self, since=None):
+        first = 0 if since is None else self._first_after(since)
+        return [self.point(index) for index in range(first, self.count)]
+
+    def _first_after(self, since):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._slot(middle)] <= since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slot(self, index):
+        return (self.start + index) % self.size
+
+
+def heading_degrees(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    dlng = lng2 - lng1
+    x = sin(dlng) * cos(lat2)
+    y = cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(dlng)
+    return (degrees(atan2(x, y)) + 360) % 360
+
+
+# One Trail per rider, created on the first ping. A trail with no ping for
+# `idle_ttl` seconds is dropped (checked from append() at most once per
+# idle_ttl), so memory is bounded by the riders active in that window times
+# TRAIL_POINTS, not by every rider that ever connected.
+class TrailStore:
+    def __init__(self, size=120, idle_ttl=600):
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self._trails = {}
+        self._touched = {}
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._trails)
+
+    def append(self, rider_id, lat, lng, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        now = time.monotonic()
+        with self._lock:
+            trail = self._trails.get(rider_id)
+            if trail is None:
+                trail = self._trails[rider_id] = Trail(self.size)
+            trail.append(lat, lng, timestamp)
+            self._touched[rider_id] = now
+            if now - self._pruned_at >= self.idle_ttl:
+                self._prune(now)
+
+    def points(self, rider_id, since=None):
+        with self._lock:
+            trail = self._trails.get(rider_id)
+            return trail.points(since) if trail is not None else []
+
+    def latest(self, rider_id):
+        with self._lock:
+            trail = self._trails.get(rider_id)
+            return trail.latest() if trail is not None else None
+
+    def forget(self, rider_id):
+        with self._lock:
+            self._trails.pop(rider_id, None)
+            self._touched.pop(rider_id, None)
+
+    # Drops the trails idle for idle_ttl seconds. Call under the lock.
+    def _prune(self, now):
+        cutoff = now - self.idle_ttl
+        for rider_id in [rider_id for rider_id, touched in self._touched.items() if touched < cutoff]:
+            del self._trails[rider_id]
+            del self._touched[rider_id]
+        self._pruned_at = now
+
+    # Heading (degrees from north) and speed (km/h) between the latest point
+    # and the oldest one at most `window` seconds before it. None until
+    # there are two points spread over time.
+    def motion(self, rider_id, window=30):
+        from riders.utils import distance_km
+
+        with self._lock:
+            trail = self._trails.get(rider_id)
+            if trail is None or len(trail) < 2:
+                return None
+            lat, lng, timestamp = trail.latest()
+            first = min(trail._first_after(timestamp - window), len(trail) - 2)
+            from_lat, from_lng, from_timestamp = trail.point(first)
+
+        elapsed = timestamp - from_timestamp
+        if elapsed <= 0:
+            return None
+        return {
+            "heading": round(heading_degrees(from_lat, from_lng, lat, lng), 1),
+            "speed_kmh": round(distance_km(from_lat, from_lng, lat, lng) / elapsed * 3600, 1)
+        }
+
+    # Seconds to reach (lat, lng) at the rider's current speed, or None when
+    # the rider is not moving.
+    def eta_seconds(self, rider_id, lat, lng, window=30):
+        from riders.utils import distance_km
+
+        motion = self.motion(rider_id, window)
+        latest = self.latest(rider_id)
+        if not motion or not motion["speed_kmh"] or latest is None:
+            return None
+        return round(distance_km(latest[0], latest[1], float(lat), float(lng)) / motion["speed_kmh"] * 3600)
+
+
+def _setting(name, default):
+    from django.conf import settings
+    return getattr(settings, name, default)
+
+
+rider_trails = TrailStore(size=_setting("TRAIL_POINTS", 120), idle_ttl=_setting("TRAIL_IDLE_TTL", 600))
@@ -0,0 +1,65 @@
+###########################################################################
+#                       Ride State Machine Module                         #
+###########################################################################
+
+# Legal ride status changes, from -> to. Every transition is a single
+# conditional UPDATE ... WHERE id = ? AND status IN (<legal sources>), so
+# concurrent callers never wait on a row lock held across round trips; the
+# first one wins and the others see a lost race (False).
+RIDE_TRANSITIONS = {
+    "requested": {"accepted", "declined", "closed"},
+    # A rider can hand an accepted ride back ("requested") or the ride can be
+    # completed without a recorded pick up.
+    "accepted": {"requested", "picked_up", "completed", "declined"},
+    "picked_up": {"completed"},
+    "completed": set(),
+    "declined": set(),
+    "closed": set(),
+}
+
+
+def sources(to_state, expected=None):
+    legal = {state for state, targets in RIDE_TRANSITIONS.items() if to_state in targets}
+    if not legal:
+        raise ValueError(f"No transition leads to '{to_state}'")
+    if expected is None:
+        return legal
+    illegal = set(expected) - legal
+    if illegal:
+        raise ValueError(f"Illegal transition from {sorted(illegal)} to '{to_state}'")
+    return set(expected)
+
+
+# Moves one ride to `to_state` if its status is one of `expected` (default:
+# every legal source) and it matches the extra `where` filters, setting
+# `fields` in the same UPDATE. Returns True if this call made the change.
+def transition(ride_id, to_state, expected=None, where=None, **fields):
+    from riders.models import Ride
+
+    return Ride.objects.filter(
+        id=ride_id,
+        status__in=sources(to_state, expected),
+        **(where or {})
+    ).update(status=to_state, **fields) == 1
+
+
+# transition() for async views, with the async ORM.
+async def atransition(ride_id, to_state, expected=None, where=None, **fields):
+    from riders.models import Ride
+
+    return await Ride.objects.filter(
+        id=ride_id,
+        status__in=sources(to_state, expected),
+        **(where or {})
+    ).aupdate(status=to_state, **fields) == 1
+
+
+# Same for many rides at once; returns how many were moved.
+def transition_many(ride_ids, to_state, expected=None, where=None, **fields):
+    from riders.models import Ride
+
+    return Ride.objects.filter(
+        id__in=list(ride_ids),
+        status__in=sources(to_state, expected),
+        **(where or {})
+    ).update(status=to_state, **fields)
@@ -1,5 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from .views import *
+from . import async_views
 from django.urls import path
 
 router = DefaultRouter()
@@ -9,7 +10,16 @@ router.register('ride', RideViewSet, basename='ride')
 router.register('payments', RiderPaymentViewSet, basename='payments')
 
 urlpatterns = [
-    path('login/', LoginViewSet.as_view(), name='login')    
+    path('login/', LoginViewSet.as_view(), name='login'),
+
+    # Async login, signup and ride transitions for the ASGI deployment;
+    # same responses as login/, profile/, ride/<pk>/accept/ etc.
+    path('async/login/', async_views.login, name='async-login'),
+    path('async/signup/', async_views.signup, name='async-signup'),
+    path('async/ride/<int:pk>/accept/', async_views.accept_ride, name='async-ride-accept'),
+    path('async/ride/<int:pk>/pickup/', async_views.pickup_ride, name='async-ride-pickup'),
+    path('async/ride/<int:pk>/decline/', async_views.decline_ride, name='async-ride-decline'),
+    path('async/ride/<int:pk>/complete/', async_views.complete_ride, name='async-ride-complete'),
 ]
 
 
@@ -1,42 +1,170 @@
+import logging
+import threading
+import time
+from math import radians, cos, sin, asin, sqrt
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
 ###########################################################################
 #                       Rider Avialability Module                         #
 ###########################################################################
 
-def broadcast_available_riders():
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    from riders.models import RiderProfile
-    channel_layer = get_channel_layer()
+# The availability stream is versioned: subscribers get a full snapshot
+# once, then only add/move/remove deltas. Every delta carries the version it
+# starts from ("since") so a client that missed one can ask for a resync.
+_availability_stream = {"version": 0}
+_availability_lock = threading.Lock()
 
-    riders_queryset = RiderProfile.objects.filter(role="RIDER", is_available=True, latitude__isnull=False, longitude__isnull=False).values(
-            "latitude", "longitude")
-    
-    riders = [{
-        "latitude": float(r["latitude"]),
-        "longitude": float(r["longitude"]),
+def available_rider_data(rider_id, vehicle_type, lat, lng):
+    return {
+        "id": rider_id,
+        "latitude": lat,
+        "longitude": lng,
+        "vehicle_type": vehicle_type if vehicle_type is not None else "UNKNOWN"
+    }
+
+def available_riders_snapshot():
+    from riders.geo import available_riders
+
+    available_riders.ensure_loaded()
+    version, riders = available_riders.snapshot()
+    return {
+        "status": True,
+        "message": "Available Riders Snapshot",
+        "data": {
+            "version": version,
+            "available_riders": [available_rider_data(*rider) for rider in riders]
+        }
+    }
+
+def available_riders_delta(since, version, changes):
+    deltas = []
+    for op, rider_id, vehicle_type, lat, lng in changes:
+        if op == "remove":
+            deltas.append({"op": op, "id": rider_id})
+        else:
+            deltas.append({"op": op, **available_rider_data(rider_id, vehicle_type, lat, lng)})
+
+    return {
+        "status": True,
+        "message": "Updated Riders are",
+        "data": {
+            "since": since,
+            "version": version,
+            "changes": deltas
+        }
     }
-    for r in riders_queryset
+
+# Answers a subscriber that last saw `version`: the deltas since then, or a
+# full snapshot when the change log no longer reaches back that far. Tile
+# subscribers only get the changes seen from their tiles.
+def available_riders_since(version, tiles=None):
+    from riders.geo import available_riders
+
+    available_riders.ensure_loaded()
+    if not tiles:
+        current, changes = available_riders.changes_since(version)
+        if changes is None:
+            return available_riders_snapshot()
+        return available_riders_delta(version, current, changes)
+
+    tiles = sorted(tiles)
+    current, changes = available_riders.changes_since(version, cells=set(tiles))
+    if changes is None:
+        return available_riders_in_tiles(tiles)
+    message = available_riders_delta(version, current, changes)
+    message["data"]["tiles"] = [list(tile) for tile in tiles]
+    return message
+
+# Clients can subscribe to map tiles (the cells of the available riders
+# index) instead of the whole city; each tile is its own channel group.
+def availability_tile_group(tile):
+    return f"rider_availability_{tile[0]}_{tile[1]}"
+
+def tiles_for_viewport(south, west, north, east):
+    from riders.geo import available_riders, cell_for
+
+    cell_degrees = available_riders.cell_degrees
+    min_row, min_col = cell_for(float(south), float(west), cell_degrees)
+    max_row, max_col = cell_for(float(north), float(east), cell_degrees)
+    return [
+        (row, col)
+        for row in range(min_row, max_row + 1)
+        for col in range(min_col, max_col + 1)
     ]
 
-    async_to_sync(channel_layer.group_send)(
-        "rider_availability",
-        {
-            "type": "rider_update",
-            "status": True,
-            "message": "Updated Riders are",
-            "data": {
-                "available_riders": riders
-            }
+def available_riders_in_tiles(tiles):
+    from riders.geo import available_riders
+
+    available_riders.ensure_loaded()
+    with available_riders._lock:
+        version = available_riders.version
+        riders = available_riders.in_cells(tiles)
+    return {
+        "status": True,
+        "message": "Available Riders Snapshot",
+        "data": {
+            "version": version,
+            "cell_degrees": available_riders.cell_degrees,
+            "tiles": [list(tile) for tile in tiles],
+            "available_riders": [available_rider_data(*rider) for rider in riders]
         }
-    )
+    }
+
+def available_riders_messages():
+    from riders.geo import available_riders, available_tiles
+
+    available_riders.ensure_loaded()
+    with _availability_lock:
+        since = _availability_stream["version"]
+        version, changes = available_riders.changes_since(since)
+        _availability_stream["version"] = version
+        _, tiles = available_tiles.drain()
+
+    messages = []
+    if changes is None:
+        messages.append(("rider_availability", available_riders_snapshot()))
+    elif changes:
+        messages.append(("rider_availability", available_riders_delta(since, version, changes)))
+
+    for tile, tile_changes in tiles.items():
+        message = available_riders_delta(since, version, tile_changes)
+        message["data"]["tile"] = list(tile)
+        messages.append((availability_tile_group(tile), message))
+    return messages
+
+def broadcast_available_riders():
+    from channels.layers import get_channel_layer
+    from asgiref.sync import async_to_sync
+
+    messages = available_riders_messages()
+    if messages:
+        async_to_sync(group_send_many)(get_channel_layer(), "rider_update", messages)
+
+async def group_send_many(channel_layer, event_type, messages):
+    import asyncio
+
+    await asyncio.gather(*(
+        channel_layer.group_send(group, {"type": event_type, "data": message})
+        for group, message in messages
+    ))
 
 ###########################################################################
 #               Nearby Rider can see requested ride Module                #
 ###########################################################################
 
-def distance_km(lat1, lon1, lat2, lon2):
-    from math import radians, cos, sin, asin, sqrt
+EARTH_RADIUS_KM = 6371
+
+# The NumPy and Python kernels can differ in the last bits (~1e-15 km); the
+# radius check allows this much so both agree on points right on the radius.
+RADIUS_TOLERANCE_KM = 1e-9
 
+def distance_km(lat1, lon1, lat2, lon2):
     lat1, lon1, lat2, lon2 = map(float, [lat1, lon1, lat2, lon2])
     lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
 
@@ -44,47 +172,163 @@ def distance_km(lat1, lon1, lat2, lon2):
     dlat = lat2 - lat1
     a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
     c = 2*asin(sqrt(a))
-    r = 6371
-    return c*r
+    return c*EARTH_RADIUS_KM
 
-def broadcast_new_ride(new_ride):
-    from asgiref.sync import async_to_sync
+# Batched haversine: one origin against many candidates. Returns the
+# distances and a mask of the candidates within radius_km (every candidate
+# when no radius is given). Uses NumPy when it is installed and falls back
+# to a plain Python loop with the same results otherwise.
+def distances_km(lat, lng, lats, lngs, radius_km=None):
+    if np is not None:
+        return _distances_km_numpy(lat, lng, lats, lngs, radius_km)
+    return _distances_km_python(lat, lng, lats, lngs, radius_km)
+
+def _distances_km_numpy(lat, lng, lats, lngs, radius_km=None):
+    lat = radians(float(lat))
+    lng = radians(float(lng))
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    a = np.sin((lats - lat) / 2)**2 + cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2)**2
+    distances = 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_KM
+
+    if radius_km is None:
+        mask = np.ones(distances.shape, dtype=bool)
+    else:
+        mask = distances <= radius_km + RADIUS_TOLERANCE_KM
+    return distances, mask
+
+def _distances_km_python(lat, lng, lats, lngs, radius_km=None):
+    lat = radians(float(lat))
+    lng = radians(float(lng))
+    cos_lat = cos(lat)
+
+    distances = []
+    mask = []
+    for other_lat, other_lng in zip(lats, lngs):
+        other_lat = radians(float(other_lat))
+        other_lng = radians(float(other_lng))
+        a = sin((other_lat - lat)/2)**2 + cos_lat * cos(other_lat) * sin((other_lng - lng)/2)**2
+        distance = 2*asin(sqrt(a))*EARTH_RADIUS_KM
+        distances.append(distance)
+        mask.append(radius_km is None or distance <= radius_km + RADIUS_TOLERANCE_KM)
+    return distances, mask
+
+def vehicle_type_id(vehicle_type):
+    from riders.models import Vehicle
+
+    if vehicle_type in Vehicle.VEHICLE_TYPE_IDS:
+        return Vehicle.VEHICLE_TYPE_IDS[vehicle_type]
+    try:
+        return int(vehicle_type)
+    except (TypeError, ValueError):
+        return None
+
+def index_rider(rider):
+    from riders.models import Vehicle
+    from riders.geo import available_riders
+    from riders.locations import location_buffer
+
+    lat, lng = location_buffer.get(rider.id) or (rider.latitude, rider.longitude)
+
+    if rider.role != "RIDER" or not rider.is_available or lat is None or lng is None:
+        available_riders.remove(rider.id)
+        return
+
+    try:
+        vehicle_type = rider.vehicle.vehicle_type_id
+    except Vehicle.DoesNotExist:
+        vehicle_type = None
+
+    available_riders.add(rider.id, vehicle_type, lat, lng)
+
+def index_ride(ride):
+    from riders.geo import open_rides
+
+    if ride.status != "requested":
+        open_rides.remove(ride.id)
+        return
+
+    open_rides.add(ride.id, vehicle_type_id(ride.vehicle_type), ride.pickup_latitude, ride.pickup_longitude)
+
+# Returns up to k available riders closest to (lat, lng), sorted by
+# distance, as (rider_id, vehicle_type_id, lat, lng, distance) tuples. The
+# search radius starts small and doubles until k riders are found or
+# max_radius is reached, so dense areas stop early and sparse areas still
+# look further out.
+def nearest_riders(lat, lng, vehicle_type=None, k=None, max_radius=None):
+    from django.conf import settings
+    from riders.geo import ANY, available_riders
+
+    k = k or settings.NEAREST_RIDERS_LIMIT
+    max_radius = max_radius or settings.NEAREST_RIDERS_MAX_RADIUS_KM
+
+    key = ANY
+    if vehicle_type is not None:
+        key = vehicle_type_id(vehicle_type)
+        if key is None:
+            return []
+
+    available_riders.ensure_loaded()
+
+    radius = min(settings.NEAREST_RIDERS_START_RADIUS_KM, max_radius)
+    while True:
+        riders = available_riders.within(lat, lng, radius, key=key)
+        if len(riders) >= k or radius >= max_radius:
+            break
+        radius = min(radius * 2, max_radius)
+
+    riders.sort(key=lambda rider: rider[4])
+    return riders[:k]
+
+# Offers a new ride to its nearest riders. The ride is serialized once and
+# the rider_{id} groups are sent to concurrently, at most
+# RIDE_FANOUT_CONCURRENCY at a time. Returns how many riders were targeted
+# and how long the fan-out took.
+async def fan_out_new_ride(new_ride):
+    import asyncio
+    from django.conf import settings
     from channels.layers import get_channel_layer
-    from riders.models import RiderProfile, Ride
+    from riders.db import database_sync_to_async
+    from riders.geo import available_riders
     from riders.serializers import RideSerializer
-    from riders.utils import distance_km
 
+    started = time.perf_counter()
     channel_layer = get_channel_layer()
 
-    riders = RiderProfile.objects.filter(is_available=True, role="RIDER").select_related("vehicle")
-
-    for rider in riders:
-        if rider.latitude is None or rider.longitude is None:
-            continue
-
-        if rider.vehicle.vehicle_type_id != new_ride.vehicle_type:
-            continue
-
-        distance = distance_km(
-        float(rider.latitude),
-        float(rider.longitude),
-        float(new_ride.pickup_latitude),
-        float(new_ride.pickup_longitude)
-        )
-        if distance <= 5:
-            data = RideSerializer(new_ride).data
-
-            async_to_sync(channel_layer.group_send)(
-                f"rider_{rider.id}",
-                {
-                    "type": "rides_update",
-                    "data": {
-                        "status": True,
-                        "message": "Nearby Rides are",
-                        "data": data
-                    }
-                }
-            )
+    if not available_riders.loaded:
+        await database_sync_to_async(available_riders.ensure_loaded, bounded=False)()
+    riders = nearest_riders(
+        new_ride.pickup_latitude,
+        new_ride.pickup_longitude,
+        new_ride.vehicle_type
+    )
+
+    if riders:
+        message = {
+            "type": "rides_update",
+            "data": {
+                "status": True,
+                "message": "Nearby Rides are",
+                "data": RideSerializer(new_ride).data
+            }
+        }
+        semaphore = asyncio.Semaphore(settings.RIDE_FANOUT_CONCURRENCY)
+
+        async def send(rider_id):
+            async with semaphore:
+                await channel_layer.group_send(f"rider_{rider_id}", message)
+
+        await asyncio.gather(*(send(rider_id) for rider_id, _, _, _, _ in riders))
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.debug("Ride %s offered to %d riders in %.1f ms", new_ride.id, len(riders), elapsed_ms)
+    return {"targeted": len(riders), "elapsed_ms": elapsed_ms}
+
+def broadcast_new_ride(new_ride):
+    from asgiref.sync import async_to_sync
+
+    return async_to_sync(fan_out_new_ride)(new_ride)
 
 
 ###########################################################################
@@ -101,45 +345,50 @@ def validate_coordinates(lat, lng):
 
 def rider_location(lat, lng):
     return{
-        "latitude": float(lat),
-        "longitude": float(lng)
+        "latitude": lat,
+        "longitude": lng
     }
 
 
 ###########################################################################
-#                       Ride Timeout Module                               #
+#                       Event Loop Module                                 #
 ###########################################################################
 
-async def auto_close_ride(channel_layer, ride_id, delay_seconds=300):
+_server_loop = None
+
+async def _running_loop():
     import asyncio
-    from asgiref.sync import sync_to_async
-    from riders.models import Ride
 
-    try:
-        await asyncio.sleep(delay_seconds)
-    except asyncio.CancelledError:
-        return
+    return asyncio.get_running_loop()
+
+# Called by riders.middleware.ServerLoopMiddleware for every ASGI
+# connection, so the loop the ASGI server runs on can be told apart from
+# the short-lived ones asgiref and test clients start.
+def mark_server_loop():
+    import asyncio
+
+    global _server_loop
+    _server_loop = asyncio.get_running_loop()
+
+def is_server_loop(loop):
+    return loop is not None and loop is _server_loop and not loop.is_closed()
+
+# The ASGI server's event loop, for scheduling work on it from sync code, or
+# None when there is no running loop to hand work to (WSGI, management
+# commands).
+def server_event_loop():
+    import asyncio
+    from asgiref.sync import async_to_sync
 
     try:
-        ride = await sync_to_async(Ride.objects.get)(id=ride_id)
-    except Ride.DoesNotExist:
-        return
-    
-    if ride.status == "requested":
-        ride.status = "closed"
-        await sync_to_async(ride.save)()
-
-    await channel_layer.group_send(
-        f"user_{ride.user_id}",
-        {
-            "type": "ride_declined",
-            "data": {
-                "ride_id": ride.id,
-                "status": "timeout",
-                "message": "No rider accept your ride"
-            }
-        }
-    )
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    # From a sync view under ASGI this lands on the server's event loop;
+    # anywhere else asgiref runs it on a throwaway loop that is already
+    # stopped by the time we get it back.
+    loop = async_to_sync(_running_loop)()
+    return loop if loop.is_running() else None
 
 
 ###########################################################################
@@ -3,83 +3,112 @@ from rest_framework.response import Response
 from .models import RiderProfile
 from .serializers import *
 from rest_framework.views import APIView
-from django.contrib.auth.hashers import check_password
-from rest_framework_simplejwt.tokens import RefreshToken
+from riders.hashing import HashingBusy, password_hasher
+from riders.authentication import principal_token
 from rest_framework.decorators import action
-from riders.utils import broadcast_available_riders, broadcast_new_ride
+from riders.utils import index_rider, index_ride
+from riders.geo import available_riders, open_rides
+from riders.dispatch import batch_dispatcher
+from riders.timeouts import ride_timeouts
+from riders.transitions import transition
+from riders.broadcasts import broadcast_scheduler
+from riders.pagination import KeysetPaginator, paginated_response
+
+# Answer for a login or profile save while the password hashing pool is full.
+def hashing_busy():
+    return Response({
+        "status": False,
+        "message": "Server busy, please try again",
+        "data": None
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
 
 ###########################################################################
 #                       Create Profile                                    #
 ###########################################################################
 
+# The checks RiderProfileViewSet.create runs before the serializer, shared
+# with the async signup: (body, http status) of the error answer, or None.
+def signup_error(data):
+    # Check Email
+    email = data.get("email")
+    if not email:
+        return {
+        "success": False,
+        "message": "Email is required",
+        "data": None
+    }, status.HTTP_400_BAD_REQUEST
+
+    elif RiderProfile.objects.filter(email=email).exists():
+        return {
+        "success": False,
+        "message": "Email already exist.",
+        "data": None
+    }, status.HTTP_400_BAD_REQUEST
+
+    # Check Phone
+    phone = data.get("phone")
+    if not phone:
+        return {
+        "success": False,
+        "message": "Phone is required",
+        "data": None
+    }, status.HTTP_400_BAD_REQUEST
+
+    else:
+        digits = "".join(filter(str.isdigit, phone))
+        if len(digits) < 10:
+            return {
+                "success": False,
+                "message": "Phone number must be 10 digits",
+                "data": None
+            }, status.HTTP_400_BAD_REQUEST
+        elif RiderProfile.objects.filter(phone=digits).exists():
+            return {
+                "success": False,
+                "message": "Phone number already exist.",
+                "data": None
+            }, status.HTTP_400_BAD_REQUEST
+        
+        # Check Role
+        role = data.get("role")
+        if not role:
+            return {
+                "status": False,
+                "message": "Role is required",
+                "data": None
+            }, status.HTTP_404_NOT_FOUND
+        
+        allowed_role = ['USER', 'RIDER', 'ADMIN']
+        if role not in allowed_role:
+            return {
+                "status": False,
+                "message": f"This role {role} is not allowed",
+                "data": None
+            }, status.HTTP_404_NOT_FOUND
+
+    return None
+
+
 class RiderProfileViewSet(viewsets.ModelViewSet):
     queryset = RiderProfile.objects.all()
     serializer_class = RiderProfileSerializer
+    keyset = KeysetPaginator("created_at", {"role": ("role", str)})
     
     # For create any User, Rider, Admin
     def create(self, request, *args, **kwargs):
-        data = request.data
-        # Check Email
-        email = data.get("email")
-        if not email:
-            return Response({
-            "success": False,
-            "message": "Email is required",
-            "data": None
-        }, status=status.HTTP_400_BAD_REQUEST)
-
-        elif RiderProfile.objects.filter(email=email).exists():
-            return Response({
-            "success": False,
-            "message": "Email already exist.",
-            "data": None
-        }, status=status.HTTP_400_BAD_REQUEST)
-
-        # Check Phone
-        phone = data.get("phone")
-        if not phone:
-            return Response({
-            "success": False,
-            "message": "Phone is required",
-            "data": None
-        }, status=status.HTTP_400_BAD_REQUEST)
-
-        else:
-            digits = "".join(filter(str.isdigit, phone))
-            if len(digits) < 10:
-                return Response({
-                    "success": False,
-                    "message": "Phone number must be 10 digits",
-                    "data": None
-                }, status=status.HTTP_400_BAD_REQUEST)
-            elif RiderProfile.objects.filter(phone=digits).exists():
-                return Response({
-                    "success": False,
-                    "message": "Phone number already exist.",
-                    "data": None
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Check Role
-            role = data.get("role")
-            if not role:
-                return Response({
-                    "status": False,
-                    "message": "Role is required",
-                    "data": None
-                }, status=status.HTTP_404_NOT_FOUND)
-            
-            allowed_role = ['USER', 'RIDER', 'ADMIN']
-            if role not in allowed_role:
-                return Response({
-                    "status": False,
-                    "message": f"This role {role} is not allowed",
-                    "data": None
-                }, status=status.HTTP_404_NOT_FOUND)
-
+        error = signup_error(request.data)
+        if error is not None:
+            body, http_status = error
+            return Response(body, status=http_status)
+        role = request.data.get("role")
 
         serializer = RiderProfileSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                serializer.save()
+            except HashingBusy:
+                return hashing_busy()
             return Response({
                 "status": True,
                 "message": f"{role.capitalize()} created successfully",
@@ -106,13 +135,7 @@ class RiderProfileViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        rider = self.get_queryset()
-        serializer = RiderProfileSerializer(rider, many=True)
-        return Response({
-            "status": True,
-            "message": "List of users",
-            "data": serializer.data
-        }, status=status.HTTP_200_OK)
+        return paginated_response(request, self.get_queryset(), self.keyset, RiderProfileSerializer, "List of users")
     
     def retrieve(self, request, pk=None):
         user = request.user
@@ -188,7 +211,11 @@ class RiderProfileViewSet(viewsets.ModelViewSet):
                     "data": RiderProfileSerializer(rider).data
                 }, status=status.HTTP_200_OK)
 
-            serializer.save()
+            try:
+                serializer.save()
+            except HashingBusy:
+                return hashing_busy()
+            index_rider(rider)
             return Response({
                 "status": True,
                 "message": "User updated successfully",
@@ -227,7 +254,9 @@ class RiderProfileViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
         
+        rider_id = rider.id
         rider.delete()
+        available_riders.remove(rider_id)
         return Response({
             "success": True,
             "message": "User deleted successfully",
@@ -239,24 +268,28 @@ class RiderProfileViewSet(viewsets.ModelViewSet):
 #                               Login                                     #
 ###########################################################################
 
+# LoginSerializer errors as one sentence per field.
+def login_error_message(serializer_errors):
+    error_messages = []
+    for field, errors in serializer_errors.items():
+        for error in errors:
+            text = str(error).lower()
+            if "required" in text:
+                error_messages.append(f"{field.replace('_',' ').title()} is required.")
+            elif "blank" in text:
+                error_messages.append(f"{field.replace('_',' ').title()} cannot be empty.")
+            else:
+                error_messages.append(str(error))
+    return " ".join(error_messages)
+
+
 class LoginViewSet(APIView):
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         if not serializer.is_valid():
-            error_messages = []
-            for field, errors in serializer.errors.items():
-                for error in errors:
-                    text = str(error).lower()
-                    if "required" in text:
-                        error_messages.append(f"{field.replace('_',' ').title()} is required.")
-                    elif "blank" in text:
-                        error_messages.append(f"{field.replace('_',' ').title()} cannot be empty.")
-                    else:
-                        error_messages.append(str(error))
-
             return Response({
                 "status": False,
-                "message": " ".join(error_messages),
+                "message": login_error_message(serializer.errors),
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
             
@@ -272,14 +305,23 @@ class LoginViewSet(APIView):
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        if not check_password(password, rider.password):
+        try:
+            matches, upgraded = password_hasher.verify(password, rider.password)
+        except HashingBusy:
+            return hashing_busy()
+
+        if not matches:
             return Response({
                 "status": False,
                 "message": "Invalid Password",
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Stored with an outdated hasher: keep the new hash.
+        if upgraded:
+            RiderProfile.objects.filter(pk=rider.pk).update(password=upgraded)
             
-        refresh = RefreshToken.for_user(rider)
+        refresh = principal_token(rider)
 
         return Response({
             "status": True,
@@ -303,6 +345,7 @@ class LoginViewSet(APIView):
 class VehicleViewSet(viewsets.ModelViewSet):
     queryset = Vehicle.objects.all()
     serializer_class = VehicleSerializer
+    keyset = KeysetPaginator(filters={"rider": ("rider_id", int)})
 
     def create(self, request):
         data = request.data
@@ -349,7 +392,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        if Vehicle.objects.filter(rider=user).exists():
+        if Vehicle.objects.filter(rider_id=user.id).exists():
             return Response({
                 "status": False,
                 "message": "Vehicle already exists for this rider",
@@ -366,7 +409,8 @@ class VehicleViewSet(viewsets.ModelViewSet):
 
         serializer = VehicleSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(rider=request.user)
+            serializer.save(rider_id=user.id)
+            index_rider(user.profile)
             return Response({
                 "status": True,
                 "message": "Vehicle created successfully",
@@ -394,13 +438,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_401_UNAUTHORIZED)   
         
-        vehicle = self.get_queryset()
-        serializer = VehicleSerializer(vehicle, many=True)
-        return Response({
-            "status": True,
-            "message": "List of vehicles",
-            "data": serializer.data
-        }, status=status.HTTP_200_OK)
+        return paginated_response(request, self.get_queryset(), self.keyset, VehicleSerializer, "List of vehicles")
     
     def retrieve(self, request, pk=None):
         user = request.user
@@ -427,7 +465,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
         
-        if user.role == "RIDER" and vehicle.rider != user:
+        if user.role == "RIDER" and vehicle.rider_id != user.id:
             return Response({
                 "status": False,
                 "message": "You are not allowed to access this vehicle.",
@@ -497,7 +535,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_404_NOT_FOUND)
         
         
-        if user.role == "RIDER" and vehicle.rider != user:
+        if user.role == "RIDER" and vehicle.rider_id != user.id:
             return Response({
                 "status": False,
                 "message": "You are not allowed to update this vehicle.",
@@ -530,6 +568,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_200_OK)
 
             serializer.save()
+            index_rider(vehicle.rider)
             return Response({
                 "status": True,
                 "message": "Vehicle updated successfully",
@@ -567,14 +606,16 @@ class VehicleViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
         
-        if user.role == "RIDER" and vehicle.rider != user:
+        if user.role == "RIDER" and vehicle.rider_id != user.id:
             return Response({
                 "status": False,
                 "message": "You are not allowed to delete this vehicle.",
                 "data": None
             }, status=403)
 
+        rider_id = vehicle.rider_id
         vehicle.delete()
+        index_rider(RiderProfile.objects.get(pk=rider_id))
         return Response({
             "status": True,
             "message": "Vehicle deleted successfully",
@@ -589,6 +630,35 @@ class VehicleViewSet(viewsets.ModelViewSet):
 class RideViewSet(viewsets.ModelViewSet):
     queryset = Ride.objects.all()
     serializer_class = RideSerializer
+    keyset = KeysetPaginator("requested_at", {
+        "status": ("status", str),
+        "rider": ("rider_id", int),
+        "user": ("user_id", int),
+    })
+
+    # Admins list every ride, riders and users only their own.
+    def list(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return Response({
+                "status": False,
+                "message": "Authentication credentials were not provided.",
+                "data": None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        rides = self.get_queryset()
+        if user.role == "RIDER":
+            rides = rides.filter(rider_id=user.id)
+        elif user.role == "USER":
+            rides = rides.filter(user_id=user.id)
+        elif user.role != "ADMIN":
+            return Response({
+                "status": False,
+                "message": "You do not have permission",
+                "data": None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        return paginated_response(request, rides, self.keyset, RideSerializer, "List of rides")
 
     def create(self, request):
         data = request.data
@@ -653,7 +723,10 @@ class RideViewSet(viewsets.ModelViewSet):
 
         serializer = RideSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user=user, user_name=user.name, user_phone=user.phone)
+            profile = user.profile
+            serializer.save(user=profile, user_name=profile.name, user_phone=profile.phone)
+            index_ride(serializer.instance)
+            ride_timeouts.schedule_ride(serializer.instance)
 
             # broadcast_new_ride()
 
@@ -696,7 +769,7 @@ class RideViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_404_NOT_FOUND)
         
         if user.role == "USER":
-            if ride.user_phone != user.phone:
+            if ride.user_id != user.id:
                 return Response({
                     "status": False,
                     "message": "You are not allowed to update this ride.",
@@ -718,8 +791,9 @@ class RideViewSet(viewsets.ModelViewSet):
         serializer = RideSerializer(ride, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            index_ride(ride)
             
-            broadcast_new_ride()
+            broadcast_scheduler.request(ride=ride)
 
             return Response({
                 "status": True,
@@ -760,7 +834,7 @@ class RideViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_404_NOT_FOUND)
         
         if user.role == "USER":
-            if ride.user_phone != user.phone:
+            if ride.user_id != user.id:
                 return Response({
                     "status": False,
                     "message": "You are not allowed to delete this ride.",
@@ -769,7 +843,8 @@ class RideViewSet(viewsets.ModelViewSet):
 
         ride_id = ride.id
         ride.delete()
-        broadcast_new_ride()
+        open_rides.remove(ride_id)
+        ride_timeouts.cancel(ride_id)
         return Response({
             "status": True,
             "message": "Ride deleted successfully",
@@ -782,7 +857,6 @@ class RideViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def accept(self, request, pk=None):
         user = request.user
-        ride = Ride.objects.get(pk=pk)
         if not user.is_authenticated:
             return Response({
                 "status": False,
@@ -797,19 +871,12 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_401_UNAUTHORIZED)
 
-        if not Vehicle.objects.filter(rider=user).exists():
+        if not user.has_vehicle:
             return Response({
                 "status": False,
                 "message": "You must have a registered vehicle to accept rides.",
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if not Vehicle.objects.filter(rider=user, vehicle_type=ride.vehicle_type).exists():
-            return Response({
-                "status": False,
-                "message": f"You do not have {ride.vehicle_type} to accept this ride.",
-                "data": None
-            }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             ride = Ride.objects.get(pk=pk)
@@ -820,25 +887,33 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
 
-        if ride.status != 'requested':
+        if user.vehicle_type != ride.vehicle_type:
+            return Response({
+                "status": False,
+                "message": f"You do not have {ride.vehicle_type} to accept this ride.",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not transition(ride.id, 'accepted', rider_id=user.id):
+            ride.refresh_from_db(fields=['status'])
             return Response({
                 "status": False,
                 "message": f"Cannot accept ride with status '{ride.status}'",
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        ride.rider = user
+        ride.rider_id = user.id
         ride.status = 'accepted'
-        ride.save()
+        index_ride(ride)
+        batch_dispatcher.discard(ride.id)
+        ride_timeouts.cancel(ride.id)
 
         # Update rider availability
-        rider_profile = RiderProfile.objects.get(pk=user.pk)
-        rider_profile.is_available = False
-        rider_profile.save()
+        RiderProfile.objects.filter(pk=user.pk).update(is_available=False)
+        available_riders.remove(user.pk)
 
         # Broadcast updated list to WebSocket
-        broadcast_available_riders()
-        broadcast_new_ride()
+        broadcast_scheduler.request(availability=True)
 
         return Response({
             "status": True,
@@ -849,7 +924,6 @@ class RideViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def pickup(self, request, pk=None):
         user = request.user
-        ride = Ride.objects.get(pk=pk)
         if not user.is_authenticated:
             return Response({
                 "status": False,
@@ -864,20 +938,13 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not Vehicle.objects.filter(rider=user).exists():
+        if not user.has_vehicle:
             return Response({
                 "status": False,
                 "message": "You must have a registered vehicle to complete rides.",
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        if not Vehicle.objects.filter(rider=user, vehicle_type=ride.vehicle_type).exists():
-            return Response({
-                "status": False,
-                "message": f"You do not have {ride.vehicle_type} to pick up this ride.",
-                "data": None
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
         try:
             ride = Ride.objects.get(pk=pk)
         except Ride.DoesNotExist:
@@ -887,15 +954,28 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None                
             }, status=status.HTTP_404_NOT_FOUND)
         
-        if ride.status != 'accepted':
+        if user.vehicle_type != ride.vehicle_type:
+            return Response({
+                "status": False,
+                "message": f"You do not have {ride.vehicle_type} to pick up this ride.",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not transition(ride.id, 'picked_up', where={'rider_id': user.id}):
+            ride.refresh_from_db(fields=['status', 'rider'])
+            if ride.rider_id != user.id:
+                return Response({
+                    "status": False,
+                    "message": "Ride not found or not assigned to you",
+                    "data": None
+                }, status=status.HTTP_404_NOT_FOUND)
             return Response({
                 "status": False,
                 "message": f"Cannot pick up ride with status '{ride.status}'",
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        ride.status = 'picked up'
-        ride.save()
+        ride.status = 'picked_up'
 
         return Response({
             "status": True,
@@ -932,14 +1012,14 @@ class RideViewSet(viewsets.ModelViewSet):
              }, status=status.HTTP_400_BAD_REQUEST)
         
         if user.role == "RIDER":
-            if not Vehicle.objects.filter(rider=user).exists():
+            if not user.has_vehicle:
                 return Response({
                     "status": False,
                     "message": "You must have a registered vehicle to decline rides.",
                     "data": None
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            if not ride.rider or ride.rider != user:
+            if ride.rider_id != user.id:
                 return Response({
                     "status": False,
                     "message": "Ride not assigned to you.",
@@ -947,7 +1027,7 @@ class RideViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_403_FORBIDDEN)
             
         elif user.role == "USER":
-            if ride.user_name != user.name:
+            if ride.user_id != user.id:
                 return Response({
                     "status": False,
                     "message": "You are not allowed to decline this ride.",
@@ -964,15 +1044,28 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_403_FORBIDDEN)
         
+        # Only from the status and rider checked above, so the rider side
+        # effects below match what was declined.
+        where = {'rider_id': ride.rider_id} if ride.status == 'accepted' else None
+        if not transition(ride.id, 'declined', expected=[ride.status], where=where):
+            ride.refresh_from_db(fields=['status'])
+            return Response({
+                "status": False,
+                "message": f"Cannot decline ride with status '{ride.status}'",
+                "data": None
+             }, status=status.HTTP_400_BAD_REQUEST)
+
         if ride.status == 'accepted' and ride.rider:
             ride.rider.is_available = True
             ride.rider.save(update_fields=['is_available'])
+            index_rider(ride.rider)
 
         ride.status = 'declined'
-        ride.save()
+        index_ride(ride)
+        batch_dispatcher.discard(ride.id)
+        ride_timeouts.cancel(ride.id)
 
-        broadcast_available_riders()
-        broadcast_new_ride()
+        broadcast_scheduler.request(availability=True)
         
         return Response({
             "status": True,
@@ -997,7 +1090,7 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not Vehicle.objects.filter(rider=user).exists():
+        if not user.has_vehicle:
             return Response({
                 "status": False,
                 "message": "You must have a registered vehicle to complete rides.",
@@ -1005,7 +1098,7 @@ class RideViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            ride = Ride.objects.get(pk=pk, rider=user)
+            ride = Ride.objects.get(pk=pk, rider_id=user.id)
         except Ride.DoesNotExist:
             return Response({
                 "status": False,
@@ -1013,7 +1106,8 @@ class RideViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
 
-        if ride.status != 'accepted':
+        if not transition(ride.id, 'completed', where={'rider_id': user.id}):
+            ride.refresh_from_db(fields=['status'])
             return Response({
                 "status": False,
                 "message": f"Cannot complete ride with status '{ride.status}'",
@@ -1021,15 +1115,15 @@ class RideViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         ride.status = 'completed'
-        ride.save()
+        index_ride(ride)
 
         # Make rider available again
-        rider_profile = RiderProfile.objects.get(pk=user.pk)
+        rider_profile = user.profile
         rider_profile.is_available = True
-        rider_profile.save()
+        rider_profile.save(update_fields=['is_available'])
+        index_rider(rider_profile)
 
-        broadcast_available_riders()
-        broadcast_new_ride()
+        broadcast_scheduler.request(availability=True)
 
         return Response({
             "status": True,
@@ -1045,6 +1139,33 @@ class RideViewSet(viewsets.ModelViewSet):
 class RiderPaymentViewSet(viewsets.ModelViewSet):
     queryset = RiderPayment.objects.all()
     serializer_class = RiderPaymentSerializer
+    keyset = KeysetPaginator("created_at", {
+        "rider": ("rider_id", int),
+        "paid": ("paid", lambda value: {"true": True, "false": False}[value.lower()]),
+    })
+
+    # Admins list every payment, riders only their own.
+    def list(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return Response({
+                "status": False,
+                "message": "Authentication credentials were not provided.",
+                "data": None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        if user.role not in ["RIDER", "ADMIN"]:
+            return Response({
+                "status": False,
+                "message": "You do not have permission",
+                "data": None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        payments = self.get_queryset()
+        if user.role == "RIDER":
+            payments = payments.filter(rider_id=user.id)
+
+        return paginated_response(request, payments, self.keyset, RiderPaymentSerializer, "List of payments")
 
     # Create a payment for a ride
     @action(detail=True, methods=['post'])
@@ -1068,7 +1189,7 @@ class RiderPaymentViewSet(viewsets.ModelViewSet):
             if user.role == "ADMIN":
                 ride = Ride.objects.get(pk=pk)
             else:
-                ride = Ride.objects.get(pk=pk, rider=user)
+                ride = Ride.objects.get(pk=pk, rider_id=user.id)
         except Ride.DoesNotExist:
             return Response({
                 "status": False,
@@ -1091,7 +1212,7 @@ class RiderPaymentViewSet(viewsets.ModelViewSet):
 
         payment = RiderPayment.objects.create(
             ride=ride,
-            rider=user,
+            rider_id=user.id,
             amount=ride.charges
         )
 
@@ -1122,7 +1243,7 @@ class RiderPaymentViewSet(viewsets.ModelViewSet):
             if user.role == "ADMIN":
                 ride = Ride.objects.get(pk=pk)
             else:
-                ride = Ride.objects.get(pk=pk, rider=user)
+                ride = Ride.objects.get(pk=pk, rider_id=user.id)
 
             payment = RiderPayment.objects.get(ride=ride)
         except (Ride.DoesNotExist, RiderPayment.DoesNotExist):
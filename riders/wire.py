@@ -0,0 +1,102 @@
+import struct
+import time
+
+###########################################################################
+#                       Location Wire Format Module                       #
+###########################################################################
+
+# Binary format for the live location socket, used when the client asks for
+# the SUBPROTOCOL WebSocket sub-protocol at connect. Every binary message
+# carries one or more little-endian records back to back:
+#
+#   absolute  <BiiQ  type=1, latitude and longitude in micro-degrees,
+#                    timestamp in unix milliseconds            (17 bytes)
+#   delta     <BhhH  type=2, latitude, longitude and timestamp as
+#                    differences from the previous record       (7 bytes)
+#
+# A delta is only valid after an absolute record on the same connection and
+# direction; encoders fall back to an absolute record whenever a difference
+# does not fit. Control messages (e.g. the trail catch-up) stay JSON text.
+
+SUBPROTOCOL = "ridebooking.location.v1"
+
+ABSOLUTE = 1
+DELTA = 2
+
+ABSOLUTE_FRAME = struct.Struct("<BiiQ")
+DELTA_FRAME = struct.Struct("<BhhH")
+
+MICRODEGREES = 1000000
+
+
+class WireError(ValueError):
+    pass
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def to_microdegrees(value):
+    return round(float(value) * MICRODEGREES)
+
+
+# Per connection and direction: remembers the last point written so the next
+# one can go out as a delta.
+class LocationEncoder:
+    def __init__(self):
+        self.last = None
+
+    def encode(self, lat, lng, timestamp_ms=None):
+        point = (
+            to_microdegrees(lat),
+            to_microdegrees(lng),
+            now_ms() if timestamp_ms is None else int(timestamp_ms)
+        )
+
+        if self.last is not None:
+            dlat = point[0] - self.last[0]
+            dlng = point[1] - self.last[1]
+            dt = point[2] - self.last[2]
+            if -32768 <= dlat <= 32767 and -32768 <= dlng <= 32767 and 0 <= dt <= 65535:
+                self.last = point
+                return DELTA_FRAME.pack(DELTA, dlat, dlng, dt)
+
+        self.last = point
+        return ABSOLUTE_FRAME.pack(ABSOLUTE, *point)
+
+
+class LocationDecoder:
+    def __init__(self):
+        self.last = None
+
+    # Returns [(lat, lng, timestamp_ms), ...]; raises WireError on a
+    # truncated record, an unknown record type or a delta without a
+    # preceding absolute record.
+    def decode(self, data):
+        points = []
+        offset = 0
+        while offset < len(data):
+            frame_type = data[offset]
+            if frame_type == ABSOLUTE:
+                frame = ABSOLUTE_FRAME
+            elif frame_type == DELTA:
+                frame = DELTA_FRAME
+            else:
+                raise WireError(f"Unknown record type {frame_type}")
+
+            if offset + frame.size > len(data):
+                raise WireError("Truncated record")
+            _, lat, lng, timestamp = frame.unpack_from(data, offset)
+            offset += frame.size
+
+            if frame_type == DELTA:
+                if self.last is None:
+                    raise WireError("Delta record without an absolute record")
+                lat += self.last[0]
+                lng += self.last[1]
+                timestamp += self.last[2]
+
+            self.last = (lat, lng, timestamp)
+            points.append((lat / MICRODEGREES, lng / MICRODEGREES, timestamp))
+        return points